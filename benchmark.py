@@ -0,0 +1,602 @@
+"""
+benchmark.py
+
+Times the hot paths of the scene: tessellation, transform composition,
+scene files, texture loading and whole frames rendered offscreen.
+Tessellation, transforms and scene files need no OpenGL context; texture
+loading and frames use a headless context (see headless.py) and are skipped
+if one cannot be created.
+
+Results can be saved as JSON and compared against a stored baseline. The run
+fails if any benchmark is slower than its baseline by more than a threshold,
+or if composing transforms one object at a time is slower than the 4x4
+matrix products it replaced, which are timed in every run.
+
+    python benchmark.py [--output results.json] [--baseline PATH]
+                        [--update-baseline] [--threshold 0.15]
+"""
+
+# Must be imported before OpenGL so the offscreen platform is selected
+import headless
+
+import glob
+import json
+import math
+import os
+import sys
+import tempfile
+import time
+import timeit
+import numpy as np
+from OpenGL.GL import *
+from object import SceneObject
+from stone import Stone
+from boulder import Boulder, UV_SPHERE, ICOSPHERE
+from ground import Ground
+from instancing import build_batches
+from transform_store import transform_store
+from texture_loader import texture_loader
+from scene_file import SceneFile
+from henge import generate_henges
+
+STONE_DIVISIONS = [10, 25, 50, 100, 200, 300, 400, 500]
+UV_SPHERE_DIVISIONS = [8, 12, 16, 20, 32, 64, 128]
+ICOSPHERE_DIVISIONS = [0, 1, 2, 3, 4, 5, 6]
+GROUND_DIVISIONS = [10, 25, 50, 100, 200]
+TRANSFORM_COUNTS = [100, 1000, 10000]
+SCENE_COPIES = [1, 2, 4, 8]
+
+# Henge fields of 40 stones and 20 boulders per henge, up to 100,000 objects
+HENGE_COUNTS = [10, 100, 1000]
+HENGE_STONES = 40
+HENGE_BOULDERS = 20
+REPEATS = 5
+
+# Frames rendered before and while timing each scene size
+WARMUP_FRAMES = 3
+TIMED_FRAMES = 20
+FRAME_SIZE = 512
+
+BASELINE_PATH = "benchmark_baseline.json"
+DEFAULT_THRESHOLD = 0.15
+
+
+def benchmark_stone_tessellation(divisions_list=STONE_DIVISIONS,
+                                 repeats=REPEATS):
+    """
+    Times Stone.tessellate across a range of subdivision counts.
+
+    :param divisions_list: The subdivision counts to be timed
+    :param repeats: The number of timed runs per subdivision count
+
+    :return: A list of (divisions, vertices, triangles, seconds) tuples, where
+             seconds is the best time of all runs
+    """
+    # The constructor buffers data to the GPU, so it is bypassed here
+    stone = Stone.__new__(Stone)
+    results = []
+
+    for divisions in divisions_list:
+        timer = timeit.Timer(lambda: stone.tessellate(divisions))
+        seconds = min(timer.repeat(repeat=repeats, number=1))
+        results.append((divisions, len(stone.vertices) // 3,
+                        len(stone.elements) // 3, seconds))
+
+    return results
+
+
+def benchmark_boulder_tessellation(topology, divisions_list, repeats=REPEATS):
+    """
+    Times Boulder.tessellate for a sphere topology across a range of
+    subdivision levels.
+
+    :param topology: Either UV_SPHERE or ICOSPHERE
+    :param divisions_list: The subdivision levels to be timed
+    :param repeats: The number of timed runs per subdivision level
+
+    :return: A list of (divisions, vertices, triangles, seconds) tuples, where
+             seconds is the best time of all runs
+    """
+    # The constructor buffers data to the GPU, so it is bypassed here
+    boulder = Boulder.__new__(Boulder)
+    results = []
+
+    for divisions in divisions_list:
+        timer = timeit.Timer(lambda: boulder.tessellate(divisions, topology))
+        seconds = min(timer.repeat(repeat=repeats, number=1))
+        results.append((divisions, len(boulder.vertices) // 3,
+                        len(boulder.elements) // 3, seconds))
+
+    return results
+
+
+def benchmark_ground_tessellation(divisions_list=GROUND_DIVISIONS,
+                                  repeats=REPEATS):
+    """
+    Times Ground.tessellate across a range of subdivision counts.
+
+    :param divisions_list: The subdivision counts to be timed
+    :param repeats: The number of timed runs per subdivision count
+
+    :return: A list of (divisions, vertices, triangles, seconds) tuples, where
+             seconds is the best time of all runs
+    """
+    # The constructor buffers data to the GPU, so it is bypassed here
+    ground = Ground.__new__(Ground)
+    results = []
+
+    for divisions in divisions_list:
+        timer = timeit.Timer(lambda: ground.tessellate(divisions, 3))
+        seconds = min(timer.repeat(repeat=repeats, number=1))
+        results.append((divisions, len(ground.vertices) // 3,
+                        len(ground.elements) // 3, seconds))
+
+    return results
+
+
+def reference_compose(transforms, x, y, z):
+    """
+    Composes a scale, rotation about the vertical axis and translation on
+    each of a list of 4x4 matrices one at a time, with the float32 matrix
+    products SceneObject used before transforms were kept in the transform
+    store. Timed as the reference per-object composition must not fall
+    behind.
+
+    :param transforms: A list of 4x4 float32 model matrices, replaced in place
+    :param x: The scale value
+    :param y: The rotation angle (in degrees) about the vertical axis
+    :param z: The translation value along x and z
+    """
+    for index, transform in enumerate(transforms):
+        scale_mat = np.array([[x, 0.0, 0.0, 0.0],
+                              [0.0, x, 0.0, 0.0],
+                              [0.0, 0.0, x, 0.0],
+                              [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
+        transform = scale_mat @ transform
+
+        angle = math.radians(y)
+        cos_y, sin_y = math.cos(angle), math.sin(angle)
+        x_mat = np.identity(4, dtype=np.float32)
+        y_mat = np.array([[cos_y, 0.0, sin_y, 0.0],
+                          [0.0, 1.0, 0.0, 0.0],
+                          [-sin_y, 0.0, cos_y, 0.0],
+                          [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
+        z_mat = np.identity(4, dtype=np.float32)
+        transform = x_mat @ z_mat @ y_mat @ transform
+
+        translate_mat = np.array([[1.0, 0.0, 0.0, z],
+                                  [0.0, 1.0, 0.0, 0.0],
+                                  [0.0, 0.0, 1.0, z],
+                                  [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
+        transforms[index] = translate_mat @ transform
+
+
+def benchmark_transforms(counts=TRANSFORM_COUNTS, repeats=REPEATS):
+    """
+    Times composing a scale, rotation and translation on each of a number of
+    objects one at a time through SceneObject, the same composition with
+    the 4x4 matrix products it replaced, and then rebuilding all of the
+    objects' model matrices.
+
+    :param counts: The numbers of objects to be timed
+    :param repeats: The number of timed runs per object count
+
+    :return: A list of (objects, compose seconds, reference seconds, matrices
+             seconds) tuples, where each time is the best of all runs
+    """
+    results = []
+
+    for count in counts:
+        # Objects only need a transform, not a mesh
+        objects = []
+        for index in range(count):
+            obj = SceneObject.__new__(SceneObject)
+            SceneObject.__init__(obj)
+            objects.append(obj)
+        indices = [obj.index for obj in objects]
+        transforms = [np.identity(4, dtype=np.float32) for index in range(count)]
+
+        def compose():
+            for obj in objects:
+                obj.scale(1.001, 1.001, 1.001)
+                obj.rotate(0.0, 1.0, 0.0)
+                obj.translate(0.01, 0.0, 0.01)
+
+        def reference():
+            reference_compose(transforms, 1.001, 1.0, 0.01)
+
+        def matrices():
+            transform_store.dirty = True
+            transform_store.matrices(indices)
+
+        compose_seconds = min(timeit.Timer(compose).repeat(repeat=repeats, number=1))
+        reference_seconds = min(timeit.Timer(reference).repeat(repeat=repeats,
+                                                               number=1))
+        matrices_seconds = min(timeit.Timer(matrices).repeat(repeat=repeats, number=1))
+        results.append((count, compose_seconds, reference_seconds,
+                        matrices_seconds))
+
+        # Leave no transforms behind to slow down later benchmarks
+        transform_store.clear()
+
+    return results
+
+
+def compare_reference(times, threshold):
+    """
+    Compares the per-object transform composition against the 4x4 matrix
+    products it replaced, timed in the same run, so a slowdown is caught
+    even without a stored baseline.
+
+    :param times: A dictionary mapping benchmark names to times in seconds
+    :param threshold: The fraction by which the composition may be slower
+                      than the reference before it counts as a regression
+
+    :return: A list of (name, reference seconds, seconds) tuples of the
+             object counts that regressed
+    """
+    regressions = []
+    for name, seconds in sorted(times.items()):
+        if not name.startswith('transforms.compose.'):
+            continue
+        reference = times.get(name.replace('.compose.', '.reference.'))
+        if reference is not None and seconds > reference * (1.0 + threshold):
+            regressions.append((name, reference, seconds))
+    return regressions
+
+
+def benchmark_scene_files(henge_counts=HENGE_COUNTS, repeats=REPEATS):
+    """
+    Times generating fields of henges and saving and loading them as scene
+    files.
+
+    :param henge_counts: The numbers of henges in the fields to be timed
+    :param repeats: The number of timed runs per field
+
+    :return: A list of (objects, generate seconds, save seconds, load
+             seconds) tuples, where each time is the best of all runs
+    """
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'henges.json')
+        for count in henge_counts:
+            def generate():
+                return generate_henges(count, HENGE_STONES, HENGE_BOULDERS)
+
+            field = generate()
+            generate_seconds = min(timeit.Timer(generate).repeat(
+                repeat=repeats, number=1))
+            save_seconds = min(timeit.Timer(lambda: field.save(path)).repeat(
+                repeat=repeats, number=1))
+            load_seconds = min(timeit.Timer(lambda: SceneFile.load(path))
+                               .repeat(repeat=repeats, number=1))
+            results.append((len(field), generate_seconds, save_seconds,
+                            load_seconds))
+
+    return results
+
+
+def time_texture_load(obj, path):
+    """
+    Loads a texture through SceneObject.load_texture and waits until it has
+    been uploaded, then deletes it again.
+
+    :param obj: The SceneObject loading the texture
+    :param path: The path of the image file
+
+    :return: A (seconds, width, height) tuple, or None if the image could not
+             be loaded
+    """
+    obj.texture = 0
+    start = time.perf_counter()
+    obj.load_texture(os.fsencode(path))
+    texture_loader.finish()
+    glFinish()
+    seconds = time.perf_counter() - start
+
+    if obj.texture == 0:
+        return None
+    glBindTexture(GL_TEXTURE_2D, obj.texture)
+    width = glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_WIDTH)
+    height = glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_HEIGHT)
+    glBindTexture(GL_TEXTURE_2D, 0)
+    texture_loader.delete(obj.texture)
+    return seconds, width, height
+
+
+def benchmark_texture_loading(paths=None, repeats=REPEATS):
+    """
+    Times SceneObject.load_texture for each shipped texture, cold and warm.
+    Cold loads decode the image, build its mip chain and write it to an
+    empty texture cache; warm loads read the mip chain back from the cache.
+    Both include the upload to the GPU. Needs a current OpenGL context.
+
+    :param paths: The image files to be loaded, or None for every JPEG in the
+                  current directory
+    :param repeats: The number of timed loads per image, cold and warm
+
+    :return: A list of (file name, width, height, cold seconds, warm seconds)
+             tuples, where each time is the best of all runs
+    """
+    if paths is None:
+        paths = sorted(glob.glob('*.jpg'))
+
+    obj = SceneObject.__new__(SceneObject)
+    cache = texture_loader.cache
+    directory = cache.directory
+    results = []
+
+    try:
+        for path in paths:
+            # Every cold load gets a cache directory of its own, so the image
+            # is decoded each time
+            cold = []
+            for repeat in range(repeats):
+                with tempfile.TemporaryDirectory() as cache_directory:
+                    cache.directory = cache_directory
+                    loaded = time_texture_load(obj, path)
+                if loaded is None:
+                    break
+                cold.append(loaded[0])
+            if not cold:
+                continue
+
+            # The warm loads share one cache directory, filled by a first,
+            # untimed load
+            warm = []
+            with tempfile.TemporaryDirectory() as cache_directory:
+                cache.directory = cache_directory
+                time_texture_load(obj, path)
+                for repeat in range(repeats):
+                    seconds, width, height = time_texture_load(obj, path)
+                    warm.append(seconds)
+
+            results.append((os.path.basename(path), width, height, min(cold),
+                            min(warm)))
+    finally:
+        cache.directory = directory
+
+    return results
+
+
+def add_scene_copies(scene, copies):
+    """
+    Adds copies of the stones and boulders of a scene, each copy of the
+    whole arrangement rotated about the vertical axis, so the scene has a
+    multiple of its usual number of objects.
+
+    :param scene: The Scene to add objects to
+    :param copies: The number of copies of the arrangement to add
+    """
+    originals = scene.objects[1:]
+
+    for copy in range(1, copies + 1):
+        for original in originals:
+            obj = type(original)(original.shader_program)
+            for array in (transform_store.translation, transform_store.rotation,
+                          transform_store.scale_factors):
+                array[obj.index] = array[original.index]
+            obj.rotate(0.0, copy * 360.0 / (copies + 1), 0.0)
+            scene.objects.append(obj)
+
+    if scene.instanced:
+        scene.batches = build_batches(scene.objects[1:],
+                                      scene.instanced_shader_program)
+
+
+def benchmark_frames(copies_list=SCENE_COPIES, instanced=False,
+                     size=FRAME_SIZE):
+    """
+    Times whole frames of Scene.display in a headless context, at increasing
+    object counts. A new scene is built for each object count.
+
+    :param copies_list: The numbers of copies of the stones and boulders to
+                        add to the scene, 0 for the plain scene
+    :param instanced: Whether the scene draws with instancing
+    :param size: The width and height of the frames in pixels
+
+    :return: A list of (objects, seconds per frame) tuples
+    """
+    from scene import Scene
+
+    context = headless.HeadlessContext(size, size)
+    results = []
+
+    try:
+        for copies in [0] + list(copies_list):
+            # Drop the transforms of the previous scene
+            transform_store.clear()
+            scene = Scene(instanced)
+            add_scene_copies(scene, copies)
+
+            for frame in range(WARMUP_FRAMES):
+                context.render(scene)
+
+            start = time.perf_counter()
+            for frame in range(TIMED_FRAMES):
+                scene.rotate(1.0)
+                scene.display()
+            glFinish()
+            seconds = (time.perf_counter() - start) / TIMED_FRAMES
+
+            results.append((len(scene.objects), seconds))
+            scene.close()
+    finally:
+        context.close()
+
+    return results
+
+
+def print_results(title, results):
+    """
+    Prints the results of a tessellation benchmark as a table.
+
+    :param title: The heading for the table
+    :param results: A list of (divisions, vertices, triangles, seconds) tuples
+    """
+    print(title)
+    print('{:>10} {:>12} {:>12} {:>12}'.format('divisions', 'vertices',
+                                               'triangles', 'time (ms)'))
+    for divisions, vertices, triangles, seconds in results:
+        print('{:>10} {:>12} {:>12} {:>12.3f}'.format(divisions, vertices,
+                                                      triangles, seconds * 1000))
+
+
+def run_all(instanced=False):
+    """
+    Runs every benchmark, printing each table as it completes.
+
+    :param instanced: Whether the frame benchmark draws with instancing
+
+    :return: A dictionary mapping benchmark names to times in seconds
+    """
+    times = {}
+
+    tessellations = [
+        ('stone', 'Stone.tessellate', benchmark_stone_tessellation()),
+        ('boulder_uv', 'Boulder.tessellate (UV sphere)',
+         benchmark_boulder_tessellation(UV_SPHERE, UV_SPHERE_DIVISIONS)),
+        ('boulder_icosphere', 'Boulder.tessellate (icosphere)',
+         benchmark_boulder_tessellation(ICOSPHERE, ICOSPHERE_DIVISIONS)),
+        ('ground', 'Ground.tessellate', benchmark_ground_tessellation()),
+    ]
+    for key, title, results in tessellations:
+        print_results(title, results)
+        print()
+        for divisions, vertices, triangles, seconds in results:
+            times['tessellate.{}.{}'.format(key, divisions)] = seconds
+
+    print('SceneObject.scale/rotate/translate and TransformStore.matrices')
+    print('{:>10} {:>14} {:>14} {:>14} {:>14}'.format(
+        'objects', 'compose (ms)', '4x4 ref (ms)', 'matrices (ms)',
+        'objects/s'))
+    for count, compose_seconds, reference_seconds, matrices_seconds in \
+            benchmark_transforms():
+        print('{:>10} {:>14.3f} {:>14.3f} {:>14.3f} {:>14.0f}'.format(
+            count, compose_seconds * 1000, reference_seconds * 1000,
+            matrices_seconds * 1000, count / compose_seconds))
+        times['transforms.compose.{}'.format(count)] = compose_seconds
+        times['transforms.reference.{}'.format(count)] = reference_seconds
+        times['transforms.matrices.{}'.format(count)] = matrices_seconds
+    print()
+
+    print('generate_henges, SceneFile.save and SceneFile.load')
+    print('{:>10} {:>14} {:>14} {:>14}'.format('objects', 'generate (ms)',
+                                               'save (ms)', 'load (ms)'))
+    for count, generate_seconds, save_seconds, load_seconds in \
+            benchmark_scene_files():
+        print('{:>10} {:>14.3f} {:>14.3f} {:>14.3f}'.format(
+            count, generate_seconds * 1000, save_seconds * 1000,
+            load_seconds * 1000))
+        times['scene_file.generate.{}'.format(count)] = generate_seconds
+        times['scene_file.save.{}'.format(count)] = save_seconds
+        times['scene_file.load.{}'.format(count)] = load_seconds
+    print()
+
+    try:
+        context = headless.HeadlessContext(64, 64)
+    except Exception as context_ex:
+        print('Skipping texture and frame benchmarks, no headless context:',
+              context_ex)
+        return times
+
+    print('SceneObject.load_texture (cold: decoded, warm: from the cache)')
+    print('{:>28} {:>12} {:>12} {:>12}'.format('image', 'size', 'cold (ms)',
+                                               'warm (ms)'))
+    for name, width, height, cold_seconds, warm_seconds in \
+            benchmark_texture_loading():
+        print('{:>28} {:>12} {:>12.3f} {:>12.3f}'.format(
+            name, '{}x{}'.format(width, height), cold_seconds * 1000,
+            warm_seconds * 1000))
+        times['texture.cold.{}'.format(name)] = cold_seconds
+        times['texture.warm.{}'.format(name)] = warm_seconds
+    print()
+    context.close()
+
+    print('Scene.display ({}, {}x{})'.format(
+        'instanced' if instanced else 'not instanced', FRAME_SIZE, FRAME_SIZE))
+    print('{:>10} {:>12} {:>12}'.format('objects', 'frame (ms)', 'fps'))
+    for objects, seconds in benchmark_frames(instanced=instanced):
+        print('{:>10} {:>12.3f} {:>12.1f}'.format(objects, seconds * 1000,
+                                                  1.0 / seconds))
+        times['frame.{}.{}'.format('instanced' if instanced else 'plain',
+                                   objects)] = seconds
+    print()
+
+    return times
+
+
+def compare(times, baseline, threshold):
+    """
+    Compares benchmark times against a baseline.
+
+    :param times: A dictionary mapping benchmark names to times in seconds
+    :param baseline: A dictionary of baseline times in the same form
+    :param threshold: The fraction by which a time may exceed its baseline
+                      before it counts as a regression
+
+    :return: A list of (name, baseline seconds, seconds) tuples of the
+             benchmarks that regressed
+    """
+    regressions = []
+    for name, seconds in sorted(times.items()):
+        if name in baseline and seconds > baseline[name] * (1.0 + threshold):
+            regressions.append((name, baseline[name], seconds))
+    return regressions
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Time the hot paths of the '
+                                                 'scene.')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='the JSON file of baseline results to compare '
+                             'against, if it exists')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='the fraction a benchmark may be slower than its '
+                             'baseline before the run fails')
+    parser.add_argument('--instanced', action='store_true',
+                        help='draw the frame benchmark with instancing')
+    args = parser.parse_args()
+
+    times = run_all(args.instanced)
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(times, output_file, indent=2, sort_keys=True)
+
+    # The per-object composition is checked against the matrix products it
+    # replaced whether or not there is a baseline
+    reference_regressions = compare_reference(times, args.threshold)
+    for name, reference_seconds, seconds in reference_regressions:
+        print('REGRESSION {}: {:.3f} ms, slower than the 4x4 matrix products '
+              '({:.3f} ms)'.format(name, seconds * 1000,
+                                   reference_seconds * 1000))
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(times, baseline_file, indent=2, sort_keys=True)
+        print('Stored the results as the baseline in', args.baseline)
+
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        regressions = compare(times, baseline, args.threshold)
+        for name, baseline_seconds, seconds in regressions:
+            print('REGRESSION {}: {:.3f} ms -> {:.3f} ms ({:+.0%})'.format(
+                name, baseline_seconds * 1000, seconds * 1000,
+                seconds / baseline_seconds - 1.0))
+
+        if regressions:
+            sys.exit(1)
+        print('No regressions beyond {:.0%} of {}'.format(args.threshold,
+                                                          args.baseline))
+
+    if reference_regressions:
+        sys.exit(1)
@@ -9,64 +9,181 @@ import math
 from OpenGL.GL import *
 from object import SceneObject
 
+UV_SPHERE = 'uv'
+ICOSPHERE = 'icosphere'
+
+# Default subdivision level for each topology. Both give a similar silhouette
+# at the sizes boulders are drawn at, the icosphere with far fewer triangles.
+DIVISIONS = {UV_SPHERE: 20, ICOSPHERE: 2}
+
+# Subdivision levels of the coarser levels of detail for each topology. The
+# coarsest icosphere is the icosahedron itself, at 20 triangles.
+LOD_DIVISIONS = {UV_SPHERE: (12, 6), ICOSPHERE: (1, 0)}
+
+# Vertices of a regular icosahedron, built from three golden rectangles
+GOLDEN_RATIO = (1.0 + math.sqrt(5.0)) / 2.0
+ICOSAHEDRON_VERTICES = np.array([[-1, GOLDEN_RATIO, 0], [1, GOLDEN_RATIO, 0],
+                                 [-1, -GOLDEN_RATIO, 0], [1, -GOLDEN_RATIO, 0],
+                                 [0, -1, GOLDEN_RATIO], [0, 1, GOLDEN_RATIO],
+                                 [0, -1, -GOLDEN_RATIO], [0, 1, -GOLDEN_RATIO],
+                                 [GOLDEN_RATIO, 0, -1], [GOLDEN_RATIO, 0, 1],
+                                 [-GOLDEN_RATIO, 0, -1], [-GOLDEN_RATIO, 0, 1]],
+                                dtype=np.float64)
+ICOSAHEDRON_ELEMENTS = np.array([[0, 11, 5], [0, 5, 1], [0, 1, 7], [0, 7, 10],
+                                 [0, 10, 11], [1, 5, 9], [5, 11, 4],
+                                 [11, 10, 2], [10, 7, 6], [7, 1, 8], [3, 9, 4],
+                                 [3, 4, 2], [3, 2, 6], [3, 6, 8], [3, 8, 9],
+                                 [4, 9, 5], [2, 4, 11], [6, 2, 10], [8, 6, 7],
+                                 [9, 8, 1]], dtype=np.int64)
+
+
+def sphere_counts(topology, divisions):
+    """
+    Returns the number of vertices and triangles a boulder is tessellated
+    into for a given topology and subdivision level.
+
+    :param topology: Either UV_SPHERE or ICOSPHERE
+    :param divisions: The number of subdivisions for tessellation
+
+    :return: A (vertices, triangles) tuple
+    """
+    if topology == UV_SPHERE:
+        return divisions * (divisions - 1) + 2, 2 * divisions * (divisions - 1)
+    elif topology == ICOSPHERE:
+        return 10 * 4 ** divisions + 2, 20 * 4 ** divisions
+    raise ValueError('Unknown sphere topology: {}'.format(topology))
+
+
 class Boulder(SceneObject):
     """
     Class representing a boulder in the scene.
     """
 
-    def __init__(self, shader_program):
+    def __init__(self, shader_program, topology=ICOSPHERE):
         """
         Contructor. Tesselates the shape, sets normals and elements. Sets up
-        material properties. Buffers all the data to the GPU.
+        material properties. Buffers all the data to the GPU, unless a boulder
+        with the same topology already has. Coarser levels of detail are built
+        with fewer subdivisions.
 
-        :param shader_program: A unique ID for the shader_program to be used
-                               with this object
+        :param shader_program: The ShaderProgram to be used with this object
+        :param topology: The sphere topology, either UV_SPHERE or ICOSPHERE
         """
-        self.tessellate(20)
+        super().__init__()
+        self.load_lods(shader_program,
+                       [(divisions, topology) for divisions
+                        in (DIVISIONS[topology],) + LOD_DIVISIONS[topology]])
 
         self.k_ambient = np.array([0.3, 0.3, 0.21], dtype=np.float32)
         self.k_diffuse = np.array([0.4, 0.5, 0.35], dtype=np.float32)
         self.k_specular = np.array([0.3, 0.3, 0.3], dtype=np.float32)
         self.shininess = 7.0
 
-        self.set_buffers(shader_program)
-
-    def tessellate(self, divisions):
+    def tessellate(self, divisions, topology=ICOSPHERE):
         """
         Calculates the vertices, triangles and normals at the vertices of a
-        boulder object. A boulder is represented as a sphere.
+        boulder object. A boulder is represented as a unit sphere, so the
+        normal at each vertex is its position.
+
+        :param divisions: The number of subdivisions for tessellation. For a
+                          UV sphere this is the number of segments around and
+                          from pole to pole, for an icosphere the number of
+                          times the icosahedron is subdivided.
+        :param topology: The sphere topology, either UV_SPHERE or ICOSPHERE
+        """
+        if topology == UV_SPHERE:
+            vertices, elements = self.uv_sphere(divisions)
+        elif topology == ICOSPHERE:
+            vertices, elements = self.icosphere(divisions)
+        else:
+            raise ValueError('Unknown sphere topology: {}'.format(topology))
+
+        self.vertices = vertices.astype(np.float32).ravel()
+        self.normals = self.vertices.copy()
+        self.elements = elements.astype(np.uint32).ravel()
+
+    @staticmethod
+    def uv_sphere(divisions):
+        """
+        Generates a latitude/longitude sphere. Each pole is a single vertex
+        joined to the nearest ring by a triangle fan, and the last segment of
+        every ring is welded to the first, so no vertices are duplicated and
+        no triangles are degenerate.
 
-        :param divisions: The number of subdivisions for tessellation
+        :param divisions: The number of segments around and from pole to pole
+
+        :return: A (vertices, triangles) tuple of arrays
+        """
+        if divisions < 3:
+            raise ValueError('A UV sphere needs at least 3 divisions')
+
+        theta = np.radians(np.arange(divisions) * (360.0 / divisions))
+        phi = np.radians(np.arange(1, divisions) * (180.0 / divisions))
+        theta, phi = np.meshgrid(theta, phi, indexing='ij')
+
+        # Ring vertices are stored segment by segment, north to south
+        rings = np.stack([np.sin(theta) * np.sin(phi),
+                          np.cos(phi),
+                          np.cos(theta) * np.sin(phi)], axis=-1).reshape((-1, 3))
+        north, south = len(rings), len(rings) + 1
+        vertices = np.concatenate([rings, [[0.0, 1.0, 0.0], [0.0, -1.0, 0.0]]])
+
+        row = divisions - 1
+        segment = np.arange(divisions)[:, np.newaxis]
+        next_segment = (segment + 1) % divisions
+        band = np.arange(row - 1)[np.newaxis, :]
+
+        # Two triangles per quad between neighbouring rings
+        a = segment * row + band
+        b = segment * row + band + 1
+        c = next_segment * row + band + 1
+        d = next_segment * row + band
+        quads = np.stack([a, b, c, c, d, a], axis=-1).reshape((-1, 3))
+
+        # Triangle fans around the poles
+        top = np.concatenate([np.full_like(segment, north), segment * row,
+                              next_segment * row], axis=1)
+        bottom = np.concatenate([np.full_like(segment, south),
+                                 next_segment * row + row - 1,
+                                 segment * row + row - 1], axis=1)
+
+        return vertices, np.concatenate([top, quads, bottom])
+
+    @staticmethod
+    def icosphere(divisions):
         """
-        theta_step = 360 / divisions
-        phi_step = 180 / divisions
-        radius = 1.0
-
-        vertices = []
-        elements = []
-
-        # Calculate the vertices
-        for theta in np.arange(0, 360, theta_step):
-            for phi in np.arange(0, 180 + phi_step, phi_step):
-                v = [math.sin(math.radians(theta)) * math.sin(math.radians(phi)),
-                     math.cos(math.radians(phi)),
-                     math.cos(math.radians(theta)) * math.sin(math.radians(phi))]
-                vertices.append([radius * c for c in v])
-
-        num_vertices = len(vertices)
-
-        # Calculate the triangles
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append((i * (divisions + 1) + j) % num_vertices)
-                elements.append((i * (divisions + 1) + (j + 1)) % num_vertices)
-                elements.append(((i + 1) * (divisions + 1) + (j + 1)) % num_vertices)
-                elements.append(((i + 1) * (divisions + 1) + (j + 1)) % num_vertices)
-                elements.append(((i + 1) * (divisions + 1) + j) % num_vertices)
-                elements.append((i * (divisions + 1) + j) % num_vertices)
-
-        vertices = [x for vertex in vertices for x in vertex]
-
-        self.vertices = np.array(vertices, dtype=np.float32)
-        self.normals = np.array(vertices, dtype=np.float32)
-        self.elements = np.array(elements, dtype=np.uint16)
+        Generates a sphere by repeatedly splitting each triangle of an
+        icosahedron into four and projecting the new vertices onto the sphere.
+        Triangles are close to equilateral and evenly spread, so fewer are
+        needed than for a UV sphere of similar smoothness.
+
+        :param divisions: The number of times the icosahedron is subdivided
+
+        :return: A (vertices, triangles) tuple of arrays
+        """
+        vertices = ICOSAHEDRON_VERTICES / np.linalg.norm(ICOSAHEDRON_VERTICES,
+                                                         axis=1, keepdims=True)
+        triangles = ICOSAHEDRON_ELEMENTS
+
+        for _ in range(divisions):
+            # Every edge is shared by two triangles, so midpoints are
+            # deduplicated by their sorted endpoint pair
+            edges = np.sort(triangles[:, [[0, 1], [1, 2], [2, 0]]], axis=2)
+            unique_edges, edge_index = np.unique(edges.reshape((-1, 2)), axis=0,
+                                                 return_inverse=True)
+
+            midpoints = vertices[unique_edges].mean(axis=1)
+            midpoints /= np.linalg.norm(midpoints, axis=1, keepdims=True)
+
+            m = len(vertices) + edge_index.reshape((-1, 3))
+            v0, v1, v2 = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+            m01, m12, m20 = m[:, 0], m[:, 1], m[:, 2]
+
+            vertices = np.concatenate([vertices, midpoints])
+            triangles = np.stack([np.stack([v0, m01, m20], axis=1),
+                                  np.stack([v1, m12, m01], axis=1),
+                                  np.stack([v2, m20, m12], axis=1),
+                                  np.stack([m01, m12, m20], axis=1)],
+                                 axis=1).reshape((-1, 3))
+
+        return vertices, triangles
@@ -6,7 +6,6 @@ Contains the Camera class to manage the view and projection matrices.
 
 import math
 import numpy as np
-from OpenGL.GL import *
 
 class Camera(object):
     """
@@ -29,53 +28,85 @@ class Camera(object):
         self.lookat = np.array([*self.lookat], dtype=np.float32)
         self.up = np.array([*self.up], dtype=np.float32)
 
-    def setup(self, shader_program):
+    def view_matrix(self):
         """
-        Sends the view and projection matrices to a given shader program.
+        Calculates the view matrix from the eyepoint, lookat and up vectors.
 
-        :param shader_program: A unique ID representing the shader program
+        :return: The view matrix, flattened in column-major order
         """
-        self.setup_view(shader_program)
-        self.setup_projection(shader_program)
+        n = self.normalize(self.eyepoint - self.lookat)
+        u = self.normalize(np.cross(self.normalize(self.up), n))
+        v = self.normalize(np.cross(n, u))
+
+        return np.array([u[0], v[0], n[0], 0.0,
+                         u[1], v[1], n[1], 0.0,
+                         u[2], v[2], n[2], 0.0,
+                         -np.dot(u, self.eyepoint),
+                         -np.dot(v, self.eyepoint),
+                         -np.dot(n, self.eyepoint), 1.0],
+                        dtype=np.float32)
 
-    def setup_view(self, shader_program):
+    def projection_matrix(self):
         """
-        Calculates the view matrix and passes it to a given shader program.
+        Calculates the perspective projection matrix from the frustum
+        parameters.
 
-        :param shader_program: A unique ID representing the shader program
+        :return: The projection matrix, flattened in column-major order
         """
-        n = self.normalize(self.eyepoint - self.lookat)
-        u = self.normalize(np.cross(self.normalize(self.up), n))
-        v = self.normalize(np.cross(n, u))
+        return np.array([(2.0*self.near)/(self.right-self.left), 0.0, 0.0, 0.0,
+                         0.0, ((2.0*self.near)/(self.top-self.bottom)), 0.0, 0.0,
+                         ((self.right+self.left)/(self.right-self.left)),
+                         ((self.top+self.bottom)/(self.top-self.bottom)),
+                         ((-1.0*(self.far+self.near)) / (self.far-self.near)), -1.0,
+                         0.0, 0.0, ((-2.0*self.far*self.near)/(self.far-self.near)),
+                         0.0], dtype=np.float32)
+
+    def object_matrices(self, transforms):
+        """
+        Calculates the model-view, normal and model-view-projection matrices
+        of any number of objects at once. These are constant for an object
+        over a frame, so they are computed here rather than per vertex.
 
-        view_mat = np.array([u[0], v[0], n[0], 0.0,
-                             u[1], v[1], n[1], 0.0,
-                             u[2], v[2], n[2], 0.0,
-                             -np.dot(u, self.eyepoint),
-                             -np.dot(v, self.eyepoint),
-                             -np.dot(n, self.eyepoint), 1.0],
-                            dtype=np.float32)
+        :param transforms: An (N, 4, 4) array of model matrices
 
-        view_location = glGetUniformLocation(shader_program, "view")
-        glUseProgram(shader_program)
-        glUniformMatrix4fv(view_location, 1, GL_FALSE, view_mat)
+        :return: A (model_view, normal, model_view_projection) tuple of
+                 (N, 4, 4), (N, 3, 3) and (N, 4, 4) arrays
+        """
+        view = self.view_matrix().reshape((4, 4)).T
+        projection = self.projection_matrix().reshape((4, 4)).T
+
+        model_view = view @ np.asarray(transforms, dtype=np.float64)
+        normal = np.linalg.inv(model_view[:, :3, :3]).transpose((0, 2, 1))
+        model_view_projection = projection @ model_view
+
+        return (model_view.astype(np.float32), normal.astype(np.float32),
+                model_view_projection.astype(np.float32))
+
+    def view_projection_matrix(self):
+        """
+        Calculates the combined view and projection matrix, which takes world
+        space points to clip space.
+
+        :return: The 4x4 view-projection matrix, in row-major order
+        """
+        view = self.view_matrix().reshape((4, 4)).T
+        projection = self.projection_matrix().reshape((4, 4)).T
+        return projection.astype(np.float64) @ view
 
-    def setup_projection(self, shader_program):
+    def frustum_planes(self):
         """
-        Calculates the projection matrix and passes it to a given shader program.
+        Extracts the six planes of the view frustum in world space from the
+        combined view-projection matrix (the Gribb-Hartmann method). A point p
+        is inside a plane (a, b, c, d) when a*p.x + b*p.y + c*p.z + d >= 0.
 
-        :param shader_program: A unique ID representing the shader program
+        :return: A (6, 4) array of the left, right, bottom, top, near and far
+                 planes, each with a unit normal pointing into the frustum
         """
-        projection_mat = np.array([(2.0*self.near)/(self.right-self.left), 0.0, 0.0, 0.0,
-                                   0.0, ((2.0*self.near)/(self.top-self.bottom)), 0.0, 0.0,
-                                   ((self.right+self.left)/(self.right-self.left)),
-                                   ((self.top+self.bottom)/(self.top-self.bottom)),
-                                   ((-1.0*(self.far+self.near)) / (self.far-self.near)), -1.0,
-                                   0.0, 0.0, ((-2.0*self.far*self.near)/(self.far-self.near)),
-                                   0.0], dtype=np.float32)
-
-        projection_location = glGetUniformLocation(shader_program, "projection")
-        glUniformMatrix4fv(projection_location, 1, GL_FALSE, projection_mat)
+        row_x, row_y, row_z, row_w = self.view_projection_matrix()
+        planes = np.array([row_w + row_x, row_w - row_x,
+                           row_w + row_y, row_w - row_y,
+                           row_w + row_z, row_w - row_z])
+        return planes / np.linalg.norm(planes[:, :3], axis=1, keepdims=True)
 
     @staticmethod
     def normalize(vector):
@@ -0,0 +1,130 @@
+"""
+culling.py
+
+Contains the FrustumCuller class, which finds the scene objects that lie
+outside the camera's view frustum, so they are not drawn.
+"""
+
+import numpy as np
+from object import SceneObject
+
+
+def world_spheres(transforms, centers, radii):
+    """
+    Moves bounding spheres from model space into world space. The center is
+    transformed as a point and the radius is scaled by a bound on the
+    largest stretch of the model matrix. The bound is the square root of the
+    largest row sum of the absolute Gram matrix of its linear part, which is
+    the largest scale factor when the matrix is a rotation and scale, and
+    never too small when it shears.
+
+    :param transforms: An (N, 4, 4) array of model matrices
+    :param centers: An (N, 3) array of sphere centers in model space
+    :param radii: An array of the N sphere radii in model space
+
+    :return: A (centers, radii) tuple of (N, 3) and (N,) arrays
+    """
+    transforms = np.asarray(transforms, dtype=np.float64)
+    linear = transforms[:, :3, :3]
+
+    world_centers = np.einsum('nij,nj->ni', linear, centers) + transforms[:, :3, 3]
+    gram = linear.transpose((0, 2, 1)) @ linear
+    world_radii = radii * np.sqrt(np.abs(gram).sum(axis=2).max(axis=1))
+    return world_centers, world_radii
+
+
+def world_boxes(transforms, centers, extents):
+    """
+    Moves axis-aligned bounding boxes from model space into world space. The
+    half-extents are transformed by the absolute values of the linear part of
+    the model matrix, which gives the axis-aligned box enclosing the
+    transformed box.
+
+    :param transforms: An (N, 4, 4) array of model matrices
+    :param centers: An (N, 3) array of box centers in model space
+    :param extents: An (N, 3) array of box half-extents in model space
+
+    :return: A (centers, extents) tuple of (N, 3) arrays
+    """
+    transforms = np.asarray(transforms, dtype=np.float64)
+    linear = transforms[:, :3, :3]
+
+    world_centers = np.einsum('nij,nj->ni', linear, centers) + transforms[:, :3, 3]
+    world_extents = np.einsum('nij,nj->ni', np.abs(linear), extents)
+    return world_centers, world_extents
+
+
+class FrustumCuller(object):
+    """
+    Tests the bounds of every object against the six planes of the view
+    frustum in one batch. The bounding box and bounding sphere of each
+    object's mesh are moved into world space by the object's model matrix,
+    and an object is culled when either lies entirely outside any one plane.
+    Both tests are conservative, so objects straddling a corner of the
+    frustum may be kept, but visible objects are never culled.
+    """
+
+    def __init__(self):
+        """
+        Constructor. Starts with no objects.
+        """
+        self.objects = []
+        self.mesh_version = -1
+        self.centers = np.zeros((0, 3))
+        self.extents = np.zeros((0, 3))
+        self.radii = np.zeros(0)
+        self.visible_count = 0
+        self.culled_count = 0
+
+    def __repr__(self):
+        return 'visible objects: {}, culled objects: {}'.format(
+            self.visible_count, self.culled_count)
+
+    def set_objects(self, objects):
+        """
+        Gathers the model space bounds of the meshes of a list of objects.
+        The finest level of detail is used, as it encloses the coarser ones.
+
+        :param objects: The scene objects to be culled, in the order of the
+                        transforms later passed to cull
+        """
+        self.objects = list(objects)
+        self.mesh_version = SceneObject.mesh_version
+        self.centers = np.array([obj.lods[0].center for obj in self.objects]
+                                ).reshape((-1, 3))
+        self.extents = np.array([obj.lods[0].extents for obj in self.objects]
+                                ).reshape((-1, 3))
+        self.radii = np.array([obj.lods[0].radius for obj in self.objects])
+
+    def cull(self, camera, objects, transforms):
+        """
+        Finds the objects at least partly inside the view frustum.
+
+        :param camera: The Camera the objects are viewed from
+        :param objects: The scene objects to be tested
+        :param transforms: An (N, 4, 4) array of the model matrices of the
+                           objects
+
+        :return: A boolean array, True for each object that should be drawn
+        """
+        # Lists of the same objects compare equal without a call per object
+        if self.mesh_version != SceneObject.mesh_version or \
+                self.objects != objects:
+            self.set_objects(objects)
+
+        # World space bounds, the box and sphere sharing a center
+        centers, extents = world_boxes(transforms, self.centers, self.extents)
+        radii = world_spheres(transforms, self.centers, self.radii)[1]
+
+        # (N, 6) signed distances of the centers from each plane
+        planes = camera.frustum_planes()
+        distances = centers @ planes[:, :3].T + planes[:, 3]
+
+        inside_spheres = np.all(distances >= -radii[:, np.newaxis], axis=1)
+        inside_boxes = np.all(distances + extents @ np.abs(planes[:, :3]).T >= 0.0,
+                              axis=1)
+        visible = inside_spheres & inside_boxes
+
+        self.visible_count = int(np.count_nonzero(visible))
+        self.culled_count = len(visible) - self.visible_count
+        return visible
@@ -1,46 +1,67 @@
 """
 ground.py
 
-Sets up the ground for the scene with a grass texture.
+Sets up the ground for the scene with a grass texture. Each repetition of the
+texture picks one of several grass variants, packed into an array texture.
 """
 
 import numpy as np
 from OpenGL.GL import *
 from object import SceneObject
+from texture_loader import texture_loader
 
-GRASS_TEXTURE_PATH = b"grass_texture.jpg"
+GRASS_TEXTURE_PATHS = [b"GrassGreenTexture0001.jpg",
+                       b"GrassGreenTexture0002.jpg",
+                       b"GrassGreenTexture0003.jpg",
+                       b"GrassGreenTexture0004.jpg",
+                       b"GrassGreenTexture0005.jpg",
+                       b"GrassGreenTexture0006.jpg"]
+
+# The number of tiles along each side of the ground
+TEXTURE_REPETITIONS = 6
 
 class Ground(SceneObject):
     """
     Class representing the ground in the scene.
     """
 
-    def __init__(self, shader_program):
+    def __init__(self, shader_program, tex_repetitions=TEXTURE_REPETITIONS):
         """
         Contructor. Tesselates the shape, sets normals, texture UV-coordinates
-        and elements. Sets up material properties. Loads the grass texture.
+        and elements. Sets up material properties. Loads the grass textures.
         Buffers all the data to the GPU.
 
-        :param shader_program: A unique ID for the shader_program to be used
-                               with this object
+        :param shader_program: The ShaderProgram to be used with this object
+        :param tex_repetitions: The number of tiles along each side, so a
+                                larger ground can keep the same tile size
         """
-        self.tessellate(10, 3)
-
-        self.normals = np.array([0.0, 1.0, 0.0] * (len(self.vertices)//3),
-                                dtype=np.float32)
-
+        super().__init__()
         self.k_ambient = np.array([0.4, 0.6, 0.2], dtype=np.float32)
         self.k_diffuse = np.array([0.2, 0.3, 0.1], dtype=np.float32)
         self.k_specular = np.array([0.1, 0.15, 0.05], dtype=np.float32)
         self.shininess = 0.0
 
-        self.load_texture(GRASS_TEXTURE_PATH)
-        self.set_buffers(shader_program)
+        self.load_texture_array(GRASS_TEXTURE_PATHS)
+        self.load_mesh(shader_program, 10, tex_repetitions)
+
+    @staticmethod
+    def request_textures():
+        """
+        Starts decoding the grass textures before the ground is created, so
+        they decode while other startup work is done. The ground is given the
+        same texture when it is created.
+        """
+        try:
+            texture_loader.load_array(GRASS_TEXTURE_PATHS)
+
+        except Exception as texture_ex:
+            print('request_textures ERROR', texture_ex)
 
     def tessellate(self, divisions, tex_repetitions):
         """
-        Calculates the vertices, triangles and the texture UV-coordinates at
-        the vertices of the ground object. The ground is represented as a quad.
+        Calculates the vertices, triangles, normals and the texture
+        UV-coordinates at the vertices of the ground object. The ground is
+        represented as a quad.
 
         :param divisions: The number of subdivisions for tessellation
         :param tex_repititions: The number of times the texture is to be
@@ -72,5 +93,7 @@ class Ground(SceneObject):
                 elements.append(i * (divisions + 1) + j)
 
         self.vertices = np.array(vertices, dtype=np.float32)
-        self.elements = np.array(elements, dtype=np.uint16)
+        self.elements = np.array(elements, dtype=np.uint32)
         self.texture_uv = np.array(texture_uv, dtype=np.float32)
+        self.normals = np.array([0.0, 1.0, 0.0] * (len(self.vertices)//3),
+                                dtype=np.float32)
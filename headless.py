@@ -0,0 +1,244 @@
+"""
+headless.py
+
+Contains the HeadlessContext class, which renders the scene offscreen without
+a window or display, using EGL or OSMesa. Both work with Mesa's llvmpipe
+software renderer, so no GPU is needed.
+
+This module must be imported before anything else imports OpenGL, since
+PyOpenGL picks its platform on first import. EGL is used by default; set
+PYOPENGL_PLATFORM=osmesa to use OSMesa instead.
+
+    python headless.py [--instanced] [--size WIDTHxHEIGHT] [--scene PATH]
+                       output.png
+"""
+
+import os
+
+os.environ.setdefault('PYOPENGL_PLATFORM', 'egl')
+
+import ctypes
+import numpy as np
+from OpenGL.GL import *
+
+# Not defined by PyOpenGL
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+DEFAULT_WIDTH = 768
+DEFAULT_HEIGHT = 768
+
+class HeadlessContext(object):
+    """
+    An offscreen OpenGL 3.2 core profile context rendering into a framebuffer
+    object of a given size.
+    """
+    platform = None
+    display = None
+    context = None
+    framebuffer = 0
+    renderbuffers = []
+
+    def __init__(self, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT):
+        """
+        Constructor. Creates the context, makes it current and sets up a
+        framebuffer object to render into.
+
+        :param width: The width of the rendered frames in pixels
+        :param height: The height of the rendered frames in pixels
+        """
+        self.width = width
+        self.height = height
+        self.platform = os.environ['PYOPENGL_PLATFORM']
+
+        if self.platform == 'egl':
+            self.create_egl_context()
+        elif self.platform == 'osmesa':
+            self.create_osmesa_context()
+        else:
+            raise RuntimeError('Headless rendering needs PYOPENGL_PLATFORM to '
+                               'be egl or osmesa, not {}'.format(self.platform))
+
+        self.create_framebuffer()
+
+    def create_egl_context(self):
+        """
+        Creates an EGL context without a surface. Mesa's surfaceless platform
+        is preferred, since the default display may need a windowing system.
+        """
+        from OpenGL import EGL
+
+        self.display = None
+        displays = [lambda: EGL.eglGetPlatformDisplayEXT(
+                        EGL_PLATFORM_SURFACELESS_MESA, EGL.EGL_DEFAULT_DISPLAY, None),
+                    lambda: EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)]
+
+        for get_display in displays:
+            try:
+                display = get_display()
+                if display and EGL.eglInitialize(display, None, None):
+                    self.display = display
+                    break
+            except Exception:
+                continue
+
+        if self.display is None:
+            raise RuntimeError('Could not initialize an EGL display')
+
+        config = EGL.EGLConfig()
+        num_configs = EGL.EGLint()
+        config_attributes = (EGL.EGLint * 5)(EGL.EGL_RENDERABLE_TYPE,
+                                             EGL.EGL_OPENGL_BIT,
+                                             EGL.EGL_SURFACE_TYPE,
+                                             EGL.EGL_PBUFFER_BIT, EGL.EGL_NONE)
+        if not EGL.eglChooseConfig(self.display, config_attributes,
+                                   ctypes.pointer(config), 1,
+                                   ctypes.pointer(num_configs)) \
+                or num_configs.value == 0:
+            raise RuntimeError('No EGL config supports desktop OpenGL')
+
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        context_attributes = (EGL.EGLint * 7)(
+            EGL.EGL_CONTEXT_MAJOR_VERSION, 3,
+            EGL.EGL_CONTEXT_MINOR_VERSION, 2,
+            EGL.EGL_CONTEXT_OPENGL_PROFILE_MASK,
+            EGL.EGL_CONTEXT_OPENGL_CORE_PROFILE_BIT,
+            EGL.EGL_NONE)
+        self.context = EGL.eglCreateContext(self.display, config,
+                                            EGL.EGL_NO_CONTEXT,
+                                            context_attributes)
+        if not self.context:
+            raise RuntimeError('Could not create an EGL context')
+
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE,
+                           self.context)
+
+    def create_osmesa_context(self):
+        """
+        Creates an OSMesa context. OSMesa needs a buffer of its own to make
+        the context current, but rendering still goes to the framebuffer
+        object.
+        """
+        from OpenGL import arrays
+        from OpenGL import osmesa
+
+        attributes = (ctypes.c_int * 9)(
+            osmesa.OSMESA_FORMAT, osmesa.OSMESA_RGBA,
+            osmesa.OSMESA_PROFILE, osmesa.OSMESA_CORE_PROFILE,
+            osmesa.OSMESA_CONTEXT_MAJOR_VERSION, 3,
+            osmesa.OSMESA_CONTEXT_MINOR_VERSION, 2,
+            0)
+        self.context = osmesa.OSMesaCreateContextAttribs(attributes, None)
+        if not self.context:
+            raise RuntimeError('Could not create an OSMesa context')
+
+        self.osmesa_buffer = arrays.GLubyteArray.zeros((self.height, self.width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.osmesa_buffer,
+                                        GL_UNSIGNED_BYTE, self.width,
+                                        self.height):
+            raise RuntimeError('Could not make the OSMesa context current')
+
+    def create_framebuffer(self):
+        """
+        Creates a framebuffer object with color and depth renderbuffers of the
+        size of the frames, and binds it for rendering.
+        """
+        self.framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+
+        self.renderbuffers = glGenRenderbuffers(2)
+        glBindRenderbuffer(GL_RENDERBUFFER, self.renderbuffers[0])
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0,
+                                  GL_RENDERBUFFER, self.renderbuffers[0])
+
+        glBindRenderbuffer(GL_RENDERBUFFER, self.renderbuffers[1])
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24,
+                              self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT,
+                                  GL_RENDERBUFFER, self.renderbuffers[1])
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError('The offscreen framebuffer is incomplete')
+
+        glViewport(0, 0, self.width, self.height)
+
+    def render(self, scene):
+        """
+        Draws a scene into the framebuffer and reads the frame back.
+
+        :param scene: The Scene to be drawn
+
+        :return: The frame as a (height, width, 3) array of bytes, top row first
+        """
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer)
+        scene.display()
+        return self.read_frame()
+
+    def read_frame(self):
+        """
+        Reads the contents of the framebuffer.
+
+        :return: The frame as a (height, width, 3) array of bytes, top row first
+        """
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        pixels = glReadPixels(0, 0, self.width, self.height, GL_RGB,
+                              GL_UNSIGNED_BYTE)
+        frame = np.frombuffer(pixels, dtype=np.uint8)
+        return frame.reshape((self.height, self.width, 3))[::-1]
+
+    def close(self):
+        """
+        Frees the framebuffer and destroys the context.
+        """
+        if self.framebuffer:
+            glDeleteFramebuffers(1, [self.framebuffer])
+            glDeleteRenderbuffers(len(self.renderbuffers), self.renderbuffers)
+            self.framebuffer = 0
+
+        if self.platform == 'egl' and self.context:
+            from OpenGL import EGL
+            EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE,
+                               EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+            EGL.eglDestroyContext(self.display, self.context)
+            EGL.eglTerminate(self.display)
+        elif self.platform == 'osmesa' and self.context:
+            from OpenGL import osmesa
+            osmesa.OSMesaDestroyContext(self.context)
+        self.context = None
+
+
+def parse_size(text):
+    """
+    Parses a frame size given as WIDTHxHEIGHT.
+
+    :param text: The size, e.g. "1920x1080"
+
+    :return: A (width, height) tuple
+    """
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    import argparse
+    from PIL import Image
+    from scene import Scene, DEFAULT_SCENE_PATH
+
+    parser = argparse.ArgumentParser(description='Render the scene offscreen.')
+    parser.add_argument('output', help='the image file to write')
+    parser.add_argument('--size', type=parse_size,
+                        default=(DEFAULT_WIDTH, DEFAULT_HEIGHT),
+                        help='the frame size as WIDTHxHEIGHT')
+    parser.add_argument('--instanced', action='store_true',
+                        help='draw repeated meshes with instancing')
+    parser.add_argument('--scene', default=DEFAULT_SCENE_PATH, metavar='PATH',
+                        help='the scene file to render (see henge.py)')
+    args = parser.parse_args()
+
+    headless_context = HeadlessContext(*args.size)
+    scene = Scene(args.instanced, scene_path=args.scene)
+    frame = headless_context.render(scene)
+    Image.fromarray(frame).save(args.output)
+    scene.close()
+    headless_context.close()
@@ -0,0 +1,243 @@
+"""
+henge.py
+
+Lays out a field of henges procedurally and saves it as a scene file (see
+scene_file.py), to measure how the renderer scales with the number of
+objects. Each henge is a ring of upright stones capped by a ring of lintels,
+with boulders scattered in and around it, and the henges are placed on a
+square grid centered on the origin.
+
+    python henge.py [--henges N] [--stones N] [--boulders N] [--seed N]
+                    output.json
+
+For example, 1000 henges of 40 stones and 20 boulders make 100,000 objects.
+
+    python henge.py --henges 1000 --stones 40 --boulders 20 field.json
+    python scene.py --instanced --scene field.json
+"""
+
+import math
+import numpy as np
+from scene_file import SceneFile, OBJECT_DTYPE
+
+DEFAULT_HENGES = 1
+DEFAULT_STONES = 16
+DEFAULT_BOULDERS = 8
+
+# The distance between the centers of neighbouring uprights of a ring. The
+# radius of a ring grows with its number of stones.
+STONE_SPACING = 4.5
+MIN_STONES = 3
+
+# The space left between the boulders of neighbouring henges
+HENGE_MARGIN = 6.0
+
+# Half-sizes of the stones, as scales of the unit stone, which spans -1 to 1.
+# Uprights stand on the ground, and lintels rest on top of them.
+UPRIGHT_SCALE = (1.5, 3.0, 0.7)
+LINTEL_SCALE = (0.5, 0.7)
+
+# The largest random turn of an upright away from facing the center, in
+# degrees
+UPRIGHT_JITTER = 4.0
+
+# Boulders lie within this multiple of the ring radius of their henge, sunk
+# into the ground by part of their radius
+BOULDER_REACH = 1.4
+BOULDER_SCALES = (1.0, 2.0)
+BOULDER_SINKING = 0.5
+
+# Variations of the stone and boulder materials, as (ambient, diffuse,
+# specular, shininess). Few enough that instanced batches can hold them all.
+# The first of each is the material of the Stone and Boulder classes.
+SPECULAR = (0.3, 0.3, 0.3)
+STONE_MATERIALS = [((0.15, 0.25, 0.25), (0.25, 0.3, 0.3), SPECULAR, 2.0),
+                   ((0.18, 0.25, 0.23), (0.3, 0.32, 0.3), SPECULAR, 2.0),
+                   ((0.13, 0.2, 0.22), (0.22, 0.26, 0.28), SPECULAR, 2.0)]
+BOULDER_MATERIALS = [((0.3, 0.3, 0.21), (0.4, 0.5, 0.35), SPECULAR, 7.0),
+                     ((0.27, 0.26, 0.2), (0.38, 0.42, 0.33), SPECULAR, 7.0)]
+
+
+def y_rotations(angles):
+    """
+    Returns the quaternions of rotations about the vertical axis, matching
+    SceneObject.rotate(0, angle, 0).
+
+    :param angles: An array of rotation angles (in radians)
+
+    :return: An (N, 4) array of (x, y, z, w) quaternions
+    """
+    rotations = np.zeros((len(angles), 4))
+    rotations[:, 1] = np.sin(angles / 2.0)
+    rotations[:, 3] = np.cos(angles / 2.0)
+    return rotations
+
+
+def ring_radius(stone_count):
+    """
+    Returns the radius of a ring of uprights.
+
+    :param stone_count: The number of uprights in the ring
+
+    :return: The distance of the centers of the uprights from the center
+    """
+    return stone_count * STONE_SPACING / (2.0 * math.pi)
+
+
+def henge_centers(henge_count, stone_count):
+    """
+    Lays out the centers of the henges on a square grid, the grid centered on
+    the origin.
+
+    :param henge_count: The number of henges
+    :param stone_count: The number of uprights in each ring
+
+    :return: An (N, 3) array of the centers on the ground
+    """
+    columns = int(math.ceil(math.sqrt(henge_count)))
+    rows = int(math.ceil(henge_count / columns))
+    pitch = 2.0 * BOULDER_REACH * ring_radius(stone_count) + HENGE_MARGIN
+
+    grid = np.arange(henge_count)
+    centers = np.zeros((henge_count, 3))
+    centers[:, 0] = (grid % columns - (columns - 1) / 2.0) * pitch
+    centers[:, 2] = (grid // columns - (rows - 1) / 2.0) * pitch
+    return centers
+
+
+def ring_positions(centers, distances, angles):
+    """
+    Returns points on the ground around the centers of henges.
+
+    :param centers: An (N, 3) array of the centers of the henges
+    :param distances: An (N, K) array of the distances of the points from
+                      the centers
+    :param angles: An (N, K) array of the directions of the points (in
+                   radians), measured from +z towards +x
+
+    :return: An (N, K, 3) array of points
+    """
+    offsets = np.stack([np.sin(angles), np.zeros_like(angles), np.cos(angles)],
+                       axis=-1)
+    return centers[:, np.newaxis, :] + distances[..., np.newaxis] * offsets
+
+
+def set_materials(records, materials, choices):
+    """
+    Sets the material fields of a set of records from a list of materials.
+
+    :param records: A structured array of OBJECT_DTYPE
+    :param materials: A list of (ambient, diffuse, specular, shininess)
+                      materials
+    :param choices: An array of the index of the material of each record
+    """
+    ambient, diffuse, specular, shininess = (np.array(values) for values
+                                             in zip(*materials))
+    records['ambient'] = ambient[choices]
+    records['diffuse'] = diffuse[choices]
+    records['specular'] = specular[choices]
+    records['shininess'] = shininess[choices]
+
+
+def generate_henges(henge_count=DEFAULT_HENGES, stone_count=DEFAULT_STONES,
+                    boulder_count=DEFAULT_BOULDERS, seed=0):
+    """
+    Lays out a field of henges. All objects are placed in array operations,
+    so even very large fields are generated quickly.
+
+    :param henge_count: The number of henges
+    :param stone_count: The number of uprights in each ring, and of lintels
+                        on top of them
+    :param boulder_count: The number of boulders around each henge
+    :param seed: The seed of the random variations, so a field can be
+                 generated again exactly
+
+    :return: A SceneFile holding the uprights, then the lintels, then the
+             boulders of every henge
+    """
+    if henge_count < 0 or boulder_count < 0:
+        raise ValueError('The numbers of henges and boulders cannot be '
+                         'negative')
+    if stone_count < MIN_STONES:
+        raise ValueError('A henge needs at least {} stones'.format(MIN_STONES))
+
+    random = np.random.default_rng(seed)
+    scene_file = SceneFile()
+    stone_type = scene_file.types.index('stone')
+    boulder_type = scene_file.types.index('boulder')
+
+    radius = ring_radius(stone_count)
+    step = 2.0 * math.pi / stone_count
+    centers = henge_centers(henge_count, stone_count)
+
+    # Each henge is turned by a random angle so the grid looks less regular.
+    # Angles are (henge, stone) arrays, measured from +z towards +x.
+    turns = random.uniform(0.0, step, (henge_count, 1))
+    angles = turns + np.arange(stone_count) * step
+
+    # Uprights face the center, so their width runs along the ring
+    uprights = np.zeros(henge_count * stone_count, dtype=OBJECT_DTYPE)
+    uprights['type'] = stone_type
+    positions = ring_positions(centers, np.full(angles.shape, radius), angles)
+    positions[:, :, 1] = UPRIGHT_SCALE[1]
+    uprights['translation'] = positions.reshape((-1, 3))
+    jitter = np.radians(random.uniform(-UPRIGHT_JITTER, UPRIGHT_JITTER,
+                                       angles.shape))
+    uprights['rotation'] = y_rotations((angles + jitter).ravel())
+    uprights['scale'] = UPRIGHT_SCALE
+    set_materials(uprights, STONE_MATERIALS,
+                  random.integers(len(STONE_MATERIALS), size=len(uprights)))
+
+    # Each lintel spans the chord between the centers of two uprights
+    middles = angles + step / 2.0
+    lintels = np.zeros(henge_count * stone_count, dtype=OBJECT_DTYPE)
+    lintels['type'] = stone_type
+    distances = np.full(middles.shape, radius * math.cos(step / 2.0))
+    positions = ring_positions(centers, distances, middles)
+    positions[:, :, 1] = 2.0 * UPRIGHT_SCALE[1] + LINTEL_SCALE[0]
+    lintels['translation'] = positions.reshape((-1, 3))
+    lintels['rotation'] = y_rotations(middles.ravel())
+    lintels['scale'] = (radius * math.sin(step / 2.0),) + LINTEL_SCALE
+    set_materials(lintels, STONE_MATERIALS,
+                  random.integers(len(STONE_MATERIALS), size=len(lintels)))
+
+    # Boulders are spread evenly over a disc around each henge
+    shape = (henge_count, boulder_count)
+    distances = BOULDER_REACH * radius * np.sqrt(random.uniform(size=shape))
+    directions = random.uniform(0.0, 2.0 * math.pi, shape)
+    sizes = random.uniform(*BOULDER_SCALES, shape)
+
+    boulders = np.zeros(henge_count * boulder_count, dtype=OBJECT_DTYPE)
+    boulders['type'] = boulder_type
+    positions = ring_positions(centers, distances, directions)
+    positions[:, :, 1] = -BOULDER_SINKING * sizes
+    boulders['translation'] = positions.reshape((-1, 3))
+    boulders['rotation'] = (0.0, 0.0, 0.0, 1.0)
+    boulders['scale'] = np.repeat(sizes.reshape((-1, 1)), 3, axis=1)
+    set_materials(boulders, BOULDER_MATERIALS,
+                  random.integers(len(BOULDER_MATERIALS), size=len(boulders)))
+
+    scene_file.records = np.concatenate([uprights, lintels, boulders])
+    return scene_file
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Generate a field of henges '
+                                                 'as a scene file.')
+    parser.add_argument('output', help='the path of the scene file manifest')
+    parser.add_argument('--henges', type=int, default=DEFAULT_HENGES,
+                        help='the number of henges')
+    parser.add_argument('--stones', type=int, default=DEFAULT_STONES,
+                        help='the number of upright stones in each ring')
+    parser.add_argument('--boulders', type=int, default=DEFAULT_BOULDERS,
+                        help='the number of boulders around each henge')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='the seed of the random variations')
+    args = parser.parse_args()
+
+    field = generate_henges(args.henges, args.stones, args.boulders, args.seed)
+    field.save(args.output)
+    print('{} objects in {} henges, {:.0f} units across'.format(
+        len(field), args.henges, 2.0 * field.extent()))
@@ -0,0 +1,207 @@
+"""
+instancing.py
+
+Contains the InstanceBatch class, which renders every scene object sharing a
+mesh with a single instanced draw call.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+from ctypes import c_void_p
+from transform_store import transform_store
+
+# Must match the size of the material arrays in phong_shader.vert
+MAX_MATERIALS = 16
+
+# Floats per instance: column-major model-view and normal matrices and a
+# material index
+INSTANCE_FLOATS = 26
+NORMAL_OFFSET = 16
+MATERIAL_OFFSET = 25
+
+
+class InstanceBatch(object):
+    """
+    A group of scene objects that share a mesh and a shader program. The
+    model-view and normal matrices and material index of each object are stored in a
+    per-instance attribute buffer, and the group is drawn with one call.
+    """
+
+    def __init__(self, mesh, shader_program, level=0):
+        """
+        Constructor. Creates a vertex array object combining the buffers of
+        the mesh with a buffer of per-instance attributes.
+
+        :param mesh: The mesh shared by all objects in the batch
+        :param shader_program: The instanced ShaderProgram
+        :param level: The level of detail of the mesh in the objects' chains
+        """
+        self.mesh = mesh
+        self.shader_program = shader_program
+        self.level = level
+        self.objects = []
+        self.indices = np.array([], dtype=np.int64)
+        self.material_indices = []
+        self.materials = []
+        self.instance_count = 0
+
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+        mesh.bind_attributes(shader_program)
+
+        self.instance_buffer = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+
+        # Matrix attributes take up one location per column
+        stride = INSTANCE_FLOATS * 4
+        model_view_location = shader_program.attribute_location("instanceModelView")
+        for column in range(4):
+            glVertexAttribPointer(model_view_location + column, 4, GL_FLOAT,
+                                  GL_FALSE, stride, c_void_p(column * 16))
+            glEnableVertexAttribArray(model_view_location + column)
+            glVertexAttribDivisor(model_view_location + column, 1)
+
+        normal_location = shader_program.attribute_location("instanceNormalMatrix")
+        for column in range(3):
+            glVertexAttribPointer(normal_location + column, 3, GL_FLOAT,
+                                  GL_FALSE, stride,
+                                  c_void_p((NORMAL_OFFSET + column * 3) * 4))
+            glEnableVertexAttribArray(normal_location + column)
+            glVertexAttribDivisor(normal_location + column, 1)
+
+        material_location = shader_program.attribute_location("instanceMaterial")
+        glVertexAttribPointer(material_location, 1, GL_FLOAT, GL_FALSE, stride,
+                              c_void_p(MATERIAL_OFFSET * 4))
+        glEnableVertexAttribArray(material_location)
+        glVertexAttribDivisor(material_location, 1)
+
+        # Unbind the buffer objects
+        glBindVertexArray(0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def add(self, objects):
+        """
+        Adds objects to the batch, registering each material that no other
+        object in the batch uses.
+
+        :param objects: The scene objects to be added
+        """
+        for obj in objects:
+            material = obj.material()
+            if material not in self.materials:
+                if len(self.materials) == MAX_MATERIALS:
+                    raise ValueError('An instance batch can hold at most {} '
+                                     'materials'.format(MAX_MATERIALS))
+                self.materials.append(material)
+            self.material_indices.append(self.materials.index(material))
+
+        # The indices are extended once per call, as growing the array one
+        # object at a time would copy it for every object
+        self.objects.extend(objects)
+        self.indices = np.concatenate([self.indices,
+                                       np.array([obj.index for obj in objects],
+                                                dtype=np.int64)])
+
+    def update(self, camera, visible=None):
+        """
+        Computes the model-view and normal matrices of the objects in the
+        batch and copies them into the per-instance attribute buffer.
+
+        :param camera: The Camera the batch is viewed from
+        :param visible: A boolean array selecting the objects to be drawn,
+                        in the order they were added, or None to draw all
+        """
+        indices = self.indices
+        material_indices = np.asarray(self.material_indices)
+        if visible is not None:
+            indices = indices[visible]
+            material_indices = material_indices[visible]
+
+        self.instance_count = len(indices)
+        if self.instance_count == 0:
+            return
+
+        transforms = transform_store.matrices(indices)
+        model_view, normal, _ = camera.object_matrices(transforms)
+
+        instance_data = np.empty((self.instance_count, INSTANCE_FLOATS),
+                                 dtype=np.float32)
+        instance_data[:, :NORMAL_OFFSET] = \
+            model_view.transpose((0, 2, 1)).reshape((-1, 16))
+        instance_data[:, NORMAL_OFFSET:MATERIAL_OFFSET] = \
+            normal.transpose((0, 2, 1)).reshape((-1, 9))
+        instance_data[:, MATERIAL_OFFSET] = material_indices
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.instance_buffer)
+        glBufferData(GL_ARRAY_BUFFER, instance_data, GL_STREAM_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def draw(self):
+        """
+        Sends the material table to the shader and renders the objects
+        selected by the last update with a single instanced draw.
+        """
+        self.shader_program.use()
+        self.set_uniforms()
+
+        glBindVertexArray(self.vao)
+        self.mesh.draw(self.instance_count)
+        glBindVertexArray(0)
+
+    def delete(self):
+        """
+        Frees the vertex array object and instance buffer of the batch. The
+        buffers of the mesh belong to the mesh and are left as they are.
+        """
+        if self.vao:
+            glDeleteVertexArrays(1, [self.vao])
+            glDeleteBuffers(1, [self.instance_buffer])
+            self.vao = 0
+            self.instance_buffer = 0
+
+    def set_uniforms(self):
+        """
+        Sends the material table of the batch to the shader program.
+        """
+        ambient, diffuse, specular, shininess = zip(*self.materials)
+
+        self.shader_program.set_uniform("k_a", ambient)
+        self.shader_program.set_uniform("k_d", diffuse)
+        self.shader_program.set_uniform("k_s", specular)
+        self.shader_program.set_uniform("n", shininess)
+
+
+def build_batches(objects, shader_program):
+    """
+    Groups scene objects by the meshes they share into instance batches.
+    Each object is added to a batch for every level of its level of detail
+    chain, and each frame is drawn by the batch of its current level. A mesh
+    used at different levels by different objects gets a batch per level,
+    and a mesh drawn with more than MAX_MATERIALS materials is split into
+    several batches.
+
+    :param objects: The scene objects to be grouped
+    :param shader_program: The instanced ShaderProgram
+
+    :return: A list of instance batches, one or more per distinct mesh and
+             level
+    """
+    # The objects of each batch are gathered first, by material, and added
+    # together
+    batch_objects = {}
+    for obj in objects:
+        material = obj.material()
+        for level, mesh in enumerate(obj.lods):
+            materials = batch_objects.setdefault((mesh, level), {})
+            materials.setdefault(material, []).append(obj)
+
+    batches = []
+    for (mesh, level), materials in batch_objects.items():
+        groups = list(materials.values())
+        for start in range(0, len(groups), MAX_MATERIALS):
+            batch = InstanceBatch(mesh, shader_program, level)
+            batch.add([obj for group in groups[start:start + MAX_MATERIALS]
+                       for obj in group])
+            batches.append(batch)
+    return batches
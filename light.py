@@ -5,7 +5,6 @@ Contains the Light class to manage the lighting parameters.
 """
 
 import numpy as np
-from OpenGL.GL import *
 
 class Light(object):
     """
@@ -25,20 +24,3 @@ class Light(object):
         self.ambient = np.array([*self.ambient], dtype=np.float32)
         self.diffuse = np.array([*self.diffuse], dtype=np.float32)
         self.specular = np.array([*self.specular], dtype=np.float32)
-
-    def setup(self, shader_program):
-        """
-        Passes the lighting parameters to a given shader program.
-
-        :param shader_program: A unique ID representing the shader program
-        """
-        position_location = glGetUniformLocation(shader_program, "lightPosition")
-        ambient_location = glGetUniformLocation(shader_program, "I_a")
-        diffuse_location = glGetUniformLocation(shader_program, "I_d")
-        specular_location = glGetUniformLocation(shader_program, "I_s")
-
-        glUseProgram(shader_program)
-        glUniform3fv(position_location, 1, self.position)
-        glUniform3fv(ambient_location, 1, self.ambient)
-        glUniform3fv(diffuse_location, 1, self.diffuse)
-        glUniform3fv(specular_location, 1, self.specular)
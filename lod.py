@@ -0,0 +1,125 @@
+"""
+lod.py
+
+Contains the LodSelector class, which picks the level of detail each scene
+object is drawn with from the size it appears on screen.
+"""
+
+import numpy as np
+from culling import world_spheres
+from object import SceneObject
+
+# Projected radius, in pixels, below which each coarser level is used. An
+# object with a radius over 10 pixels is drawn at its finest level, one
+# between 4 and 10 pixels at the next, and anything smaller at the coarsest.
+# At these sizes the silhouettes of the coarser boulders stay within about
+# half a pixel of the sphere.
+SCREEN_SIZES = (10.0, 4.0)
+
+# Fraction by which the projected size must pass a threshold before the level
+# changes, so objects sitting near a threshold do not flicker between levels
+HYSTERESIS = 0.15
+
+
+class LodSelector(object):
+    """
+    Estimates the projected radius of each object's bounding sphere in pixels
+    and picks the level of detail for it in one batch. Levels only change
+    once the size is clearly past a threshold, and each object's mesh is
+    switched to the mesh of its level.
+    """
+
+    def __init__(self, screen_sizes=SCREEN_SIZES, hysteresis=HYSTERESIS):
+        """
+        Constructor.
+
+        :param screen_sizes: The projected radii, in pixels and in decreasing
+                             order, below which each coarser level is used
+        :param hysteresis: The fraction by which the size must pass a
+                           threshold before the level changes
+        """
+        self.screen_sizes = np.asarray(screen_sizes, dtype=np.float64)
+        self.hysteresis = hysteresis
+        self.objects = []
+        self.mesh_version = -1
+        self.centers = np.zeros((0, 3))
+        self.radii = np.zeros(0)
+        self.coarsest = np.zeros(0, dtype=np.int64)
+        self.triangles = np.zeros((0, 1), dtype=np.int64)
+        self.levels = np.zeros(0, dtype=np.int64)
+        self.level_counts = []
+        self.triangle_count = 0
+
+    def __repr__(self):
+        return 'objects per detail level: {}, triangles: {}'.format(
+            self.level_counts, self.triangle_count)
+
+    def set_objects(self, objects):
+        """
+        Gathers the bounding spheres, number of levels and triangle counts of
+        a list of objects. Every object starts at its finest level.
+
+        :param objects: The scene objects, in the order of the transforms
+                        later passed to select
+        """
+        self.objects = list(objects)
+        self.mesh_version = SceneObject.mesh_version
+        self.centers = np.array([obj.lods[0].center for obj in self.objects]
+                                ).reshape((-1, 3))
+        self.radii = np.array([obj.lods[0].radius for obj in self.objects])
+        self.coarsest = np.array([len(obj.lods) - 1 for obj in self.objects],
+                                 dtype=np.int64)
+        self.levels = np.zeros(len(self.objects), dtype=np.int64)
+
+        self.triangles = np.zeros((len(self.objects), len(self.screen_sizes) + 1),
+                                  dtype=np.int64)
+        for index, obj in enumerate(self.objects):
+            obj.mesh = obj.lods[0]
+            for level, mesh in enumerate(obj.lods[:self.triangles.shape[1]]):
+                self.triangles[index, level] = len(mesh.elements) // 3
+
+    def select(self, camera, objects, transforms, viewport_height, visible):
+        """
+        Picks the level of detail of every object and sets the mesh of each
+        object whose level changed.
+
+        :param camera: The Camera the objects are viewed from
+        :param objects: The scene objects
+        :param transforms: An (N, 4, 4) array of the model matrices of the
+                           objects
+        :param viewport_height: The height of the viewport in pixels
+        :param visible: A boolean array of the objects that will be drawn,
+                        used for the level and triangle counts
+
+        :return: An array of the level of each object, 0 being the finest
+        """
+        # Lists of the same objects compare equal without a call per object
+        if self.mesh_version != SceneObject.mesh_version or \
+                self.objects != objects:
+            self.set_objects(objects)
+
+        # The projected radius of a sphere, in pixels, from its distance to
+        # the eye and the vertical scale of the projection
+        centers, radii = world_spheres(transforms, self.centers, self.radii)
+        distances = np.maximum(np.linalg.norm(centers - camera.eyepoint, axis=1),
+                               camera.near)
+        focal_length = 2.0 * camera.near / (camera.top - camera.bottom)
+        sizes = radii * focal_length / distances * (viewport_height / 2.0)
+
+        # Sizes clearly below a threshold force a coarser level, and sizes
+        # clearly above one force a finer level. In between, the object keeps
+        # its current level.
+        below = sizes[:, np.newaxis] < self.screen_sizes * (1.0 - self.hysteresis)
+        near_or_below = sizes[:, np.newaxis] < self.screen_sizes * (1.0 + self.hysteresis)
+        levels = np.clip(self.levels, below.sum(axis=1), near_or_below.sum(axis=1))
+        levels = np.minimum(levels, self.coarsest)
+
+        for index in np.flatnonzero(levels != self.levels):
+            obj = self.objects[index]
+            obj.mesh = obj.lods[levels[index]]
+        self.levels = levels
+
+        self.level_counts = np.bincount(levels[visible],
+                                        minlength=self.triangles.shape[1]).tolist()
+        self.triangle_count = int(self.triangles[visible, levels[visible]].sum())
+        return levels
@@ -0,0 +1,297 @@
+"""
+mesh.py
+
+Contains the Mesh class holding geometry buffered to the GPU, and a registry
+that lets scene objects with identical geometry share a single mesh.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+from ctypes import c_void_p
+
+# Index types in order of preference, with the largest index each can hold
+INDEX_TYPES = [(np.uint8, GL_UNSIGNED_BYTE),
+               (np.uint16, GL_UNSIGNED_SHORT),
+               (np.uint32, GL_UNSIGNED_INT)]
+
+
+def index_type(vertex_count):
+    """
+    Returns the narrowest index type able to address a given number of
+    vertices.
+
+    :param vertex_count: The number of vertices to be addressed
+
+    :return: A (numpy dtype, GL type) tuple
+    """
+    for dtype, gl_type in INDEX_TYPES:
+        if vertex_count - 1 <= np.iinfo(dtype).max:
+            return dtype, gl_type
+    raise ValueError('Too many vertices to index: {}'.format(vertex_count))
+
+
+def split_elements(elements, max_vertices):
+    """
+    Splits a triangle list into consecutive sub-draws that each reference a
+    range of fewer than max_vertices vertices. The indices of each sub-draw
+    are rebased to the first vertex it references, so they can be stored in
+    a narrower index type and drawn with a base vertex.
+
+    :param elements: The triangle indices of the whole mesh
+    :param max_vertices: The maximum number of vertices a sub-draw may span
+
+    :return: A list of (rebased indices, base vertex) tuples
+    """
+    triangles = np.asarray(elements, dtype=np.int64).reshape((-1, 3))
+    triangle_min = triangles.min(axis=1)
+    triangle_max = triangles.max(axis=1)
+
+    draws = []
+    start = 0
+    while start < len(triangles):
+        # The vertex range only grows as triangles are added, so the sub-draw
+        # ends at the first triangle that makes the range too wide
+        low = np.minimum.accumulate(triangle_min[start:])
+        high = np.maximum.accumulate(triangle_max[start:])
+        too_wide = (high - low) >= max_vertices
+        if too_wide[0]:
+            raise ValueError('A triangle spans more than {} vertices'
+                             .format(max_vertices))
+        end = start + (int(np.argmax(too_wide)) if too_wide.any()
+                       else len(too_wide))
+
+        base_vertex = int(low[end - start - 1])
+        draws.append((triangles[start:end].ravel() - base_vertex, base_vertex))
+        start = end
+
+    return draws
+
+
+class Mesh(object):
+    """
+    Geometry that has been buffered to the GPU. A mesh owns its vertex array
+    object and buffers, and can be drawn by any number of scene objects.
+    """
+    vao = 0
+    buffers = []
+
+    # Index type and (count, byte offset, base vertex) of each sub-draw
+    index_type = GL_UNSIGNED_SHORT
+    draw_ranges = []
+
+    def __init__(self, vertices, normals, elements, texture_uv=None):
+        """
+        Constructor. Stores the geometry to be buffered.
+
+        :param vertices: The flattened vertex positions
+        :param normals: The flattened vertex normals
+        :param elements: The triangle indices
+        :param texture_uv: The flattened texture coordinates, or None if the
+                           mesh is not textured
+        """
+        self.vertices = np.asarray(vertices, dtype=np.float32)
+        self.normals = np.asarray(normals, dtype=np.float32)
+        self.elements = np.asarray(elements)
+        self.texture_uv = (None if texture_uv is None
+                           else np.asarray(texture_uv, dtype=np.float32))
+        self.vertex_count = len(self.vertices) // 3
+
+        # Bounding box (as a center and half-extents) and bounding sphere
+        # around the box center, in model space, for culling
+        positions = self.vertices.reshape((-1, 3)).astype(np.float64)
+        if len(positions):
+            low, high = positions.min(axis=0), positions.max(axis=0)
+            self.center = (low + high) / 2.0
+            self.extents = (high - low) / 2.0
+            self.radius = float(np.linalg.norm(positions - self.center,
+                                               axis=1).max())
+        else:
+            self.center = np.zeros(3)
+            self.extents = np.zeros(3)
+            self.radius = 0.0
+
+    def upload(self, shader_program, max_draw_vertices=None):
+        """
+        Buffers the vertex, element, normal and texture data to the GPU.
+
+        Elements are stored in the narrowest index type that can address the
+        mesh. If max_draw_vertices is given, the mesh is split into sub-draws
+        that each span fewer vertices than that, so that large meshes can
+        still use narrow indices.
+
+        :param shader_program: The ShaderProgram to be used with this mesh
+        :param max_draw_vertices: The maximum number of vertices a single draw
+                                  call may span, or None for a single draw
+        """
+        elements = self.pack_elements(max_draw_vertices)
+        textured = self.texture_uv is not None
+
+        # Generate a Vertex Array Object
+        self.vao = glGenVertexArrays(1)
+        glBindVertexArray(self.vao)
+
+        # Generate buffers for elements and vertices
+        self.buffers = glGenBuffers(2)
+
+        # Buffer element data
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.buffers[0])
+        glBufferData(GL_ELEMENT_ARRAY_BUFFER, elements, GL_STATIC_DRAW)
+
+        # Buffer vertex data (position, normal and texture)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffers[1])
+        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes + self.normals.nbytes
+                     + (self.texture_uv.nbytes if textured else 0),
+                     None, GL_STATIC_DRAW)
+        glBufferSubData(GL_ARRAY_BUFFER, 0,
+                        self.vertices.nbytes, self.vertices)
+        glBufferSubData(GL_ARRAY_BUFFER, self.vertices.nbytes,
+                        self.normals.nbytes, self.normals)
+        if textured:
+            glBufferSubData(GL_ARRAY_BUFFER, self.vertices.nbytes + self.normals.nbytes,
+                            self.texture_uv.nbytes, self.texture_uv)
+
+        self.bind_attributes(shader_program)
+
+        # Unbind the buffer objects
+        glBindVertexArray(0)
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def bind_attributes(self, shader_program):
+        """
+        Binds the buffers of the mesh to the currently bound vertex array
+        object and points the vertex attributes of a shader program at them.
+
+        :param shader_program: The ShaderProgram to be used with this mesh
+        """
+        textured = self.texture_uv is not None
+
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.buffers[0])
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffers[1])
+
+        # Set attribute pointers in the shader program
+        vertex_location = shader_program.attribute_location("vPosition")
+        normal_location = shader_program.attribute_location("vNormal")
+
+        glVertexAttribPointer(vertex_location, 3, GL_FLOAT, GL_FALSE, 0,
+                              c_void_p(0))
+        glVertexAttribPointer(normal_location, 3, GL_FLOAT, GL_FALSE, 0,
+                              c_void_p(self.vertices.nbytes))
+
+        glEnableVertexAttribArray(vertex_location)
+        glEnableVertexAttribArray(normal_location)
+
+        if textured:
+            texture_location = shader_program.attribute_location("vTexCoords")
+            glVertexAttribPointer(texture_location, 2, GL_FLOAT, GL_FALSE, 0,
+                                  c_void_p(self.vertices.nbytes + self.normals.nbytes))
+            glEnableVertexAttribArray(texture_location)
+
+    def pack_elements(self, max_draw_vertices=None):
+        """
+        Converts the elements of the mesh to the narrowest usable index type
+        and records the sub-draws needed to render them.
+
+        :param max_draw_vertices: The maximum number of vertices a single draw
+                                  call may span, or None for a single draw
+
+        :return: The packed element array to be buffered
+        """
+        if max_draw_vertices is None or self.vertex_count <= max_draw_vertices:
+            dtype, self.index_type = index_type(self.vertex_count)
+            self.draw_ranges = [(len(self.elements), 0, 0)]
+            return self.elements.astype(dtype)
+
+        dtype, self.index_type = index_type(max_draw_vertices)
+        draws = split_elements(self.elements, max_draw_vertices)
+
+        self.draw_ranges = []
+        offset = 0
+        for indices, base_vertex in draws:
+            self.draw_ranges.append((len(indices), offset, base_vertex))
+            offset += len(indices) * np.dtype(dtype).itemsize
+
+        return np.concatenate([indices for indices, _ in draws]).astype(dtype)
+
+    def draw(self, instance_count=None):
+        """
+        Renders the mesh, issuing one draw call per sub-draw. The vertex array
+        object is expected to be bound.
+
+        :param instance_count: The number of instances to be drawn, or None
+                               for a non-instanced draw
+
+        :return: The number of draw calls issued
+        """
+        for count, offset, base_vertex in self.draw_ranges:
+            if instance_count is None and base_vertex == 0:
+                glDrawElements(GL_TRIANGLES, count, self.index_type,
+                               c_void_p(offset))
+            elif instance_count is None:
+                glDrawElementsBaseVertex(GL_TRIANGLES, count, self.index_type,
+                                         c_void_p(offset), base_vertex)
+            elif base_vertex == 0:
+                glDrawElementsInstanced(GL_TRIANGLES, count, self.index_type,
+                                        c_void_p(offset), instance_count)
+            else:
+                glDrawElementsInstancedBaseVertex(GL_TRIANGLES, count,
+                                                  self.index_type,
+                                                  c_void_p(offset),
+                                                  instance_count, base_vertex)
+        return len(self.draw_ranges)
+
+    def delete(self):
+        """
+        Frees the vertex array object and buffers of the mesh.
+        """
+        if self.vao:
+            glDeleteVertexArrays(1, [self.vao])
+            glDeleteBuffers(len(self.buffers), self.buffers)
+            self.vao = 0
+            self.buffers = []
+
+
+class MeshRegistry(object):
+    """
+    Keeps one mesh per distinct combination of generator and tessellation
+    parameters, so identical objects are tessellated and buffered only once.
+    """
+
+    def __init__(self):
+        """
+        Constructor. Starts with no meshes.
+        """
+        self.meshes = {}
+
+    def __len__(self):
+        return len(self.meshes)
+
+    def get(self, key, build):
+        """
+        Returns the mesh registered under a key, building and registering it
+        first if there is none.
+
+        :param key: A hashable key identifying the generator and its parameters
+        :param build: A function taking no arguments that returns a new,
+                      uploaded mesh
+
+        :return: The shared mesh
+        """
+        mesh = self.meshes.get(key)
+        if mesh is None:
+            mesh = build()
+            self.meshes[key] = mesh
+        return mesh
+
+    def clear(self):
+        """
+        Frees all registered meshes. Must be called while the OpenGL context
+        they were created in is current.
+        """
+        for mesh in self.meshes.values():
+            mesh.delete()
+        self.meshes.clear()
+
+
+# The registry shared by all scene objects
+mesh_registry = MeshRegistry()
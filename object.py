@@ -5,11 +5,13 @@ Contains the base class SceneObject from which all objects making up the
 scene are derived.
 """
 
-import math
+import copy
 import numpy as np
 from OpenGL.GL import *
-from pysoil import *
-from ctypes import c_void_p
+from mesh import Mesh, mesh_registry
+from texture_loader import texture_loader
+from texture_manager import texture_manager
+from transform_store import transform_store
 
 class SceneObject(object):
     """
@@ -17,130 +19,222 @@ class SceneObject(object):
     buffer data to the GPU, perform model transforms and render the object.
     """
     vertices = np.array([], dtype=np.float32)
-    elements = np.array([], dtype=np.float32)
+    elements = np.array([], dtype=np.uint32)
     normals = np.array([], dtype=np.float32)
     texture_uv = np.array([], dtype=np.float32)
-    transform = np.identity(4, dtype=np.float32)
 
     texture = 0
-    vao = GLuint(0)
+    texture_layers = 1
+    mesh = None
+
+    # The meshes the object can be drawn with, finest first. The mesh drawn
+    # is picked from these each frame (see lod.py). Set through set_lods.
+    lods = []
+
+    # Bumped whenever the meshes of any object are set, so the components
+    # caching the bounds of each object's meshes know to gather them again
+    mesh_version = 0
+
+    # Whether the object is solid enough to hide what is behind its bounding
+    # box, so it can be used as an occluder (see occlusion.py)
+    occluder = False
+
+    shader_program = None
+
+    # Index of the object's transform in the shared transform store
+    index = 0
 
     k_ambient = np.array([], dtype=np.float32)
     k_diffuse = np.array([], dtype=np.float32)
     k_specular = np.array([], dtype=np.float32)
     shininess = 0.0
 
+    def __init__(self):
+        """
+        Constructor. Allocates an identity transform for the object in the
+        shared transform store.
+        """
+        self.index = int(transform_store.allocate()[0])
+
+    @property
+    def transform(self):
+        """
+        The current 4x4 model matrix of the object.
+        """
+        return transform_store.matrices(self.index)
+
     def load_texture(self, texture_path):
         """
-        Creates a texture from an image.
+        Creates a texture from an image. The image is decoded in the
+        background and uploaded when texture_loader.finish is called.
 
         :param texture_path: The path of the texture image.
         """
         try:
-            self.texture = SOIL_load_OGL_texture(
-                texture_path,
-                SOIL_LOAD_AUTO,
-                SOIL_CREATE_NEW_ID,
-                SOIL_FLAG_INVERT_Y | SOIL_FLAG_TEXTURE_REPEATS
-            )
-
-        except Exception as soil_ex:
-            print('SOIL_load_OGL_texture ERROR', soil_ex)
-
-    def set_buffers(self, shader_program):
-        """
-        Buffers the vertex, element, normal and texture data to the GPU.
-
-        :param shader_program: A unique ID for the shader_program to be used
-                               with this object
-        """
-        # Generate a Vertex Array Object
-        self.vao = glGenVertexArrays(1)
-        glBindVertexArray(self.vao)
-
-        # Generate buffers for elements and vertices
-        buffer_objects = glGenBuffers(2)
-
-        # Buffer element data
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, buffer_objects[0])
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, self.elements, GL_STATIC_DRAW)
-
-        # Buffer vertex data (position, normal and texture)
-        glBindBuffer(GL_ARRAY_BUFFER, buffer_objects[1])
-        glBufferData(GL_ARRAY_BUFFER, self.vertices.nbytes + self.normals.nbytes
-                     + (self.texture_uv.nbytes if self.texture > 0 else 0),
-                     None, GL_STATIC_DRAW)
-        glBufferSubData(GL_ARRAY_BUFFER, 0,
-                        self.vertices.nbytes, self.vertices)
-        glBufferSubData(GL_ARRAY_BUFFER, self.vertices.nbytes,
-                        self.normals.nbytes, self.normals)
-        if self.texture > 0:
-            glBufferSubData(GL_ARRAY_BUFFER, self.vertices.nbytes + self.normals.nbytes,
-                            self.texture_uv.nbytes, self.texture_uv)
+            self.texture = texture_loader.load(texture_path)
 
-        glUseProgram(shader_program)
+        except Exception as texture_ex:
+            print('load_texture ERROR', texture_ex)
 
-        # Set attribute pointers in the shader program
-        vertex_location = glGetAttribLocation(shader_program, "vPosition")
-        normal_location = glGetAttribLocation(shader_program, "vNormal")
+    def load_texture_array(self, texture_paths):
+        """
+        Creates an array texture with one layer per image. The images must all
+        have the same size. Like load_texture, they are decoded in the
+        background.
 
-        glVertexAttribPointer(vertex_location, 3, GL_FLOAT, GL_FALSE, 0,
-                              c_void_p(0))
-        glVertexAttribPointer(normal_location, 3, GL_FLOAT, GL_FALSE, 0,
-                              c_void_p(self.vertices.nbytes))
+        :param texture_paths: The paths of the texture images, in layer order
+        """
+        try:
+            self.texture = texture_loader.load_array(texture_paths)
+            self.texture_layers = len(texture_paths)
 
-        glEnableVertexAttribArray(vertex_location)
-        glEnableVertexAttribArray(normal_location)
+        except Exception as texture_ex:
+            print('load_texture_array ERROR', texture_ex)
 
-        if self.texture > 0:
-            texture_location = glGetAttribLocation(shader_program, "vTexCoords")
-            glVertexAttribPointer(texture_location, 2, GL_FLOAT, GL_FALSE, 0,
-                                  c_void_p(self.vertices.nbytes + self.normals.nbytes))
-            glEnableVertexAttribArray(texture_location)
+    def set_buffers(self, shader_program, max_draw_vertices=None):
+        """
+        Creates a mesh from the vertex, element, normal and texture data of
+        the object and buffers it to the GPU.
 
-        # Unbind the buffer objects
-        glBindVertexArray(0)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
-        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        :param shader_program: The ShaderProgram to be used with this object
+        :param max_draw_vertices: The maximum number of vertices a single draw
+                                  call may span, or None for a single draw
+        """
+        self.shader_program = shader_program
+        self.mesh = Mesh(self.vertices, self.normals, self.elements,
+                         self.texture_uv if self.texture > 0 else None)
+        self.mesh.upload(shader_program, max_draw_vertices)
 
-    def draw(self, shader_program):
+    def load_mesh(self, shader_program, *params):
         """
-        Sends the required parameters to the vertex shader and renders the
-        shape.
+        Sets the mesh of the object, sharing it with every other object of the
+        same class created with the same tessellation parameters. The shape is
+        only tessellated and buffered the first time a combination is seen.
 
-        :param shader_program: A unique ID for the shader_program to be used
+        :param shader_program: The ShaderProgram to be used with this object
+        :param *params: The parameters passed on to tessellate
         """
-        glUseProgram(shader_program)
-        glBindVertexArray(self.vao)
+        key = (type(self), shader_program, self.texture > 0) + params
 
-        # Pass the model matrix to the shader
-        model_location = glGetUniformLocation(shader_program, "model")
-        glUniformMatrix4fv(model_location, 1, GL_FALSE,
-                           self.transform.transpose().reshape((1, 16)))
+        def build():
+            self.tessellate(*params)
+            self.set_buffers(shader_program)
+            return self.mesh
 
-        # Pass the material properties to the shader
-        ambient_location = glGetUniformLocation(shader_program, "k_a")
-        diffuse_location = glGetUniformLocation(shader_program, "k_d")
-        specular_location = glGetUniformLocation(shader_program, "k_s")
-        shininess_location = glGetUniformLocation(shader_program, "n")
+        self.shader_program = shader_program
+        self.set_lods([mesh_registry.get(key, build)])
 
-        glUniform3fv(ambient_location, 1, self.k_ambient)
-        glUniform3fv(diffuse_location, 1, self.k_diffuse)
-        glUniform3fv(specular_location, 1, self.k_specular)
-        glUniform1f(shininess_location, self.shininess)
+    def load_lods(self, shader_program, levels):
+        """
+        Sets a chain of meshes of decreasing detail for the object, each
+        shared through the mesh registry like the mesh set by load_mesh. The
+        object starts out drawn with the finest mesh.
+
+        :param shader_program: The ShaderProgram to be used with this object
+        :param levels: A list with the parameters passed on to tessellate for
+                       each level of detail, finest first
+        """
+        lods = []
+        for params in levels:
+            self.load_mesh(shader_program, *params)
+            lods.append(self.mesh)
+
+        self.set_lods(lods)
+
+    def set_lods(self, lods):
+        """
+        Sets the chain of meshes the object can be drawn with, and starts
+        drawing it with the finest. The meshes of an object should only be
+        changed through this method, so cached bounds are gathered again.
+
+        :param lods: A list of meshes of decreasing detail, finest first
+        """
+        self.lods = list(lods)
+        self.mesh = self.lods[0]
+        SceneObject.mesh_version += 1
+
+    def copies(self, indices):
+        """
+        Creates objects sharing the meshes, shader program, texture and
+        material of this object, each with an existing transform. No meshes
+        are looked up, so this is much cheaper than constructing the objects.
+
+        :param indices: The indices of the transforms of the new objects in
+                        the shared transform store
+
+        :return: A list of the new objects
+        """
+        objects = []
+        for index in indices:
+            obj = copy.copy(self)
+            obj.index = int(index)
+            objects.append(obj)
+        return objects
+
+    def material(self):
+        """
+        Returns the material properties of the object in a hashable form, so
+        objects can be grouped and sorted by material.
+
+        :return: An (ambient, diffuse, specular, shininess) tuple
+        """
+        return (tuple(self.k_ambient), tuple(self.k_diffuse),
+                tuple(self.k_specular), self.shininess)
+
+    def draw(self, shader_program, model_view, normal, model_view_projection):
+        """
+        Sends the required parameters to the vertex shader and renders the
+        shape.
+
+        :param shader_program: The ShaderProgram to be used
+        :param model_view: The 4x4 model-view matrix of the object
+        :param normal: The 3x3 normal matrix of the object
+        :param model_view_projection: The 4x4 model-view-projection matrix of
+                                      the object
+        """
+        shader_program.use()
+        glBindVertexArray(self.mesh.vao)
 
         # Pass texture data to the sampler if the object has a texure
         if self.texture > 0:
-            glActiveTexture(GL_TEXTURE0 + self.texture)
-            glBindTexture(GL_TEXTURE_2D, self.texture)
-            tex_sampler_location = glGetUniformLocation(shader_program, "tex")
-            glUniform1i(tex_sampler_location, self.texture)
+            texture_manager.bind(self.texture)
+
+        self.set_uniforms(shader_program, model_view, normal,
+                          model_view_projection)
 
         # Render the object
-        glDrawElements(GL_TRIANGLES, len(self.elements), GL_UNSIGNED_SHORT, None)
+        self.mesh.draw()
 
         glBindVertexArray(0)
 
+    def set_uniforms(self, shader_program, model_view, normal,
+                     model_view_projection):
+        """
+        Sends the transformation matrices, material properties and texture
+        sampler of the object to a shader program. Values that the program
+        already holds are not sent again.
+
+        :param shader_program: The ShaderProgram to be used
+        :param model_view: The 4x4 model-view matrix of the object
+        :param normal: The 3x3 normal matrix of the object
+        :param model_view_projection: The 4x4 model-view-projection matrix of
+                                      the object
+        """
+        # Pass the transformation matrices to the shader
+        shader_program.set_uniform("modelView", model_view.T)
+        shader_program.set_uniform("normalMatrix", normal.T)
+        shader_program.set_uniform("modelViewProjection", model_view_projection.T)
+
+        # Pass the material properties to the shader
+        shader_program.set_uniform("k_a", self.k_ambient)
+        shader_program.set_uniform("k_d", self.k_diffuse)
+        shader_program.set_uniform("k_s", self.k_specular)
+        shader_program.set_uniform("n", self.shininess)
+
+        if self.texture > 0:
+            shader_program.set_uniform("tex", texture_manager.unit(self.texture))
+            shader_program.set_uniform("textureLayers", self.texture_layers)
+
     def scale(self, x, y, z):
         """
         Modifies the current model transform to scale the object.
@@ -149,11 +243,7 @@ class SceneObject(object):
         :param y: The scale value in the y-direction
         :param z: The scale value in the z-direction
         """
-        scale_mat = np.array([[x, 0.0, 0.0, 0.0],
-                              [0.0, y, 0.0, 0.0],
-                              [0.0, 0.0, z, 0.0],
-                              [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
-        self.transform = scale_mat @ self.transform
+        transform_store.scale(self.index, x, y, z)
 
     def rotate(self, x, y, z):
         """
@@ -164,31 +254,7 @@ class SceneObject(object):
         :param y: The rotation angle (in degrees) in the y-direction
         :param z: The rotation angle (in degrees) in the z-direction
         """
-        x = math.radians(x)
-        y = math.radians(y)
-        z = math.radians(z)
-
-        cos_x, sin_x = math.cos(x), math.sin(x)
-        cos_y, sin_y = math.cos(y), math.sin(y)
-        cos_z, sin_z = math.cos(z), math.sin(z)
-
-        x_mat = np.array([[1.0, 0.0, 0.0, 0.0],
-                          [0.0, cos_x, -sin_x, 0.0],
-                          [0.0, sin_x, cos_x, 0.0],
-                          [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
-
-        y_mat = np.array([[cos_y, 0.0, sin_y, 0.0],
-                          [0.0, 1.0, 0.0, 0.0],
-                          [-sin_y, 0.0, cos_y, 0.0],
-                          [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
-
-        z_mat = np.array([[cos_z, -sin_z, 0.0, 0.0],
-                          [sin_z, cos_z, 0.0, 0.0],
-                          [0.0, 0.0, 1.0, 0.0],
-                          [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
-
-        # Order of rotation: y -> z -> x
-        self.transform = x_mat @ z_mat @ y_mat @ self.transform
+        transform_store.rotate(self.index, x, y, z)
 
     def translate(self, x, y, z):
         """
@@ -198,8 +264,4 @@ class SceneObject(object):
         :param y: The translation value in the y-direction
         :param z: The translation value in the z-direction
         """
-        translate_mat = np.array([[1.0, 0.0, 0.0, x],
-                                  [0.0, 1.0, 0.0, y],
-                                  [0.0, 0.0, 1.0, z],
-                                  [0.0, 0.0, 0.0, 1.0]], dtype=np.float32)
-        self.transform = translate_mat @ self.transform
+        transform_store.translate(self.index, x, y, z)
@@ -0,0 +1,363 @@
+"""
+occlusion.py
+
+Contains the OcclusionCuller class, which finds the scene objects hidden
+behind large occluders, such as the upright stones, by rasterizing the
+occluders into a small depth buffer on the CPU and testing the screen-space
+bounds of the other objects against it.
+"""
+
+import time
+import numpy as np
+from culling import world_boxes, world_spheres
+from object import SceneObject
+
+# The width and height of the depth buffer in pixels. Must be a power of two.
+DEFAULT_SIZE = 64
+
+# The number of occluders rasterized per frame, largest on screen first
+MAX_OCCLUDERS = 16
+
+# Points closer to the eye plane than this (in clip space w) are treated as
+# being behind the eye, and boxes with such corners are not used or tested
+MIN_W = 1e-6
+
+# The corners of a box as signs of its half-extents. Bit 0 of the index is
+# set for +x, bit 1 for +y and bit 2 for +z.
+CORNER_SIGNS = np.array([[(corner >> axis & 1) * 2.0 - 1.0 for axis in range(3)]
+                         for corner in range(8)])
+
+# The corners of each face of a box, in order around the face
+FACES = np.array([[0, 2, 6, 4], [1, 3, 7, 5],
+                  [0, 1, 5, 4], [2, 3, 7, 6],
+                  [0, 1, 3, 2], [4, 5, 7, 6]])
+
+# The twelve edges of a box as pairs of corners, and the two faces meeting
+# at each edge
+EDGES = np.array([[a, b] for a in range(8) for b in range(a + 1, 8)
+                  if bin(a ^ b).count('1') == 1])
+EDGE_FACES = np.array([[face for face in range(6)
+                        if a in FACES[face] and b in FACES[face]]
+                       for a, b in EDGES])
+
+
+class OcclusionCuller(object):
+    """
+    A software occlusion culling stage. Each frame, the oriented bounding
+    boxes of the largest occluders on screen are rasterized into a low
+    resolution depth buffer with NumPy, all occluders at once. Every other
+    visible object's bounding box is projected to a screen rectangle and its
+    nearest depth, and the object is culled if the depth buffer is nearer
+    than that everywhere in the rectangle.
+
+    The test is conservative. Occluders only fill pixels their silhouette
+    covers completely, at the farthest depth their surface reaches within
+    the pixel, and objects are compared with the farthest depth in a
+    mip-mapped maximum of the buffer, so visible objects are never culled.
+    """
+
+    def __init__(self, size=DEFAULT_SIZE, max_occluders=MAX_OCCLUDERS):
+        """
+        Constructor.
+
+        :param size: The width and height of the depth buffer in pixels, a
+                     power of two
+        :param max_occluders: The number of occluders rasterized per frame
+        """
+        if size < 1 or size & (size - 1):
+            raise ValueError('The depth buffer size must be a power of two')
+
+        self.size = size
+        self.max_occluders = max_occluders
+        self.objects = []
+        self.mesh_version = -1
+        self.occluders = np.zeros(0, dtype=bool)
+        self.centers = np.zeros((0, 3))
+        self.extents = np.zeros((0, 3))
+        self.radii = np.zeros(0)
+        self.depth = np.full((size, size), np.inf)
+        self.levels = []
+
+        # Pixel centers in normalized device coordinates
+        coords = (np.arange(size) + 0.5) * (2.0 / size) - 1.0
+        grid_y, grid_x = np.meshgrid(coords, coords, indexing='ij')
+        self.pixel_x = grid_x.ravel().astype(np.float32)
+        self.pixel_y = grid_y.ravel().astype(np.float32)
+
+        # Statistics of the last frame
+        self.occluder_count = 0
+        self.tested_count = 0
+        self.occluded_count = 0
+        self.rasterize_seconds = 0.0
+        self.test_seconds = 0.0
+
+    def __repr__(self):
+        return ('occluders: {}, occluded objects: {} of {}, rasterize: '
+                '{:.2f} ms, test: {:.2f} ms'.format(
+                    self.occluder_count, self.occluded_count, self.tested_count,
+                    self.rasterize_seconds * 1000, self.test_seconds * 1000))
+
+    def set_objects(self, objects):
+        """
+        Gathers the model space bounds of the finest meshes of a list of
+        objects, and which of them are occluders.
+
+        :param objects: The scene objects, in the order of the transforms
+                        later passed to cull
+        """
+        self.objects = list(objects)
+        self.mesh_version = SceneObject.mesh_version
+        self.occluders = np.array([obj.occluder for obj in self.objects],
+                                  dtype=bool)
+        self.centers = np.array([obj.lods[0].center for obj in self.objects]
+                                ).reshape((-1, 3))
+        self.extents = np.array([obj.lods[0].extents for obj in self.objects]
+                                ).reshape((-1, 3))
+        self.radii = np.array([obj.lods[0].radius for obj in self.objects])
+
+    def cull(self, camera, objects, transforms, visible):
+        """
+        Removes the objects hidden behind occluders from a selection.
+
+        :param camera: The Camera the objects are viewed from
+        :param objects: The scene objects
+        :param transforms: An (N, 4, 4) array of the model matrices of the
+                           objects
+        :param visible: A boolean array of the objects inside the view
+                        frustum
+
+        :return: A boolean array of the objects that are in the frustum and
+                 not occluded
+        """
+        # Lists of the same objects compare equal without a call per object
+        if self.mesh_version != SceneObject.mesh_version or \
+                self.objects != objects:
+            self.set_objects(objects)
+
+        transforms = np.asarray(transforms, dtype=np.float64)
+        view_projection = camera.view_projection_matrix()
+
+        start = time.perf_counter()
+        self.rasterize(camera, transforms, visible, view_projection)
+        rasterized = time.perf_counter()
+        occluded = self.test(transforms, visible, view_projection)
+        self.rasterize_seconds = rasterized - start
+        self.test_seconds = time.perf_counter() - rasterized
+
+        return visible & ~occluded
+
+    def rasterize(self, camera, transforms, visible, view_projection):
+        """
+        Clears the depth buffer and rasterizes the largest visible occluders
+        into it, then builds its maximum mip chain.
+
+        :param camera: The Camera the objects are viewed from
+        :param transforms: An (N, 4, 4) array of the model matrices of the
+                           objects
+        :param visible: A boolean array of the objects inside the view
+                        frustum
+        :param view_projection: The 4x4 view-projection matrix
+        """
+        self.depth = np.full((self.size, self.size), np.inf)
+
+        # Pick the occluders with the largest angular size
+        candidates = np.flatnonzero(self.occluders & visible)
+        centers, radii = world_spheres(transforms[candidates],
+                                       self.centers[candidates],
+                                       self.radii[candidates])
+        distances = np.linalg.norm(centers - camera.eyepoint, axis=1)
+        order = np.argsort(-radii / np.maximum(distances, MIN_W))
+        chosen = candidates[order[:self.max_occluders]]
+
+        # Oriented box corners in world space, then clip space
+        model_corners = (self.centers[chosen, np.newaxis, :]
+                         + self.extents[chosen, np.newaxis, :] * CORNER_SIGNS)
+        world = (np.einsum('bij,bkj->bki', transforms[chosen, :3, :3],
+                           model_corners)
+                 + transforms[chosen, np.newaxis, :3, 3])
+        clip = world @ view_projection[:3, :3].T + view_projection[:3, 3]
+        w = world @ view_projection[3, :3] + view_projection[3, 3]
+
+        # Boxes reaching behind the eye would not project to a convex shape
+        in_front = np.all(w > MIN_W, axis=1)
+        world, clip, w = world[in_front], clip[in_front], w[in_front]
+        self.occluder_count = len(world)
+        if self.occluder_count > 0:
+            ndc = clip / w[:, :, np.newaxis]
+            depth = self.box_depths(camera, world, ndc).min(axis=0)
+            self.depth = depth.reshape((self.size, self.size))
+
+        # Each level holds the farthest depth of a 2x2 block of the last
+        self.levels = [self.depth]
+        while len(self.levels[-1]) > 1:
+            half = len(self.levels[-1]) // 2
+            self.levels.append(self.levels[-1].reshape((half, 2, half, 2))
+                               .max(axis=(1, 3)))
+
+    def box_depths(self, camera, world, ndc):
+        """
+        Rasterizes boxes into separate depth buffers. A pixel is covered when
+        it lies completely inside the silhouette of a box, and its depth is
+        then the farthest depth the front of the box reaches in the pixel.
+        The front of a convex box is the maximum of the planes of its front
+        faces, which stay planes in normalized device coordinates.
+
+        :param camera: The Camera the boxes are viewed from
+        :param world: A (B, 8, 3) array of the corners of each box in world
+                      space
+        :param ndc: A (B, 8, 3) array of the same corners in normalized
+                    device coordinates
+
+        :return: A (B, pixels) array of depths, infinite where not covered
+        """
+        half_pixel = 1.0 / self.size
+        box_count = len(world)
+        box_centers = world.mean(axis=1)
+
+        # Front-facing faces, from outward normals of the world space box
+        face_points = world[:, FACES]
+        normals = np.cross(face_points[:, :, 1] - face_points[:, :, 0],
+                           face_points[:, :, 2] - face_points[:, :, 0])
+        face_centers = face_points.mean(axis=2)
+        outward = np.sign(np.einsum('bfi,bfi->bf', normals,
+                                    face_centers - box_centers[:, np.newaxis]))
+        front = np.einsum('bfi,bfi->bf', normals * outward[:, :, np.newaxis],
+                          camera.eyepoint - face_centers) > 0.0
+
+        # The silhouette is where exactly one face at an edge faces the
+        # camera. Each silhouette edge gives a half-plane x*a + y*b + c >= 0
+        # holding the projected box center.
+        silhouette = front[:, EDGE_FACES[:, 0]] != front[:, EDGE_FACES[:, 1]]
+        start = ndc[:, EDGES[:, 0], :2]
+        delta = ndc[:, EDGES[:, 1], :2] - start
+        edge_a = -delta[:, :, 1]
+        edge_b = delta[:, :, 0]
+        edge_c = delta[:, :, 1] * start[:, :, 0] - delta[:, :, 0] * start[:, :, 1]
+
+        inside = ndc.mean(axis=1)
+        flip = np.where(edge_a * inside[:, np.newaxis, 0]
+                        + edge_b * inside[:, np.newaxis, 1] + edge_c < 0.0,
+                        -1.0, 1.0)
+        edge_a = np.where(silhouette, edge_a * flip, 0.0)
+        edge_b = np.where(silhouette, edge_b * flip, 0.0)
+        edge_c = np.where(silhouette, edge_c * flip, 1.0)
+
+        # A silhouette has at most six edges, so only those are evaluated
+        edge_order = np.argsort(~silhouette, axis=1, kind='stable')[:, :6]
+        edge_a = np.take_along_axis(edge_a, edge_order, axis=1)
+        edge_b = np.take_along_axis(edge_b, edge_order, axis=1)
+        edge_c = np.take_along_axis(edge_c, edge_order, axis=1)
+
+        # Require the whole pixel, not just its center, inside each edge
+        edge_c = edge_c - half_pixel * (np.abs(edge_a) + np.abs(edge_b))
+        covered = np.all(self.evaluate(edge_a, edge_b, edge_c) >= 0.0, axis=1)
+        covered &= np.any(silhouette, axis=1)[:, np.newaxis]
+
+        # The plane depth = a*x + b*y + c of each face in normalized device
+        # coordinates. Faces seen edge on fall back to the farthest corner.
+        farthest = ndc[:, :, 2].max(axis=1)
+        face_ndc = ndc[:, FACES]
+        plane = np.cross(face_ndc[:, :, 1] - face_ndc[:, :, 0],
+                         face_ndc[:, :, 2] - face_ndc[:, :, 0])
+        degenerate = np.abs(plane[:, :, 2]) <= 1e-9 * np.linalg.norm(plane, axis=2)
+        plane_z = np.where(degenerate, 1.0, plane[:, :, 2])
+        plane_a = np.where(degenerate, 0.0, -plane[:, :, 0] / plane_z)
+        plane_b = np.where(degenerate, 0.0, -plane[:, :, 1] / plane_z)
+        plane_c = np.where(degenerate, farthest[:, np.newaxis],
+                           face_ndc[:, :, 0, 2] - plane_a * face_ndc[:, :, 0, 0]
+                           - plane_b * face_ndc[:, :, 0, 1])
+
+        # The farthest depth of each plane within the pixel. At most three
+        # faces of a box face the camera, and back faces are left out of the
+        # maximum.
+        plane_c = plane_c + half_pixel * (np.abs(plane_a) + np.abs(plane_b))
+        plane_c = np.where(front, plane_c, -np.inf)
+        face_order = np.argsort(~front, axis=1, kind='stable')[:, :3]
+        plane_a = np.take_along_axis(plane_a, face_order, axis=1)
+        plane_b = np.take_along_axis(plane_b, face_order, axis=1)
+        plane_c = np.take_along_axis(plane_c, face_order, axis=1)
+
+        depth = self.evaluate(plane_a, plane_b, plane_c).max(axis=1)
+        depth = np.minimum(depth, farthest[:, np.newaxis])
+
+        return np.where(covered, depth, np.inf).reshape((box_count, -1))
+
+    def evaluate(self, a, b, c):
+        """
+        Evaluates linear functions a*x + b*y + c at every pixel center, in
+        single precision to halve the memory traffic.
+
+        :param a: A (B, K) array of x coefficients
+        :param b: A (B, K) array of y coefficients
+        :param c: A (B, K) array of constants
+
+        :return: A (B, K, pixels) array of values
+        """
+        values = a.astype(np.float32)[:, :, np.newaxis] * self.pixel_x
+        values += b.astype(np.float32)[:, :, np.newaxis] * self.pixel_y
+        values += c.astype(np.float32)[:, :, np.newaxis]
+        return values
+
+    def test(self, transforms, visible, view_projection):
+        """
+        Tests the bounding boxes of the visible objects against the depth
+        buffer. Each box is projected to a rectangle of pixels, and the
+        farthest depth in the rectangle is read from the mip level where it
+        spans at most 2x2 texels.
+
+        :param transforms: An (N, 4, 4) array of the model matrices of the
+                           objects
+        :param visible: A boolean array of the objects inside the view
+                        frustum
+        :param view_projection: The 4x4 view-projection matrix
+
+        :return: A boolean array, True for each object that is occluded
+        """
+        occluded = np.zeros(len(visible), dtype=bool)
+        tested = np.flatnonzero(visible)
+        self.tested_count = len(tested)
+        self.occluded_count = 0
+        if self.occluder_count == 0 or len(tested) == 0:
+            return occluded
+
+        centers, extents = world_boxes(transforms[tested], self.centers[tested],
+                                       self.extents[tested])
+        corners = centers[:, np.newaxis, :] + extents[:, np.newaxis, :] * CORNER_SIGNS
+        clip = corners @ view_projection[:3, :3].T + view_projection[:3, 3]
+        w = corners @ view_projection[3, :3] + view_projection[3, 3]
+
+        # Objects reaching behind the eye are kept
+        in_front = np.all(w > MIN_W, axis=1)
+        tested, clip, w = tested[in_front], clip[in_front], w[in_front]
+        ndc = clip / w[:, :, np.newaxis]
+        nearest = ndc[:, :, 2].min(axis=1)
+
+        # The rectangle of pixels the box touches, inclusive
+        low = np.floor((ndc[:, :, :2].min(axis=1) + 1.0) * (self.size / 2.0))
+        high = np.floor((ndc[:, :, :2].max(axis=1) + 1.0) * (self.size / 2.0))
+        low = np.clip(low, 0, self.size - 1).astype(np.int64)
+        high = np.clip(high, 0, self.size - 1).astype(np.int64)
+
+        # The first level at which the rectangle spans at most 2x2 texels
+        level = np.zeros(len(tested), dtype=np.int64)
+        span = np.max(high - low, axis=1)
+        while np.any(span > 1):
+            wide = span > 1
+            level[wide] += 1
+            span = np.max((high >> level[:, np.newaxis])
+                          - (low >> level[:, np.newaxis]), axis=1)
+
+        farthest = np.full(len(tested), -np.inf)
+        for index, depth in enumerate(self.levels):
+            selected = np.flatnonzero(level == index)
+            if len(selected) == 0:
+                continue
+            x0, y0 = (low[selected] >> index).T
+            x1, y1 = (high[selected] >> index).T
+            farthest[selected] = np.max([depth[y0, x0], depth[y0, x1],
+                                         depth[y1, x0], depth[y1, x1]], axis=0)
+
+        hidden = nearest > farthest
+        occluded[tested[hidden]] = True
+        self.occluded_count = int(np.count_nonzero(hidden))
+        return occluded
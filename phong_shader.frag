@@ -0,0 +1,100 @@
+#version 150
+
+// Shared by every Phong material. Features are switched on by #define lines
+// inserted after the version line (see shader_variants.py):
+//   TEXTURED  - modulates the lighting with an array texture, picking a
+//               layer per tile (repetition of the texture)
+//   INSTANCED - takes the material from the vertex shader instead of uniforms
+
+// Vertex position (in camera space)
+in vec3 vPositionCam;
+
+// Surface Normal (in camera space)
+in vec3 normalCam;
+
+#ifdef TEXTURED
+// Texture Coordinates
+in vec2 texCoords;
+#endif
+
+// Camera and light state shared by every shader program. Written once per
+// frame by FrameUniforms in uniform_buffer.py.
+layout(std140) uniform FrameUniforms
+{
+    // Transformation matrices
+    mat4 view;
+    mat4 projection;
+
+    // Light position (in camera space)
+    vec3 lightPositionCam;
+
+    // Light intensities for ambient, diffuse and specular components
+    vec3 I_a;
+    vec3 I_d;
+    vec3 I_s;
+};
+
+#ifdef INSTANCED
+// Material properties of the instance
+flat in vec3 materialAmbient;
+flat in vec3 materialDiffuse;
+flat in vec3 materialSpecular;
+flat in float materialShininess;
+#else
+// Material properties for ambient, diffuse and specular lighting
+uniform vec3 k_a;
+uniform vec3 k_d;
+uniform vec3 k_s;
+
+// Shininess (specular exponent)
+uniform float n;
+
+#define materialAmbient k_a
+#define materialDiffuse k_d
+#define materialSpecular k_s
+#define materialShininess n
+#endif
+
+#ifdef TEXTURED
+// Texture to be mapped to object, with one variant per layer
+uniform sampler2DArray tex;
+
+// The number of layers in the texture
+uniform int textureLayers;
+
+// Picks the texture layer for the tile (repetition of the texture) that a
+// point lies in, so neighbouring tiles show different variants
+float tileLayer(vec2 coords)
+{
+    ivec2 tile = ivec2(floor(coords));
+    int hash = (tile.x * 73856093) ^ (tile.y * 19349663);
+    return float(abs(hash) % textureLayers);
+}
+#endif
+
+// Fragment color
+out vec4 finalColor;
+
+void main()
+{
+    // Calculate the required N, L, R and V vectors
+    vec3 N = normalize(normalCam);
+    vec3 L = normalize(lightPositionCam - vPositionCam);
+    vec3 R = normalize(reflect(-L, N));
+    vec3 V = normalize(-vPositionCam);
+
+    // Calculate ambient, diffuse and specular components
+    vec3 ambient = I_a * materialAmbient;
+    vec3 diffuse = I_d * materialDiffuse * max(dot(L, N), 0.0);
+    vec3 specular = I_s * materialSpecular * pow(max(dot(R, V), 0.0), materialShininess);
+
+#ifdef TEXTURED
+    // Get the texture value for the current fragment
+    vec4 texColor = texture(tex, vec3(texCoords, tileLayer(texCoords)));
+
+    // Set the final fragment color
+    finalColor = vec4(ambient + diffuse, 1.0) * texColor + vec4(specular, 1.0);
+#else
+    finalColor = vec4(ambient + diffuse + specular, 1.0);
+#endif
+}
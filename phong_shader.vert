@@ -0,0 +1,109 @@
+#version 150
+
+// Shared by every Phong material. Features are switched on by #define lines
+// inserted after the version line (see shader_variants.py):
+//   TEXTURED  - forwards texture coordinates to the fragment shader
+//   INSTANCED - reads the transforms and material of each instance from
+//               vertex attributes instead of uniforms
+
+// Vertex location (in model space)
+in vec3 vPosition;
+
+// Normal vector at vertex (in model space)
+in vec3 vNormal;
+
+#ifdef TEXTURED
+// Texture coordinates for the vertex
+in vec2 vTexCoords;
+#endif
+
+#ifdef INSTANCED
+// Model-view and normal matrices of the instance, computed once per frame
+// on the CPU
+in mat4 instanceModelView;
+in mat3 instanceNormalMatrix;
+
+// Index of the instance's material in the material arrays
+in float instanceMaterial;
+#else
+// Model-view, normal and model-view-projection matrices of the object,
+// computed once per frame on the CPU
+uniform mat4 modelView;
+uniform mat3 normalMatrix;
+uniform mat4 modelViewProjection;
+#endif
+
+// Camera and light state shared by every shader program. Written once per
+// frame by FrameUniforms in uniform_buffer.py.
+layout(std140) uniform FrameUniforms
+{
+    // Transformation matrices
+    mat4 view;
+    mat4 projection;
+
+    // Light position (in camera space)
+    vec3 lightPositionCam;
+
+    // Light intensities for ambient, diffuse and specular components
+    vec3 I_a;
+    vec3 I_d;
+    vec3 I_s;
+};
+
+#ifdef INSTANCED
+// Material properties for ambient, diffuse and specular lighting, and the
+// shininess (specular exponent), for every material used by the instances
+uniform vec3 k_a[16];
+uniform vec3 k_d[16];
+uniform vec3 k_s[16];
+uniform float n[16];
+
+// Material properties of the instance
+flat out vec3 materialAmbient;
+flat out vec3 materialDiffuse;
+flat out vec3 materialSpecular;
+flat out float materialShininess;
+#endif
+
+// Vertex position (in camera space)
+out vec3 vPositionCam;
+
+// Surface Normal (in camera space)
+out vec3 normalCam;
+
+#ifdef TEXTURED
+// Texture coordinates
+out vec2 texCoords;
+#endif
+
+void main()
+{
+#ifdef INSTANCED
+    // Transform vertex and normal to camera space
+    vec4 positionCam = instanceModelView * vec4(vPosition, 1.0);
+    vPositionCam = vec3(positionCam);
+    normalCam = normalize(instanceNormalMatrix * vNormal);
+
+    // Look up the material of the instance
+    int material = int(instanceMaterial);
+    materialAmbient = k_a[material];
+    materialDiffuse = k_d[material];
+    materialSpecular = k_s[material];
+    materialShininess = n[material];
+
+    // Transform the vertex location into clip space
+    gl_Position = projection * positionCam;
+#else
+    // Transform vertex and normal to camera space
+    vPositionCam = vec3(modelView * vec4(vPosition, 1.0));
+    normalCam = normalize(normalMatrix * vNormal);
+
+    // Transform the vertex location into clip space
+    gl_Position = modelViewProjection * vec4(vPosition, 1.0);
+#endif
+
+#ifdef TEXTURED
+    // Forward the texture coordinates to the fragment shader
+    texCoords = vTexCoords;
+#endif
+}
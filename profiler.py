@@ -0,0 +1,252 @@
+"""
+profiler.py
+
+Contains the Profiler class, which measures the CPU and GPU time spent in
+each pass and draw of a frame, and exports the results as a Chrome trace
+(viewable in chrome://tracing or Perfetto) and a per-frame CSV summary.
+"""
+
+import csv
+import ctypes
+import json
+import time
+from collections import deque
+from OpenGL.GL import *
+
+# Number of frames a timer query is left in flight before its result is read,
+# so reading it does not wait for the GPU
+DEFAULT_LATENCY = 3
+
+PASS = 'pass'
+DRAW = 'draw'
+
+
+class Span(object):
+    """
+    A named, timed section of a frame. The CPU times are taken with
+    time.perf_counter, and the GPU times are read from a pair of timestamp
+    queries once they are available.
+    """
+
+    def __init__(self, name, category, depth, start_query, end_query):
+        """
+        Constructor. Starts the CPU timer.
+
+        :param name: The name of the section, e.g. a pass or an object
+        :param category: The kind of section, PASS or DRAW
+        :param depth: The number of sections the section is nested in
+        :param start_query: The timestamp query issued at the start
+        :param end_query: The timestamp query issued at the end
+        """
+        self.name = name
+        self.category = category
+        self.depth = depth
+        self.start_query = start_query
+        self.end_query = end_query
+        self.cpu_start = time.perf_counter()
+        self.cpu_end = self.cpu_start
+        self.gpu_start = 0
+        self.gpu_end = 0
+
+    def cpu_time(self):
+        """
+        :return: The CPU time of the section in milliseconds
+        """
+        return (self.cpu_end - self.cpu_start) * 1000.0
+
+    def gpu_time(self):
+        """
+        :return: The GPU time of the section in milliseconds
+        """
+        return (self.gpu_end - self.gpu_start) / 1.0e6
+
+
+class Profiler(object):
+    """
+    Records CPU and GPU spans for passes and draws. Spans may be nested, so
+    the GPU side uses GL_TIMESTAMP queries rather than GL_TIME_ELAPSED, which
+    cannot be nested. The queries of a frame are read back a few frames
+    later, when their results are already available, and are then recycled.
+    """
+
+    def __init__(self, latency=DEFAULT_LATENCY):
+        """
+        Constructor. Records the CPU and GPU clocks at the same moment so GPU
+        timestamps can be placed on the CPU timeline.
+
+        :param latency: The number of frames to wait before reading queries
+        """
+        self.latency = latency
+        self.frame = 0
+        self.spans = []
+        self.open_spans = []
+        self.pending = deque()
+        self.free_queries = []
+        self.frames = []
+
+        glFinish()
+        self.cpu_origin = time.perf_counter()
+        gpu_origin = ctypes.c_int64()
+        glGetInteger64v(GL_TIMESTAMP, ctypes.byref(gpu_origin))
+        self.gpu_origin = gpu_origin.value
+
+    def query(self):
+        """
+        Returns an unused query object, creating one if none are free.
+
+        :return: The ID of the query object
+        """
+        if self.free_queries:
+            return self.free_queries.pop()
+        return int(glGenQueries(1)[0])
+
+    def begin_frame(self):
+        """
+        Starts recording a frame.
+        """
+        self.spans = []
+        self.begin('frame', PASS)
+
+    def end_frame(self):
+        """
+        Finishes recording a frame and collects the results of earlier
+        frames whose queries are old enough to be read without waiting.
+        """
+        self.end()
+        self.pending.append((self.frame, self.spans))
+        self.frame += 1
+        self.collect(self.latency)
+
+    def begin(self, name, category=PASS):
+        """
+        Opens a span. Spans must be closed in the reverse order they were
+        opened.
+
+        :param name: The name of the span, e.g. a pass or an object
+        :param category: The kind of span, PASS or DRAW
+        """
+        span = Span(name, category, len(self.open_spans), self.query(),
+                    self.query())
+        glQueryCounter(span.start_query, GL_TIMESTAMP)
+        self.open_spans.append(span)
+        self.spans.append(span)
+
+    def end(self):
+        """
+        Closes the most recently opened span.
+        """
+        span = self.open_spans.pop()
+        glQueryCounter(span.end_query, GL_TIMESTAMP)
+        span.cpu_end = time.perf_counter()
+
+    def collect(self, latency=0):
+        """
+        Reads the GPU timestamps of recorded frames.
+
+        :param latency: The number of most recent frames to leave in flight.
+                        With 0, waits for every recorded frame.
+        """
+        while len(self.pending) > latency:
+            frame, spans = self.pending.popleft()
+            for span in spans:
+                span.gpu_start = self.timestamp(span.start_query)
+                span.gpu_end = self.timestamp(span.end_query)
+                self.free_queries += [span.start_query, span.end_query]
+            self.frames.append((frame, spans))
+
+    @staticmethod
+    def timestamp(query):
+        """
+        Reads the result of a timestamp query, waiting for it if needed.
+
+        :param query: The ID of the query object
+
+        :return: The GPU time of the query in nanoseconds
+        """
+        # PyOpenGL cannot allocate the 64-bit output array itself
+        result = ctypes.c_uint64()
+        glGetQueryObjectui64v(query, GL_QUERY_RESULT, ctypes.byref(result))
+        return result.value
+
+    def write_chrome_trace(self, path):
+        """
+        Writes the recorded frames as Chrome trace events, with the CPU and
+        GPU spans on separate tracks.
+
+        :param path: The path of the JSON file to write
+        """
+        self.collect()
+
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 1,
+                   'args': {'name': 'CPU'}},
+                  {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': 2,
+                   'args': {'name': 'GPU'}}]
+
+        for frame, spans in self.frames:
+            for span in spans:
+                arguments = {'frame': frame}
+                events.append({'name': span.name, 'cat': span.category,
+                               'ph': 'X', 'pid': 1, 'tid': 1,
+                               'ts': (span.cpu_start - self.cpu_origin) * 1.0e6,
+                               'dur': span.cpu_time() * 1000.0,
+                               'args': arguments})
+                events.append({'name': span.name, 'cat': span.category,
+                               'ph': 'X', 'pid': 1, 'tid': 2,
+                               'ts': (span.gpu_start - self.gpu_origin) / 1000.0,
+                               'dur': span.gpu_time() * 1000.0,
+                               'args': arguments})
+
+        with open(path, 'w') as trace_file:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'},
+                      trace_file)
+
+    def write_csv(self, path):
+        """
+        Writes one row per recorded frame with the CPU and GPU time of the
+        frame, of each pass and of all draws, in milliseconds. Times of
+        passes that occur more than once in a frame are summed.
+
+        :param path: The path of the CSV file to write
+        """
+        self.collect()
+
+        passes = []
+        for frame, spans in self.frames:
+            for span in spans:
+                if span.category == PASS and span.depth > 0 \
+                        and span.name not in passes:
+                    passes.append(span.name)
+
+        header = ['frame', 'cpu_ms', 'gpu_ms', 'draws', 'draw_cpu_ms',
+                  'draw_gpu_ms']
+        for name in passes:
+            header += [name + '_cpu_ms', name + '_gpu_ms']
+
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(header)
+
+            for frame, spans in self.frames:
+                draws = [span for span in spans if span.category == DRAW]
+                row = [frame, spans[0].cpu_time(), spans[0].gpu_time(),
+                       len(draws), sum(span.cpu_time() for span in draws),
+                       sum(span.gpu_time() for span in draws)]
+
+                for name in passes:
+                    matching = [span for span in spans if span.category == PASS
+                                and span.depth > 0 and span.name == name]
+                    row += [sum(span.cpu_time() for span in matching),
+                            sum(span.gpu_time() for span in matching)]
+
+                writer.writerow(['{:.4f}'.format(value)
+                                 if isinstance(value, float) else value
+                                 for value in row])
+
+    def delete(self):
+        """
+        Frees all query objects, waiting for any still in flight.
+        """
+        self.collect()
+        if self.free_queries:
+            glDeleteQueries(len(self.free_queries), self.free_queries)
+        self.free_queries = []
@@ -0,0 +1,187 @@
+"""
+render_queue.py
+
+Contains the RenderQueue class, which sorts each frame's draws to minimise
+OpenGL state changes and skips binds of state that is already current.
+"""
+
+from collections import namedtuple
+from OpenGL.GL import *
+from texture_manager import texture_manager
+
+# A single draw submitted to the queue. The sort key orders draws by program,
+# then texture, vertex array object and material, then front to back.
+DrawItem = namedtuple('DrawItem', ['shader_program', 'texture', 'vao',
+                                   'material', 'depth', 'draw', 'name'])
+
+
+class FrameStats(object):
+    """
+    Counts of the state changes and draw calls made while submitting one
+    frame, along with the binds that were skipped because the state was
+    already current. Binds and draws are counted where the OpenGL calls are
+    made, so a program still bound from the previous frame is not counted,
+    and a mesh split into sub-draws counts one draw per sub-draw.
+    """
+
+    def __init__(self):
+        """
+        Constructor. Starts all counts at zero.
+        """
+        self.program_binds = 0
+        self.texture_binds = 0
+        self.vao_binds = 0
+        self.skipped_binds = 0
+        self.draws = 0
+        self.uniform_uploads = 0
+
+    def __repr__(self):
+        return ('programs: {}, textures: {}, VAOs: {}, skipped binds: {}, '
+                'draws: {}, uniform uploads: {}'
+                .format(self.program_binds, self.texture_binds, self.vao_binds,
+                        self.skipped_binds, self.draws, self.uniform_uploads))
+
+
+class RenderQueue(object):
+    """
+    Collects the draws of a frame, sorts them by program -> texture -> VAO ->
+    material and front to back by view depth (for early depth rejection),
+    and submits them while tracking the currently bound state.
+    """
+
+    def __init__(self):
+        """
+        Constructor. Starts with an empty queue.
+        """
+        self.items = []
+        self.materials = {}
+        self.stats = FrameStats()
+
+    def clear(self):
+        """
+        Removes all draws and materials from the queue, ready for the next
+        frame.
+        """
+        self.items = []
+        self.materials = {}
+
+    def add(self, shader_program, texture, vao, material, depth, draw,
+            name='draw'):
+        """
+        Adds a draw to the queue.
+
+        :param shader_program: The ShaderProgram the draw uses
+        :param texture: The texture the draw samples, or 0 for none
+        :param vao: The vertex array object the draw reads
+        :param material: A hashable description of the draw's material
+        :param depth: The distance of the draw from the camera
+        :param draw: A function taking the ShaderProgram that sets any
+                     remaining uniforms, issues the draw calls and returns
+                     their number
+        :param name: A name identifying the draw in profiles
+        """
+        # Materials are sorted by the order they were first seen in
+        material_id = self.materials.setdefault(material, len(self.materials))
+        self.items.append(DrawItem(shader_program, texture, vao, material_id,
+                                   depth, draw, name))
+
+    def add_object(self, obj, model_view, normal, model_view_projection):
+        """
+        Adds a scene object to the queue.
+
+        :param obj: The scene object to be drawn
+        :param model_view: The 4x4 model-view matrix of the object
+        :param normal: The 3x3 normal matrix of the object
+        :param model_view_projection: The 4x4 model-view-projection matrix of
+                                      the object
+        """
+        def draw(shader_program):
+            obj.set_uniforms(shader_program, model_view, normal,
+                             model_view_projection)
+            return obj.mesh.draw()
+
+        # The camera looks down -z, so the view depth is the negated z
+        self.add(obj.shader_program, obj.texture, obj.mesh.vao, obj.material(),
+                 -float(model_view[2, 3]), draw,
+                 '{} {}'.format(type(obj).__name__, obj.index))
+
+    def add_batch(self, batch):
+        """
+        Adds an instance batch to the queue.
+
+        :param batch: The InstanceBatch to be drawn
+        """
+        def draw(shader_program):
+            batch.set_uniforms()
+            return batch.mesh.draw(batch.instance_count)
+
+        self.add(batch.shader_program, 0, batch.vao, tuple(batch.materials),
+                 0.0, draw, '{} x{}'.format(type(batch.objects[0]).__name__,
+                                            batch.instance_count))
+
+    def submit(self, profiler=None):
+        """
+        Sorts and draws everything in the queue. Programs, textures and
+        vertex array objects are only bound when they differ from the
+        currently bound ones.
+
+        :param profiler: A Profiler timing the draws, grouped into one pass
+                         per shader program, or None
+
+        :return: The FrameStats of the submission
+        """
+        stats = FrameStats()
+        programs = set()
+        uploads_before = {}
+
+        current_program = None
+        current_vao = 0
+
+        self.items.sort(key=lambda item: (item.shader_program.id, item.texture,
+                                          item.vao, item.material, item.depth))
+
+        for item in self.items:
+            if item.shader_program is not current_program:
+                if profiler is not None:
+                    if current_program is not None:
+                        profiler.end()
+                    profiler.begin(item.shader_program.name)
+                if item.shader_program not in programs:
+                    programs.add(item.shader_program)
+                    uploads_before[item.shader_program] = \
+                        item.shader_program.upload_count
+                current_program = item.shader_program
+
+            if item.shader_program.use():
+                stats.program_binds += 1
+            else:
+                stats.skipped_binds += 1
+
+            # Textures stay bound to their own units across frames
+            if item.texture > 0:
+                if texture_manager.bind(item.texture):
+                    stats.texture_binds += 1
+                else:
+                    stats.skipped_binds += 1
+
+            if item.vao != current_vao:
+                glBindVertexArray(item.vao)
+                current_vao = item.vao
+                stats.vao_binds += 1
+            else:
+                stats.skipped_binds += 1
+
+            if profiler is not None:
+                profiler.begin(item.name, 'draw')
+            stats.draws += item.draw(item.shader_program)
+            if profiler is not None:
+                profiler.end()
+
+        if profiler is not None and current_program is not None:
+            profiler.end()
+        glBindVertexArray(0)
+
+        stats.uniform_uploads = sum(program.upload_count - uploads_before[program]
+                                    for program in programs)
+        self.stats = stats
+        return stats
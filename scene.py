@@ -1,72 +1,130 @@
 """
 scene.py
 
-The driver program. Sets up the scene and its components and displays it.
+Sets up the scene and its components and draws it into the current OpenGL
+context. The context itself is created either by window.py (an interactive
+GLUT window) or by headless.py (offscreen rendering without a display).
+
+    python scene.py
 """
 
-import sys
+import math
+import numpy as np
 from OpenGL.GL import *
-from OpenGL.GLUT import *
 from light import Light
+from mesh import mesh_registry
 from camera import Camera
-from ground import Ground
-from stone import Stone
-from boulder import Boulder
-
-GROUND_VERTEX_SHADER = "ground_shader.vert"
-GROUND_FRAGMENT_SHADER = "ground_shader.frag"
-STONE_VERTEX_SHADER = "stone_shader.vert"
-STONE_FRAGMENT_SHADER = "stone_shader.frag"
-
+from ground import Ground, TEXTURE_REPETITIONS
+from instancing import build_batches
+from shader import ShaderProgram
+from shader_variants import ShaderVariants
+from uniform_buffer import FrameUniforms
+from transform_store import transform_store
+from render_queue import RenderQueue
+from culling import FrustumCuller
+from lod import LodSelector
+from occlusion import OcclusionCuller
+from scene_file import SceneFile
+from texture_loader import texture_loader
+from texture_streamer import TextureStreamer
+
+PHONG_VERTEX_SHADER = "phong_shader.vert"
+PHONG_FRAGMENT_SHADER = "phong_shader.frag"
+
+# The features the Phong shaders can be built with
+PHONG_FEATURES = ('TEXTURED', 'INSTANCED')
+
+# The stones and boulders of the scene, as a scene file (see scene_file.py)
+DEFAULT_SCENE_PATH = "stonehenge.json"
+
+# The ground is at least this large, and reaches this far past the objects
 GROUND_SIZE = 20.0
+GROUND_MARGIN = 5.0
 
 class Scene(object):
     """
     A class encapsulating the entire scene. Contains methods to initialize the
-    OpenGL context, setup the camera and lighting, setup the shaders and the
-    components of the scene. Displays the scene and handles user input.
+    OpenGL state, setup the camera and lighting, setup the shaders and the
+    components of the scene, and draw the scene. The scene does not own a
+    window or event loop, so the same code drives interactive and offscreen
+    rendering.
     """
     light = None
     camera = None
+    frame_uniforms = None
+    render_queue = None
+    profiler = None
+    texture_streamer = None
+    shader_variants = None
+    culler = None
+    occlusion_culler = None
+    lod_selector = None
     ground_shader_program = None
     stone_shader_program = None
+    instanced_shader_program = None
 
     objects = []
+    batches = []
+    transform_indices = np.array([], dtype=np.int64)
 
-    def __init__(self):
+    def __init__(self, instanced=False, stream_textures=False,
+                 occlusion_culling=False, scene_path=DEFAULT_SCENE_PATH):
         """
-        Constructor. Executes the entire 3D pipeline.
+        Constructor. Sets up the entire scene in the current OpenGL context.
+
+        :param instanced: Whether stones and boulders sharing a mesh are drawn
+                          with a single instanced draw call
+        :param stream_textures: Whether textures are first drawn with their
+                                smallest mip levels while the larger levels
+                                are uploaded over the following frames
+        :param occlusion_culling: Whether objects hidden behind the stones
+                                  are found on the CPU and not drawn
+        :param scene_path: The path of the scene file holding the stones and
+                           boulders
         """
-        self.init_glut()
+        self.instanced = instanced
+        self.objects = []
+        self.init_gl()
+
+        # The shaders compile in the background while the scene file is read,
+        # the textures decode and the rest of the state is set up
+        self.request_shaders()
+
+        if stream_textures:
+            self.texture_streamer = TextureStreamer()
+        texture_loader.streamer = self.texture_streamer
+
+        Ground.request_textures()
+        scene_file = SceneFile.load(scene_path)
 
         self.light = Light()
         self.camera = Camera()
+        self.render_queue = RenderQueue()
+        self.culler = FrustumCuller()
+        if occlusion_culling:
+            self.occlusion_culler = OcclusionCuller()
+        self.lod_selector = LodSelector()
 
         self.setup_shaders()
+        self.setup_frame_uniforms()
 
-        ground = Ground(self.ground_shader_program)
-        ground.scale(GROUND_SIZE, 1.0, GROUND_SIZE)
-        self.objects.append(ground)
-
-        self.setup_stones()
-        self.setup_boulders()
+        self.setup_objects(scene_file)
 
-        glutDisplayFunc(self.display)
-        glutKeyboardFunc(self.handle_key)
+        if self.instanced:
+            self.batches = build_batches(self.objects[1:],
+                                         self.instanced_shader_program)
 
-        glutMainLoop()
+        # Textures were decoding in the background while the meshes were
+        # built. When streaming, drawing starts without waiting for them, and
+        # each is uploaded by display once its images are decoded.
+        if self.texture_streamer is None:
+            texture_loader.finish()
 
     @staticmethod
-    def init_glut():
+    def init_gl():
         """
-        Sets up the OpenGL context using GLUT.
+        Sets up the OpenGL state used to render the scene.
         """
-        glutInit()
-        glutInitDisplayMode(GLUT_RGBA | GLUT_ALPHA | GLUT_DOUBLE | GLUT_DEPTH
-                            | GLUT_3_2_CORE_PROFILE)
-        glutInitWindowSize(768, 768)
-        glutCreateWindow(b"Final Project - Stonehenge")
-
         glEnable(GL_DEPTH_TEST)
         glClearColor(0.0, 0.2, 0.2, 1.0)
         glEnable(GL_CULL_FACE)
@@ -74,216 +132,207 @@ class Scene(object):
         glPolygonMode(GL_FRONT_AND_BACK, GL_FILL)
         glClearDepth(1.0)
 
-    def setup_shaders(self):
-        """
-        Compiles vertex and fragment shaders and links them to shader programs
-        used in the scene. Two sets of shaders are used - one for the ground
-        and one for the stones.
+    def request_shaders(self):
         """
-        vertex_shader = self.compile_shader(GL_VERTEX_SHADER, GROUND_VERTEX_SHADER)
-        fragment_shader = self.compile_shader(GL_FRAGMENT_SHADER, GROUND_FRAGMENT_SHADER)
-        self.ground_shader_program = self.linkProgram(vertex_shader, fragment_shader)
-
-        vertex_shader = self.compile_shader(GL_VERTEX_SHADER, STONE_VERTEX_SHADER)
-        fragment_shader = self.compile_shader(GL_FRAGMENT_SHADER, STONE_FRAGMENT_SHADER)
-        self.stone_shader_program = self.linkProgram(vertex_shader, fragment_shader)
-
-        glDeleteShader(vertex_shader)
-        glDeleteShader(fragment_shader)
-
-    @staticmethod
-    def compile_shader(shader_type, source_path):
+        Starts building the variants of the Phong shaders used in the scene:
+        a textured one for the ground and a plain one for the stones, plus an
+        instanced one when the stones are drawn with instancing.
         """
-        Compiles a shader from a given source file and returns a unique ID
-        representing it.
+        self.shader_variants = ShaderVariants(PHONG_VERTEX_SHADER,
+                                              PHONG_FRAGMENT_SHADER,
+                                              PHONG_FEATURES)
+        self.shader_variants.request('ground', 'TEXTURED')
+        self.shader_variants.request('stone')
+        if self.instanced:
+            self.shader_variants.request('instanced', 'INSTANCED')
+        self.shader_variants.start()
 
-        :param shader_type: The type of shader
-        :param source_path: The path of the shader source file
-
-        :return: A unique ID representing the compiled shader
+    def setup_shaders(self):
         """
-        with open(source_path) as shader_file:
-            source = shader_file.read()
-        shader = glCreateShader(shader_type)
-        glShaderSource(shader, source)
-        glCompileShader(shader)
-        log = glGetShaderInfoLog(shader)
-        if log:
-            print(log)
-        return shader
-
-    @staticmethod
-    def linkProgram(vertex_shader, fragment_shader):
+        Waits for the shader variants requested by request_shaders to be
+        built. Textures that have already decoded are uploaded first if the
+        compiles are still running, so the uploads overlap them.
         """
-        Creates and returns a shader program after linking a vertex and
-        fragment shader to it.
+        if not self.shader_variants.ready():
+            texture_loader.upload_ready()
 
-        :param vertex_shader: A unique ID representing the vertex shader
-        :param fragment_shader: A unique ID representing the fragment shader
+        programs = self.shader_variants.finish()
+        self.ground_shader_program = programs['ground']
+        self.stone_shader_program = programs['stone']
+        self.instanced_shader_program = programs.get('instanced')
 
-        :return: A unique ID representing the shader program
-        """
-        shader_program = glCreateProgram()
-        glAttachShader(shader_program, vertex_shader)
-        glAttachShader(shader_program, fragment_shader)
-        glLinkProgram(shader_program)
-        log = glGetProgramInfoLog(shader_program)
-        if log:
-            print(log)
-        return shader_program
-
-    def setup_stones(self):
+    def setup_frame_uniforms(self):
         """
-        Creates objects for the gray stones that make up Stonehenge and applies
-        model transforms to them.
+        Creates the uniform buffer holding the per-frame camera and light
+        state, and connects every shader program to it.
         """
-        stone1 = Stone(self.stone_shader_program)
-        stone1.scale(1.5, 3.0, 0.7)
-        stone1.rotate(0.0, 20.0, 0.0)
-        stone1.translate(3.5, 3.0, 8.5)
-        self.objects.append(stone1)
-
-        stone2 = Stone(self.stone_shader_program)
-        stone2.scale(1.5, 3.0, 0.7)
-        stone2.rotate(0.0, 45.0, 0.0)
-        stone2.translate(7.8, 3.0, 5.8)
-        self.objects.append(stone2)
-
-        stone3 = Stone(self.stone_shader_program)
-        stone3.scale(3.5, 0.5, 0.7)
-        stone3.rotate(0.0, 32.5, 0.0)
-        stone3.translate(5.7, 6.5, 7.2)
-        self.objects.append(stone3)
-
-        stone4 = Stone(self.stone_shader_program)
-        stone4.scale(1.5, 3.0, 0.7)
-        stone4.rotate(0.0, -25.0, 0.0)
-        stone4.translate(-4.5, 3.0, 8.2)
-        self.objects.append(stone4)
-
-        stone5 = Stone(self.stone_shader_program)
-        stone5.scale(1.5, 3.0, 0.7)
-        stone5.rotate(0.0, -40.0, 0.0)
-        stone5.translate(-8.5, 3.0, 5.7)
-        self.objects.append(stone5)
-
-        stone6 = Stone(self.stone_shader_program)
-        stone6.scale(1.5, 3.0, 0.7)
-        stone6.rotate(0.0, -55.0, 0.0)
-        stone6.translate(-11.8, 3.0, 2.0)
-        self.objects.append(stone6)
-
-        stone7 = Stone(self.stone_shader_program)
-        stone7.scale(2.7, 0.5, 0.7)
-        stone7.rotate(0.0, -32.5, 0.0)
-        stone7.translate(-6.0, 6.5, 7.4)
-        self.objects.append(stone7)
-
-        stone8 = Stone(self.stone_shader_program)
-        stone8.scale(2.7, 0.5, 0.7)
-        stone8.rotate(0.0, -47.5, 0.0)
-        stone8.translate(-10.5, 6.5, 3.7)
-        self.objects.append(stone8)
-
-        stone9 = Stone(self.stone_shader_program)
-        stone9.scale(1.5, 3.2, 0.7)
-        stone9.rotate(0.0, 77.0, 0.0)
-        stone9.translate(11.5, 3.2, 0.8)
-        self.objects.append(stone9)
-
-        stone10 = Stone(self.stone_shader_program)
-        stone10.scale(2.2, 4.0, 1.0)
-        stone10.rotate(0.0, 3.0, 0.0)
-        stone10.translate(-3.0, 4.0, -6.0)
-        self.objects.append(stone10)
-
-        stone11 = Stone(self.stone_shader_program)
-        stone11.scale(2.2, 4.0, 1.0)
-        stone11.rotate(0.0, -3.0, 0.0)
-        stone11.translate(3.0, 4.0, -6.0)
-        self.objects.append(stone11)
-
-        stone12 = Stone(self.stone_shader_program)
-        stone12.scale(5.5, 0.6, 0.9)
-        stone12.rotate(0.0, 0.0, 0.0)
-        stone12.translate(0.0, 8.6, -6.0)
-        self.objects.append(stone12)
-
-    def setup_boulders(self):
+        self.frame_uniforms = FrameUniforms()
+        for shader_program in (self.ground_shader_program,
+                               self.stone_shader_program,
+                               self.instanced_shader_program):
+            if shader_program is not None:
+                self.frame_uniforms.bind(shader_program)
+
+    def setup_objects(self, scene_file):
         """
-        Creates objects for the boulders present along Stonehenge and applies
-        model transforms to them.
+        Creates the ground, large enough to hold the scene and tiled at the
+        same density whatever its size, followed by the stones and boulders
+        stored in a scene file.
+
+        :param scene_file: The SceneFile holding the stones and boulders
         """
-        boulder1 = Boulder(self.stone_shader_program)
-        boulder1.scale(1.0, 1.0, 1.0)
-        boulder1.translate(10.0, -0.2, -7.5)
-        self.objects.append(boulder1)
-
-        boulder2 = Boulder(self.stone_shader_program)
-        boulder2.scale(1.3, 1.3, 1.3)
-        boulder2.translate(8.0, -0.4, -9.0)
-        self.objects.append(boulder2)
-
-        boulder3 = Boulder(self.stone_shader_program)
-        boulder3.scale(2.0, 2.0, 2.0)
-        boulder3.translate(-0.8, -1.0, 1.3)
-        self.objects.append(boulder3)
-
-        boulder4 = Boulder(self.stone_shader_program)
-        boulder4.scale(1.7, 1.7, 1.7)
-        boulder4.translate(-4.1, -0.8, 0.1)
-        self.objects.append(boulder4)
-
-        boulder5 = Boulder(self.stone_shader_program)
-        boulder5.scale(1.3, 1.3, 1.3)
-        boulder5.translate(2.8, -0.5, 0.5)
-        self.objects.append(boulder5)
+        ground_size = max(GROUND_SIZE, scene_file.extent() + GROUND_MARGIN)
+        tiles = int(math.ceil(TEXTURE_REPETITIONS * ground_size / GROUND_SIZE))
+
+        ground = Ground(self.ground_shader_program, tiles)
+        ground.scale(ground_size, 1.0, ground_size)
+        self.objects.append(ground)
+
+        self.objects.extend(scene_file.create_objects(self.stone_shader_program))
 
     def display(self):
         """
-        Displays the scene on the current OpenGL window.
+        Draws the scene into the currently bound framebuffer, skipping the
+        objects outside the view frustum or, if occlusion culling is on,
+        hidden behind stones, and drawing small objects with less detail. If a
+        Profiler is attached, the setup of the frame, each shader program's
+        pass and each draw are timed.
         """
+        if self.profiler is not None:
+            self.profiler.begin('setup')
+
+        # Upload the textures that finished decoding and the next part of any
+        # still being streamed
+        if self.texture_streamer is not None:
+            texture_loader.upload_ready()
+            self.texture_streamer.update()
+
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-        # Set up parameters for the ground
-        glUseProgram(self.ground_shader_program)
-        self.camera.setup(self.ground_shader_program)
-        self.light.setup(self.ground_shader_program)
-        self.objects[0].draw(self.ground_shader_program)
+        # Upload the camera and light state shared by all programs
+        self.frame_uniforms.update(self.camera, self.light)
+
+        # Find the objects inside the view frustum and not hidden, and the
+        # level of detail to draw each with
+        indices = self.object_indices()
+        transforms = transform_store.matrices(indices)
+        visible = self.culler.cull(self.camera, self.objects, transforms)
+        if self.occlusion_culler is not None:
+            visible = self.occlusion_culler.cull(self.camera, self.objects,
+                                                 transforms, visible)
+        levels = self.lod_selector.select(self.camera, self.objects, transforms,
+                                          glGetIntegerv(GL_VIEWPORT)[3], visible)
+
+        # Queue the visible ground, stones and boulders, then draw them in an
+        # order that minimises state changes
+        self.render_queue.clear()
+        if self.instanced:
+            self.queue_objects(self.objects[:1], transforms[:1], visible[:1])
+
+            # Batches refer to their objects by transform index, and draw the
+            # visible objects at their level
+            visible_transforms = np.zeros(len(transform_store), dtype=bool)
+            visible_transforms[indices[visible]] = True
+            transform_levels = np.zeros(len(transform_store), dtype=np.int64)
+            transform_levels[indices] = levels
+            for batch in self.batches:
+                batch.update(self.camera, visible_transforms[batch.indices] &
+                             (transform_levels[batch.indices] == batch.level))
+                if batch.instance_count > 0:
+                    self.render_queue.add_batch(batch)
+        else:
+            self.queue_objects(self.objects, transforms, visible)
+
+        if self.profiler is not None:
+            self.profiler.end()
+        self.render_queue.submit(self.profiler)
+
+    def queue_objects(self, objects, transforms, visible):
+        """
+        Computes the transformation matrices of the visible objects of a list
+        in one batch and adds each of them to the render queue with them.
 
-        # Set up parameters for the stones and boulders
-        glUseProgram(self.stone_shader_program)
-        self.camera.setup(self.stone_shader_program)
-        self.light.setup(self.stone_shader_program)
+        :param objects: The objects to be drawn
+        :param transforms: An (N, 4, 4) array of the model matrices of the
+                           objects
+        :param visible: A boolean array selecting the objects to be drawn
+        """
+        selected = np.flatnonzero(visible)
+        model_views, normals, model_view_projections = \
+            self.camera.object_matrices(transforms[selected])
 
-        for obj in self.objects[1:]:
-            obj.draw(self.stone_shader_program)
+        for index, object_index in enumerate(selected):
+            self.render_queue.add_object(objects[object_index],
+                                         model_views[index], normals[index],
+                                         model_view_projections[index])
 
-        glutSwapBuffers()
+    def object_indices(self):
+        """
+        Returns the indices of the transforms of all objects in the scene.
 
-    def handle_key(self, *args):
+        :return: An array of indices into the shared transform store
         """
-        Handles user input to rotate the scene or quit.
+        if len(self.transform_indices) != len(self.objects):
+            self.transform_indices = np.array([obj.index for obj in self.objects])
+        return self.transform_indices
 
-        :param *args: User input parameters passed by GLUT
+    def rotate(self, angle):
         """
-        key = args[0].decode()
+        Rotates every object in the scene about the vertical axis.
 
-        # Rotate the scene clockwise
-        if key == 'a':
-            for obj in self.objects:
-                obj.rotate(0, 2, 0)
+        :param angle: The rotation angle (in degrees)
+        """
+        transform_store.rotate(self.object_indices(), 0, angle, 0)
 
-        # Rotate the scene counter-clockwise
-        elif key == 'd':
-            for obj in self.objects:
-                obj.rotate(0, -2, 0)
+    def loading_textures(self):
+        """
+        Checks whether textures are still being decoded or streamed, in which
+        case the next frames will show more detail even if nothing moves.
 
-        # Close the window
-        elif key == 'q':
-            sys.exit(0)
+        :return: Whether textures are still loading
+        """
+        return self.texture_streamer is not None and \
+            (len(texture_loader.pending) > 0 or len(self.texture_streamer) > 0)
 
-        self.display()
+    def close(self):
+        """
+        Frees the instance batches, frame uniform buffer and shader programs
+        of the scene and the meshes and textures shared through the global
+        registries, which hold OpenGL names and would otherwise be handed to
+        the next scene even if it is set up in another context. The shared
+        transform store is cleared. Must be called while the scene's context
+        is still current, and the scene cannot be drawn afterwards.
+        """
+        for batch in self.batches:
+            batch.delete()
+        self.batches = []
+
+        mesh_registry.clear()
+
+        if self.frame_uniforms is not None:
+            self.frame_uniforms.delete()
+            self.frame_uniforms = None
+
+        for shader_program in (self.ground_shader_program,
+                               self.stone_shader_program,
+                               self.instanced_shader_program):
+            if shader_program is not None:
+                shader_program.delete()
+        ShaderProgram.current = None
+
+        texture_loader.clear()
+        if self.texture_streamer is not None:
+            self.texture_streamer.delete()
+            texture_loader.streamer = None
+
+        # The objects of the scene hold the only indices into the store, so
+        # the next scene starts from an empty one rather than transforming
+        # these every frame
+        transform_store.clear()
+        self.objects = []
+        self.transform_indices = np.array([], dtype=np.int64)
 
 if __name__ == "__main__":
-    Scene()
+    # Accepts the same options as window.py
+    import runpy
+    runpy.run_module('window', run_name='__main__')
@@ -0,0 +1,234 @@
+"""
+scene_file.py
+
+Contains the SceneFile class, which stores the stones and boulders of a scene
+as a NumPy structured array holding the type, translation, rotation, scale
+and material of every object. On disk, a scene is a JSON manifest and a
+binary file next to it holding each column of the array in turn.
+"""
+
+import json
+import os
+import numpy as np
+from numpy.lib import recfunctions
+from stone import Stone
+from boulder import Boulder
+from transform_store import transform_store
+
+# The object classes a scene file can hold, by the names used in manifests
+OBJECT_TYPES = {'stone': Stone, 'boulder': Boulder}
+
+# One record per object. The type is an index into the type names of the
+# file, the rotation an (x, y, z, w) quaternion. Transforms are kept at the
+# precision of the transform store, so saving a scene loses nothing.
+OBJECT_DTYPE = np.dtype([('type', '<u1'),
+                         ('translation', '<f8', (3,)),
+                         ('rotation', '<f8', (4,)),
+                         ('scale', '<f8', (3,)),
+                         ('ambient', '<f4', (3,)),
+                         ('diffuse', '<f4', (3,)),
+                         ('specular', '<f4', (3,)),
+                         ('shininess', '<f4')])
+
+# The fields objects are grouped by when they are created, as objects of one
+# type and material share everything but their transform
+MATERIAL_FIELDS = ['type', 'ambient', 'diffuse', 'specular', 'shininess']
+
+FORMAT_VERSION = 1
+
+DATA_EXTENSION = '.bin'
+
+
+class SceneFile(object):
+    """
+    The objects of a scene as one record each. Files are read and written a
+    column at a time, and objects are created from the records with their
+    transforms set in one batch, so loading does not slow down with Python
+    overhead per object.
+    """
+
+    def __init__(self, records=None, types=tuple(OBJECT_TYPES)):
+        """
+        Constructor.
+
+        :param records: A structured array of OBJECT_DTYPE, or None for an
+                        empty scene
+        :param types: The object type names the type field indexes into
+        """
+        unknown = set(types) - set(OBJECT_TYPES)
+        if unknown:
+            raise ValueError('Unknown object types: {}'.format(
+                ', '.join(sorted(unknown))))
+
+        self.types = list(types)
+        self.records = (np.zeros(0, dtype=OBJECT_DTYPE) if records is None
+                        else np.asarray(records, dtype=OBJECT_DTYPE))
+
+    def __len__(self):
+        return len(self.records)
+
+    @classmethod
+    def from_objects(cls, objects):
+        """
+        Creates a scene file holding the current transforms and materials of
+        a list of stones and boulders. Objects given a non-uniform scale
+        after being rotated are sheared, and cannot be stored.
+
+        :param objects: The scene objects
+
+        :return: The SceneFile
+        """
+        names = {object_type: name
+                 for name, object_type in OBJECT_TYPES.items()}
+        types = list(OBJECT_TYPES)
+        indices = np.array([obj.index for obj in objects], dtype=np.int64)
+        if np.any(transform_store.sheared[indices]):
+            raise ValueError('Sheared objects cannot be stored in a scene file')
+
+        records = np.zeros(len(objects), dtype=OBJECT_DTYPE)
+        records['type'] = [types.index(names[type(obj)]) for obj in objects]
+        records['translation'] = transform_store.translation[indices]
+        records['rotation'] = transform_store.rotation[indices]
+        records['scale'] = transform_store.scale_factors[indices]
+        for record, obj in zip(records, objects):
+            record['ambient'] = obj.k_ambient
+            record['diffuse'] = obj.k_diffuse
+            record['specular'] = obj.k_specular
+            record['shininess'] = obj.shininess
+
+        return cls(records, types)
+
+    @staticmethod
+    def data_path(path):
+        """
+        Returns the path of the binary file belonging to a manifest.
+
+        :param path: The path of the manifest
+
+        :return: The path of the binary file
+        """
+        return os.path.splitext(path)[0] + DATA_EXTENSION
+
+    def save(self, path):
+        """
+        Writes the manifest and the binary file holding the columns.
+
+        :param path: The path of the manifest, usually ending in .json
+        """
+        columns = []
+        offset = 0
+        with open(self.data_path(path), 'wb') as data_file:
+            for name in OBJECT_DTYPE.names:
+                column = np.ascontiguousarray(self.records[name])
+                field_type = OBJECT_DTYPE.fields[name][0]
+                columns.append({'name': name,
+                                'dtype': field_type.base.str,
+                                'shape': list(field_type.shape),
+                                'offset': offset})
+                data_file.write(column.tobytes())
+                offset += column.nbytes
+
+        manifest = {'version': FORMAT_VERSION,
+                    'count': len(self.records),
+                    'types': self.types,
+                    'data': os.path.basename(self.data_path(path)),
+                    'columns': columns}
+        with open(path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a scene file. The binary file is read in one call and each
+        column is copied out of it whole.
+
+        :param path: The path of the manifest
+
+        :return: The SceneFile
+        """
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest.get('version') != FORMAT_VERSION:
+            raise ValueError('{} has an unsupported scene file version: '
+                             '{}'.format(path, manifest.get('version')))
+
+        count = manifest['count']
+        data_path = os.path.join(os.path.dirname(path), manifest['data'])
+        data = np.fromfile(data_path, dtype=np.uint8)
+        columns = {column['name']: column for column in manifest['columns']}
+
+        records = np.zeros(count, dtype=OBJECT_DTYPE)
+        for name in OBJECT_DTYPE.names:
+            if name not in columns:
+                raise ValueError('{} has no {} column'.format(path, name))
+
+            column = columns[name]
+            shape = (count,) + tuple(column['shape'])
+            column_type = np.dtype(column['dtype'])
+            end = column['offset'] + column_type.itemsize * int(np.prod(shape))
+            if end > len(data):
+                raise ValueError('{} is too short for its {} column'.format(
+                    data_path, name))
+
+            records[name] = data[column['offset']:end].view(column_type
+                                                            ).reshape(shape)
+
+        if np.any(records['type'] >= len(manifest['types'])):
+            raise ValueError('{} has objects of undeclared types'.format(path))
+        return cls(records, manifest['types'])
+
+    def extent(self):
+        """
+        :return: The largest distance of any object's origin from the
+                 vertical axis along x or z, or 0 for an empty scene
+        """
+        if len(self.records) == 0:
+            return 0.0
+        return float(np.abs(self.records['translation'][:, [0, 2]]).max())
+
+    def create_objects(self, shader_program):
+        """
+        Creates the objects of the scene. Only the first object of each type
+        and material is constructed, which looks up its meshes, and the rest
+        are copies of it. The transforms of all objects are then set at once.
+
+        :param shader_program: The ShaderProgram the objects are drawn with
+
+        :return: A list of the objects, in the order of the records
+        """
+        records = self.records
+        if len(records) == 0:
+            return []
+
+        keys = recfunctions.repack_fields(records[MATERIAL_FIELDS])
+        first, groups = np.unique(keys, return_index=True,
+                                  return_inverse=True)[1:]
+
+        objects = [None] * len(records)
+        prototypes = []
+        for position in first:
+            record = records[position]
+            obj = OBJECT_TYPES[self.types[record['type']]](shader_program)
+            obj.k_ambient = record['ambient'].copy()
+            obj.k_diffuse = record['diffuse'].copy()
+            obj.k_specular = record['specular'].copy()
+            obj.shininess = float(record['shininess'])
+            objects[position] = obj
+            prototypes.append(obj)
+
+        indices = np.empty(len(records), dtype=np.int64)
+        indices[first] = [obj.index for obj in prototypes]
+        copied = np.ones(len(records), dtype=bool)
+        copied[first] = False
+        indices[copied] = transform_store.allocate(
+            int(np.count_nonzero(copied)))
+
+        for group, prototype in enumerate(prototypes):
+            positions = np.flatnonzero(copied & (groups.ravel() == group))
+            for position, obj in zip(positions,
+                                     prototype.copies(indices[positions])):
+                objects[position] = obj
+
+        transform_store.set(indices, records['translation'],
+                            records['rotation'], records['scale'])
+        return objects
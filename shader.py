@@ -0,0 +1,156 @@
+"""
+shader.py
+
+Contains the ShaderProgram class, which wraps a linked shader program and
+caches its uniform and attribute locations and uniform values.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+
+# The number of components and upload function for each uniform type
+UNIFORM_SETTERS = {
+    GL_FLOAT: (1, glUniform1fv),
+    GL_FLOAT_VEC2: (2, glUniform2fv),
+    GL_FLOAT_VEC3: (3, glUniform3fv),
+    GL_FLOAT_VEC4: (4, glUniform4fv),
+    GL_INT: (1, glUniform1iv),
+    GL_BOOL: (1, glUniform1iv),
+    GL_SAMPLER_2D: (1, glUniform1iv),
+    GL_SAMPLER_2D_ARRAY: (1, glUniform1iv),
+    GL_FLOAT_MAT3: (9, lambda location, count, value:
+                    glUniformMatrix3fv(location, count, GL_FALSE, value)),
+    GL_FLOAT_MAT4: (16, lambda location, count, value:
+                    glUniformMatrix4fv(location, count, GL_FALSE, value)),
+}
+
+# Uniform types uploaded as integers rather than floats
+INTEGER_UNIFORMS = {GL_INT, GL_BOOL, GL_SAMPLER_2D, GL_SAMPLER_2D_ARRAY}
+
+
+class ShaderProgram(object):
+    """
+    A linked shader program. The active uniforms and attributes are looked up
+    once when the program is created, and uniform uploads are skipped when
+    the value has not changed since it was last sent.
+    """
+
+    # The program currently bound with glUseProgram
+    current = None
+
+    def __init__(self, program_id, name=None):
+        """
+        Constructor. Enumerates the active uniforms and attributes of a linked
+        program and caches their locations and types.
+
+        :param program_id: A unique ID representing the linked program
+        :param name: A name identifying the program in statistics and profiles
+        """
+        self.id = program_id
+        self.name = name or 'program {}'.format(program_id)
+        self.uniforms = {}
+        self.attributes = {}
+        self.values = {}
+        self.upload_count = 0
+
+        for index in range(glGetProgramiv(program_id, GL_ACTIVE_UNIFORMS)):
+            name, size, uniform_type = glGetActiveUniform(program_id, index)
+            name = name.decode()
+            location = glGetUniformLocation(program_id, name)
+
+            # Members of uniform blocks have no location of their own
+            if location == -1:
+                continue
+
+            # Arrays are reported as their first element, e.g. "k_a[0]"
+            if name.endswith('[0]'):
+                name = name[:-3]
+            self.uniforms[name] = (location, int(uniform_type))
+
+        for index in range(glGetProgramiv(program_id, GL_ACTIVE_ATTRIBUTES)):
+            name, size, attribute_type = glGetActiveAttrib(program_id, index)
+            name = name.decode()
+            self.attributes[name] = glGetAttribLocation(program_id, name)
+
+    def use(self):
+        """
+        Binds the program, unless it is already bound.
+
+        :return: Whether the program had to be bound
+        """
+        if ShaderProgram.current is self:
+            return False
+
+        glUseProgram(self.id)
+        ShaderProgram.current = self
+        return True
+
+    def delete(self):
+        """
+        Frees the program. The program is no longer remembered as bound, as
+        its ID may be reused by a later program, in this context or another.
+        """
+        if ShaderProgram.current is self:
+            glUseProgram(0)
+            ShaderProgram.current = None
+        glDeleteProgram(self.id)
+        self.values = {}
+
+    def attribute_location(self, name):
+        """
+        Returns the location of a vertex attribute.
+
+        :param name: The name of the attribute in the shader source
+
+        :return: The location of the attribute, or -1 if it is not active
+        """
+        return self.attributes.get(name, -1)
+
+    def bind_uniform_block(self, name, binding):
+        """
+        Connects a uniform block of the program to a uniform buffer binding
+        point. This only needs to be done once, after linking.
+
+        :param name: The name of the uniform block in the shader source
+        :param binding: The index of the binding point
+        """
+        index = glGetUniformBlockIndex(self.id, name)
+        if index != GL_INVALID_INDEX:
+            glUniformBlockBinding(self.id, index, binding)
+
+    def set_uniform(self, name, value):
+        """
+        Uploads the value of a uniform, binding the program first if needed.
+        Nothing is sent if the uniform is not active or already holds the
+        value. Matrices are expected in column-major order.
+
+        :param name: The name of the uniform in the shader source
+        :param value: A number or array holding the new value. For arrays of
+                      uniforms, the values of consecutive elements.
+        """
+        uniform = self.uniforms.get(name)
+        if uniform is None:
+            return
+
+        location, uniform_type = uniform
+        dtype = np.int32 if uniform_type in INTEGER_UNIFORMS else np.float32
+        data = np.ascontiguousarray(value, dtype=dtype).ravel()
+
+        cached = data.tobytes()
+        if self.values.get(name) == cached:
+            return
+
+        components, setter = UNIFORM_SETTERS[uniform_type]
+        self.use()
+        setter(location, len(data) // components, data)
+        self.values[name] = cached
+        self.upload_count += 1
+
+    def __hash__(self):
+        return hash(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, ShaderProgram) and other.id == self.id
+
+    def __repr__(self):
+        return 'ShaderProgram({})'.format(self.id)
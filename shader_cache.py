@@ -0,0 +1,181 @@
+"""
+shader_cache.py
+
+Contains the ProgramCache class, which stores linked shader programs on disk
+as driver binaries, so later runs can load them instead of compiling and
+linking from source.
+"""
+
+import ctypes
+import hashlib
+import os
+import struct
+from OpenGL.GL import *
+from OpenGL.error import GLError
+
+DEFAULT_DIRECTORY = "shader_cache"
+
+# File layout: the binary format enum followed by the program binary
+HEADER_FORMAT = '<I'
+
+EXTENSION = '.bin'
+
+
+class ProgramCache(object):
+    """
+    A directory of program binaries named after a hash of the shader sources
+    and the OpenGL vendor, renderer and version strings, so binaries are
+    never given to a different driver. A binary in a format the driver does
+    not list, or one it rejects, is treated as a cache miss and its file is
+    removed, so it is replaced by the next store.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        """
+        Constructor.
+
+        :param directory: The directory holding the cache files. It is created
+                          when the first file is written.
+        """
+        self.directory = directory
+        self.driver = None
+        self.formats = None
+
+    def key(self, *sources):
+        """
+        Returns the cache key of a program. Needs a current OpenGL context.
+
+        :param *sources: The source code of each shader of the program
+
+        :return: The key as a hexadecimal string
+        """
+        if self.driver is None:
+            self.driver = b'\0'.join(glGetString(name) or b''
+                                     for name in (GL_VENDOR, GL_RENDERER,
+                                                  GL_VERSION))
+
+        digest = hashlib.sha1(self.driver)
+        for source in sources:
+            digest.update(b'\0')
+            digest.update(source.encode())
+        return digest.hexdigest()
+
+    def binary_formats(self):
+        """
+        Returns the program binary formats the driver accepts. PyOpenGL does
+        not know the size of GL_PROGRAM_BINARY_FORMATS, so the formats are
+        read into a ctypes array.
+
+        :return: A set of binary format enums, empty if the driver cannot
+                 save and load program binaries
+        """
+        if self.formats is None:
+            count = int(glGetIntegerv(GL_NUM_PROGRAM_BINARY_FORMATS))
+            formats = (GLint * max(count, 1))()
+            if count > 0:
+                glGetIntegerv(GL_PROGRAM_BINARY_FORMATS, formats)
+            self.formats = set(formats[:count])
+        return self.formats
+
+    def available(self):
+        """
+        :return: Whether the driver can save and load program binaries
+        """
+        return len(self.binary_formats()) > 0
+
+    def file_path(self, key):
+        """
+        Returns the path of the cache file for a key.
+
+        :param key: The cache key of the program
+
+        :return: The path of the cache file
+        """
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def load(self, key):
+        """
+        Creates a program from its cached binary.
+
+        :param key: The cache key of the program
+
+        :return: The ID of the linked program, or None if there is no usable
+                 binary
+        """
+        path = self.file_path(key)
+        if not self.available() or not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as cache_file:
+            data = cache_file.read()
+        header_size = struct.calcsize(HEADER_FORMAT)
+        if len(data) <= header_size:
+            self.discard(path)
+            return None
+
+        binary_format, = struct.unpack(HEADER_FORMAT, data[:header_size])
+        binary = data[header_size:]
+        if binary_format not in self.binary_formats():
+            self.discard(path)
+            return None
+
+        program = glCreateProgram()
+        try:
+            glProgramBinary(program, binary_format, binary, len(binary))
+            linked = glGetProgramiv(program, GL_LINK_STATUS) == GL_TRUE
+        except GLError:
+            linked = False
+
+        if not linked:
+            glDeleteProgram(program)
+            self.discard(path)
+            return None
+        return program
+
+    @staticmethod
+    def discard(path):
+        """
+        Removes a cache file that cannot be used.
+
+        :param path: The path of the cache file
+        """
+        try:
+            os.remove(path)
+        except OSError as cache_ex:
+            print('Could not remove shader cache file:', cache_ex)
+
+    def store(self, key, program):
+        """
+        Saves the binary of a linked program. The program should have been
+        linked with GL_PROGRAM_BINARY_RETRIEVABLE_HINT set.
+
+        :param key: The cache key of the program
+        :param program: The ID of the linked program
+        """
+        if not self.available():
+            return
+
+        size = glGetProgramiv(program, GL_PROGRAM_BINARY_LENGTH)
+        if size <= 0:
+            return
+
+        length = ctypes.c_int()
+        binary_format = ctypes.c_uint()
+        binary = (ctypes.c_ubyte * size)()
+        glGetProgramBinary(program, size, ctypes.byref(length),
+                           ctypes.byref(binary_format), binary)
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.file_path(key)
+            temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(temporary_path, 'wb') as cache_file:
+                cache_file.write(struct.pack(HEADER_FORMAT, binary_format.value))
+                cache_file.write(bytes(binary)[:length.value])
+            os.replace(temporary_path, path)
+        except OSError as cache_ex:
+            print('Could not write shader cache file:', cache_ex)
+
+
+# The cache shared by all shader programs
+program_cache = ProgramCache()
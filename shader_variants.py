@@ -0,0 +1,243 @@
+"""
+shader_variants.py
+
+Contains the ShaderVariants class, which builds the permutations of one pair
+of shader source files that a scene actually uses, each permutation
+switching features on with #define lines. Every permutation is compiled and
+linked in one batch, on the driver's compiler threads where
+GL_KHR_parallel_shader_compile is supported, so the compiles overlap each
+other and the rest of startup.
+"""
+
+import ctypes
+from OpenGL.GL import *
+from OpenGL.GL.KHR.parallel_shader_compile import (
+    glInitParallelShaderCompileKHR, glMaxShaderCompilerThreadsKHR,
+    GL_COMPLETION_STATUS_KHR)
+from shader import ShaderProgram
+from shader_cache import program_cache
+
+# Passed to glMaxShaderCompilerThreadsKHR to let the driver pick the number
+# of threads
+DRIVER_THREADS = 0xFFFFFFFF
+
+
+def expand_source(source, features):
+    """
+    Inserts a #define line for each feature after the #version line of a
+    shader source.
+
+    :param source: The shader source, starting with its #version line
+    :param features: The names of the features to switch on
+
+    :return: The source of the permutation
+    """
+    version, separator, body = source.partition('\n')
+    defines = ''.join('#define {}\n'.format(feature) for feature in features)
+    return version + separator + defines + body
+
+
+class ShaderVariant(object):
+    """
+    One permutation of the shaders, from the start of its compile until it is
+    wrapped in a ShaderProgram.
+    """
+    program = 0
+    shaders = []
+    cached = False
+    shader_program = None
+
+    def __init__(self, features, sources, key):
+        """
+        Constructor.
+
+        :param features: The names of the features switched on
+        :param sources: The expanded vertex and fragment shader sources
+        :param key: The program cache key of the sources
+        """
+        self.features = features
+        self.sources = sources
+        self.key = key
+
+
+class ShaderVariants(object):
+    """
+    Builds permutations of a vertex and fragment shader on request. Each
+    distinct set of features is built once, however many names request it.
+    Permutations found in the program cache are loaded instead of compiled.
+    Compile and link errors are only checked in finish, since checking them
+    earlier would wait for the compiles.
+    """
+
+    def __init__(self, vertex_path, fragment_path, features,
+                 cache=program_cache):
+        """
+        Constructor. Reads the shader source files.
+
+        :param vertex_path: The path of the vertex shader source file
+        :param fragment_path: The path of the fragment shader source file
+        :param features: The names of the features the sources support, in
+                         the order their #define lines are inserted
+        :param cache: The ProgramCache holding linked program binaries
+        """
+        self.paths = (vertex_path, fragment_path)
+        self.features = tuple(features)
+        self.cache = cache
+        self.parallel = None
+        self.requests = {}
+        self.variants = {}
+
+        self.sources = []
+        for source_path in self.paths:
+            with open(source_path) as shader_file:
+                self.sources.append(shader_file.read())
+
+    def request(self, name, *features):
+        """
+        Requests the permutation with a set of features. Building starts when
+        start or finish is called.
+
+        :param name: A name identifying the program in statistics and profiles
+        :param *features: The names of the features to switch on
+        """
+        unknown = set(features) - set(self.features)
+        if unknown:
+            raise ValueError('{} does not support the features {}'.format(
+                ', '.join(self.paths), ', '.join(sorted(unknown))))
+
+        self.requests[name] = tuple(feature for feature in self.features
+                                    if feature in features)
+
+    def start(self):
+        """
+        Starts compiling and linking every requested permutation that is not
+        already built, without waiting for any of them.
+        """
+        if self.parallel is None:
+            self.parallel = bool(glInitParallelShaderCompileKHR())
+            if self.parallel:
+                glMaxShaderCompilerThreadsKHR(DRIVER_THREADS)
+
+        for features in self.requests.values():
+            if features in self.variants:
+                continue
+
+            sources = [expand_source(source, features) for source in self.sources]
+            variant = ShaderVariant(features, sources,
+                                    self.cache.key(*sources))
+            self.variants[features] = variant
+
+            program = self.cache.load(variant.key)
+            if program is not None:
+                variant.program = program
+                variant.cached = True
+                continue
+
+            variant.shaders = []
+            for shader_type, source in zip((GL_VERTEX_SHADER, GL_FRAGMENT_SHADER),
+                                           sources):
+                shader = glCreateShader(shader_type)
+                glShaderSource(shader, source)
+                glCompileShader(shader)
+                variant.shaders.append(shader)
+
+            variant.program = glCreateProgram()
+            for shader in variant.shaders:
+                glAttachShader(variant.program, shader)
+
+            # Allows the linked binary to be stored in the program cache
+            glProgramParameteri(variant.program,
+                                GL_PROGRAM_BINARY_RETRIEVABLE_HINT, GL_TRUE)
+            glLinkProgram(variant.program)
+
+    def ready(self):
+        """
+        Checks, without waiting, whether every permutation started has been
+        linked. Without GL_KHR_parallel_shader_compile there is no way to
+        check without waiting, so permutations are reported as ready.
+
+        :return: Whether finish can return without waiting for the compiler
+        """
+        if not self.parallel:
+            return True
+        return all(variant.cached or variant.shader_program is not None or
+                   self.completed(variant.program)
+                   for variant in self.variants.values())
+
+    @staticmethod
+    def completed(program):
+        """
+        Checks whether the driver has finished linking a program, without
+        waiting for it. PyOpenGL does not know the size of
+        GL_COMPLETION_STATUS_KHR, so the status is read into a ctypes integer.
+
+        :param program: The ID of the program
+
+        :return: Whether the link has finished, successfully or not
+        """
+        status = ctypes.c_int()
+        glGetProgramiv(program, GL_COMPLETION_STATUS_KHR, ctypes.byref(status))
+        return status.value == GL_TRUE
+
+    def finish(self):
+        """
+        Waits for every requested permutation to be built, starting any that
+        have not been started.
+
+        :return: A dictionary of the linked ShaderProgram of each requested
+                 name
+        """
+        self.start()
+
+        programs = {}
+        for name, features in self.requests.items():
+            variant = self.variants[features]
+            if variant.shader_program is None:
+                variant.shader_program = self.link(variant, name)
+            programs[name] = variant.shader_program
+        return programs
+
+    def link(self, variant, name):
+        """
+        Checks that a permutation compiled and linked, frees its shaders and
+        stores its binary in the program cache.
+
+        :param variant: The ShaderVariant
+        :param name: A name identifying the program in statistics and profiles
+
+        :return: The linked ShaderProgram
+        """
+        if variant.cached:
+            return ShaderProgram(variant.program, name)
+
+        description = '{} with features [{}]'.format(
+            name, ', '.join(variant.features))
+
+        errors = []
+        for source_path, shader in zip(self.paths, variant.shaders):
+            log = glGetShaderInfoLog(shader)
+            if glGetShaderiv(shader, GL_COMPILE_STATUS) != GL_TRUE:
+                errors.append('Could not compile {} for {}:\n{}'.format(
+                    source_path, description, log.decode(errors='replace')))
+            elif log:
+                print(log)
+
+        if not errors:
+            log = glGetProgramInfoLog(variant.program)
+            if glGetProgramiv(variant.program, GL_LINK_STATUS) != GL_TRUE:
+                errors.append('Could not link the {} program:\n{}'.format(
+                    description, log.decode(errors='replace')))
+            elif log:
+                print(log)
+
+        for shader in variant.shaders:
+            glDetachShader(variant.program, shader)
+            glDeleteShader(shader)
+        variant.shaders = []
+
+        if errors:
+            glDeleteProgram(variant.program)
+            raise RuntimeError('\n'.join(errors))
+
+        self.cache.store(variant.key, variant.program)
+        return ShaderProgram(variant.program, name)
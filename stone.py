@@ -8,141 +8,94 @@ import numpy as np
 from OpenGL.GL import *
 from object import SceneObject
 
+# The six faces of the cuboid in the order they are tessellated. Each face is
+# described by the axis it is fixed on followed by the axes its two grid
+# coordinates run along, the sign of the fixed axis, and whether the triangle
+# winding is flipped so that every face stays front-facing from outside.
+FACE_AXES = np.array([[0, 1, 2], [0, 1, 2],
+                      [1, 0, 2], [1, 0, 2],
+                      [2, 0, 1], [2, 0, 1]])
+FACE_SIGNS = np.array([-1.0, 1.0, -1.0, 1.0, -1.0, 1.0])
+FACE_FLIPPED = np.array([False, True, True, False, False, True])
+
+# Subdivisions of the coarser levels of detail. The faces are flat, so every
+# level has the same shape and shading.
+LOD_DIVISIONS = (4, 1)
+
 class Stone(SceneObject):
     """
     Class representing a stone in the scene.
     """
 
-    def __init__(self, shader_program):
+    # A stone fills its bounding box
+    occluder = True
+
+    def __init__(self, shader_program, divisions=10):
         """
         Contructor. Tesselates the shape, sets normals and elements. Sets up
-        material properties. Buffers all the data to the GPU.
+        material properties. Buffers all the data to the GPU, unless a stone
+        with the same number of divisions already has. Coarser levels of
+        detail are built with fewer subdivisions.
 
-        :param shader_program: A unique ID for the shader_program to be used
-                               with this object
+        :param shader_program: The ShaderProgram to be used with this object
+        :param divisions: The number of subdivisions for tessellation of the
+                          finest level of detail
         """
-        self.tessellate(10)
+        super().__init__()
+        levels = [divisions] + [level for level in LOD_DIVISIONS
+                                if level < divisions]
+        self.load_lods(shader_program, [(level,) for level in levels])
 
         self.k_ambient = np.array([0.15, 0.25, 0.25], dtype=np.float32)
         self.k_diffuse = np.array([0.25, 0.3, 0.3], dtype=np.float32)
         self.k_specular = np.array([0.3, 0.3, 0.3], dtype=np.float32)
         self.shininess = 2.0
 
-        self.set_buffers(shader_program)
-
     def tessellate(self, divisions):
         """
         Calculates the vertices, triangles and normals at the vertices of a
         stone object. A stone is represented as a cuboid.
 
+        Each face is generated as a (divisions + 1) x (divisions + 1) grid of
+        vertices using array operations, so the cost of tessellation does not
+        grow with Python loop overhead at high subdivision counts.
+
         :param divisions: The number of subdivisions for tessellation
         """
         start, end = -1.0, 1.0
         step = (end - start) / divisions
-
-        vertices = []
-        normals = []
-        elements = []
-
-        # X = -1
-        num_vertices = len(vertices)
-        for i in np.arange(start, end+step, step):
-            for j in np.arange(start, end+step, step):
-                vertices.append([-1.0, i, j])
-                normals.append([-1.0, 0.0, 0.0])
-        
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append(num_vertices + i * (divisions + 1) + j) # 0
-                elements.append(num_vertices + i * (divisions + 1) + (j + 1)) # 1
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1)) # 4
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1)) # 4
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + j) # 3
-                elements.append(num_vertices + i * (divisions + 1) + j) # 0
-
-        # X = 1
-        num_vertices = len(vertices)
-        for i in np.arange(start, end+step, step):
-            for j in np.arange(start, end+step, step):
-                vertices.append([1.0, i, j])
-                normals.append([1.0, 0.0, 0.0])
-
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append(num_vertices + i * (divisions + 1) + j) # 0
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + j) # 3
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1)) # 4
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1)) # 4
-                elements.append(num_vertices + i * (divisions + 1) + (j + 1)) # 1
-                elements.append(num_vertices + i * (divisions + 1) + j) # 0
-
-        # Y = -1
-        num_vertices = len(vertices)
-        for i in np.arange(start, end+step, step):
-            for j in np.arange(start, end+step, step):
-                vertices.append([i, -1.0, j])
-                normals.append([0.0, -1.0, 0.0])
-        
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append(num_vertices + i * (divisions + 1) + j)
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + j)
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + i * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + i * (divisions + 1) + j)
-
-        # Y = 1
-        num_vertices = len(vertices)
-        for i in np.arange(start, end+step, step):
-            for j in np.arange(start, end+step, step):
-                vertices.append([i, 1.0, j])
-                normals.append([0.0, 1.0, 0.0])
-        
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append(num_vertices + i * (divisions + 1) + j)
-                elements.append(num_vertices + i * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + j)
-                elements.append(num_vertices + i * (divisions + 1) + j)
-
-        # Z = -1
-        num_vertices = len(vertices)
-        for i in np.arange(start, end+step, step):
-            for j in np.arange(start, end+step, step):
-                vertices.append([i, j, -1.0])
-                normals.append([0.0, 0.0, -1.0])
-        
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append(num_vertices + i * (divisions + 1) + j)
-                elements.append(num_vertices + i * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + j)
-                elements.append(num_vertices + i * (divisions + 1) + j)
-
-        # Z = 1
-        num_vertices = len(vertices)
-        for i in np.arange(start, end+step, step):
-            for j in np.arange(start, end+step, step):
-                vertices.append([i, j, 1.0])
-                normals.append([0.0, 0.0, 1.0])
-        
-        for i in range(divisions):
-            for j in range(divisions):
-                elements.append(num_vertices + i * (divisions + 1) + j)
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + j)
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + (i + 1) * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + i * (divisions + 1) + (j + 1))
-                elements.append(num_vertices + i * (divisions + 1) + j)
-
-        vertices = [x for vertex in vertices for x in vertex]
-        normals = [x for normal in normals for x in normal]
-
-        self.vertices = np.array(vertices, dtype=np.float32)
-        self.elements = np.array(elements, dtype=np.uint16)
-        self.normals = np.array(normals, dtype=np.float32)
+        row = divisions + 1
+        face_size = row * row
+
+        # Grid coordinates along a face, identical to the values produced by
+        # stepping through np.arange one vertex at a time
+        coords = np.arange(start, end + step, step)[:row]
+        grid_i, grid_j = np.meshgrid(coords, coords, indexing='ij')
+
+        # Vertices in face-local (fixed, i, j) coordinates for all six faces
+        local = np.empty((6, face_size, 3), dtype=np.float64)
+        local[:, :, 0] = FACE_SIGNS[:, np.newaxis]
+        local[:, :, 1] = grid_i.ravel()
+        local[:, :, 2] = grid_j.ravel()
+
+        # Scatter the local coordinates onto the x, y and z axes of each face
+        to_local = np.argsort(FACE_AXES, axis=1)
+        vertices = np.take_along_axis(local, to_local[:, np.newaxis, :], axis=2)
+
+        normals = np.zeros((6, 3), dtype=np.float64)
+        normals[np.arange(6), FACE_AXES[:, 0]] = FACE_SIGNS
+        normals = np.repeat(normals, face_size, axis=0)
+
+        # Two triangles per grid cell, wound according to the face direction
+        cells = np.arange(divisions)
+        corners = (cells[:, np.newaxis] * row + cells).ravel()
+        offsets = np.where(FACE_FLIPPED[:, np.newaxis],
+                           [0, row, row + 1, row + 1, 1, 0],
+                           [0, 1, row + 1, row + 1, row, 0])
+        elements = (np.arange(6)[:, np.newaxis, np.newaxis] * face_size
+                    + corners[np.newaxis, :, np.newaxis]
+                    + offsets[:, np.newaxis, :])
+
+        self.vertices = vertices.astype(np.float32).ravel()
+        self.elements = elements.astype(np.uint32).ravel()
+        self.normals = normals.astype(np.float32).ravel()
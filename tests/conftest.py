@@ -0,0 +1,13 @@
+"""
+conftest.py
+
+Makes the modules of the repository importable from the tests, and imports
+headless first so PyOpenGL picks the EGL platform for the rendering test.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import headless
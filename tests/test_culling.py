@@ -0,0 +1,75 @@
+"""
+test_culling.py
+
+Tests moving bounding spheres and boxes into world space.
+"""
+
+import numpy as np
+from culling import world_boxes, world_spheres
+from transform_store import TransformStore
+
+
+def random_transforms(rng, count):
+    """
+    :return: An (N, 4, 4) array of model matrices of random, non-uniform
+             scales, rotations and translations
+    """
+    store = TransformStore()
+    store.allocate(count)
+    for index in range(count):
+        store.scale(index, *rng.uniform(0.2, 3.0, 3))
+        store.rotate(index, *rng.uniform(-180.0, 180.0, 3))
+        store.scale(index, *rng.uniform(0.2, 3.0, 3))
+        store.translate(index, *rng.uniform(-50.0, 50.0, 3))
+    return store.matrices().astype(np.float64)
+
+
+def transform_points(transforms, points):
+    """
+    :return: Points of shape (N, M, 3) moved by their model matrices
+    """
+    return (np.einsum('nij,nmj->nmi', transforms[:, :3, :3], points)
+            + transforms[:, np.newaxis, :3, 3])
+
+
+def test_world_spheres_contain_transformed_spheres():
+    rng = np.random.default_rng(1)
+    count = 50
+    transforms = random_transforms(rng, count)
+    centers = rng.uniform(-2.0, 2.0, (count, 3))
+    radii = rng.uniform(0.1, 2.0, count)
+
+    directions = rng.normal(size=(count, 200, 3))
+    directions /= np.linalg.norm(directions, axis=2, keepdims=True)
+    points = transform_points(transforms, centers[:, np.newaxis]
+                              + directions * radii[:, np.newaxis, np.newaxis])
+
+    world_centers, world_radii = world_spheres(transforms, centers, radii)
+    distances = np.linalg.norm(points - world_centers[:, np.newaxis], axis=2)
+    assert np.all(distances <= world_radii[:, np.newaxis] * (1.0 + 1e-9))
+
+
+def test_world_boxes_are_tight():
+    rng = np.random.default_rng(2)
+    count = 50
+    transforms = random_transforms(rng, count)
+    centers = rng.uniform(-2.0, 2.0, (count, 3))
+    extents = rng.uniform(0.1, 2.0, (count, 3))
+
+    signs = np.array(np.meshgrid([-1, 1], [-1, 1], [-1, 1])).reshape((3, -1)).T
+    points = transform_points(transforms, centers[:, np.newaxis]
+                              + signs * extents[:, np.newaxis])
+
+    # The box is the bounding box of the transformed corners
+    world_centers, world_extents = world_boxes(transforms, centers, extents)
+    assert np.allclose(world_centers - world_extents, points.min(axis=1))
+    assert np.allclose(world_centers + world_extents, points.max(axis=1))
+
+
+def test_identity_transforms():
+    transforms = np.tile(np.identity(4), (3, 1, 1))
+    centers = np.arange(9.0).reshape((3, 3))
+    radii = np.array([1.0, 2.0, 3.0])
+
+    assert np.allclose(world_spheres(transforms, centers, radii)[1], radii)
+    assert np.allclose(world_boxes(transforms, centers, centers)[0], centers)
@@ -0,0 +1,90 @@
+"""
+test_geometry.py
+
+Tests the tessellation of stones and boulders. Only the NumPy geometry is
+generated, so no OpenGL context is needed.
+"""
+
+import numpy as np
+import pytest
+from boulder import Boulder, ICOSPHERE, UV_SPHERE, sphere_counts
+from stone import Stone
+
+
+def tessellate(object_type, *params):
+    """
+    Tessellates an object without constructing it, which would upload its
+    meshes.
+
+    :param object_type: Stone or Boulder
+    :param params: The parameters of tessellate
+
+    :return: The vertices, normals and triangles as (N, 3) arrays
+    """
+    obj = object.__new__(object_type)
+    obj.tessellate(*params)
+    return (obj.vertices.reshape((-1, 3)), obj.normals.reshape((-1, 3)),
+            obj.elements.reshape((-1, 3)))
+
+
+def face_normals(vertices, triangles):
+    """
+    :return: The unnormalised normals of the triangles, following their
+             winding
+    """
+    corners = vertices[triangles]
+    return np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+
+
+@pytest.mark.parametrize('divisions', [1, 4, 10])
+def test_stone_counts(divisions):
+    vertices, normals, triangles = tessellate(Stone, divisions)
+    assert len(vertices) == len(normals) == 6 * (divisions + 1) ** 2
+    assert len(triangles) == 12 * divisions ** 2
+    assert triangles.min() == 0 and triangles.max() == len(vertices) - 1
+
+
+@pytest.mark.parametrize('divisions', [1, 4, 10])
+def test_stone_is_a_cube(divisions):
+    vertices, normals, triangles = tessellate(Stone, divisions)
+    assert np.allclose(np.abs(vertices).max(axis=1), 1.0)
+    assert np.allclose(np.linalg.norm(normals, axis=1), 1.0)
+
+    # Every vertex lies on the face its normal points out of
+    assert np.allclose((vertices * normals).sum(axis=1), 1.0)
+
+
+@pytest.mark.parametrize('divisions', [1, 4, 10])
+def test_stone_winding(divisions):
+    vertices, normals, triangles = tessellate(Stone, divisions)
+    facing = (face_normals(vertices, triangles) * normals[triangles[:, 0]]).sum(axis=1)
+    assert np.all(facing > 0.0)
+
+
+@pytest.mark.parametrize('topology, divisions',
+                         [(UV_SPHERE, 3), (UV_SPHERE, 12), (UV_SPHERE, 20),
+                          (ICOSPHERE, 0), (ICOSPHERE, 1), (ICOSPHERE, 3)])
+def test_boulder_is_a_closed_sphere(topology, divisions):
+    vertices, normals, triangles = tessellate(Boulder, divisions, topology)
+    assert (len(vertices), len(triangles)) == sphere_counts(topology, divisions)
+    assert np.allclose(np.linalg.norm(vertices, axis=1), 1.0)
+    assert np.array_equal(normals, vertices)
+
+    # Faces point outwards and none are degenerate
+    facing = (face_normals(vertices, triangles)
+              * vertices[triangles].mean(axis=1)).sum(axis=1)
+    assert np.all(facing > 1e-9)
+
+    # Every edge is shared by exactly two triangles, once in each direction
+    edges = triangles[:, [[0, 1], [1, 2], [2, 0]]].reshape((-1, 2))
+    assert len(np.unique(edges, axis=0)) == len(edges)
+    assert len(np.unique(np.sort(edges, axis=1), axis=0)) * 2 == len(edges)
+
+
+def test_boulder_rejects_bad_parameters():
+    with pytest.raises(ValueError):
+        Boulder.uv_sphere(2)
+    with pytest.raises(ValueError):
+        sphere_counts('cube', 2)
+    with pytest.raises(ValueError):
+        tessellate(Boulder, 2, 'cube')
@@ -0,0 +1,58 @@
+"""
+test_headless.py
+
+Renders the default scene offscreen, drawing one object at a time and
+drawing the objects in instanced batches, and compares the frames. Skipped
+when no headless OpenGL context can be created.
+"""
+
+import os
+import numpy as np
+import pytest
+import headless
+
+SIZE = 128
+
+# Shaders and textures are loaded relative to the repository
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope='module')
+def context():
+    try:
+        context = headless.HeadlessContext(SIZE, SIZE)
+    except Exception as error:
+        pytest.skip('No headless OpenGL context: {}'.format(error))
+
+    directory = os.getcwd()
+    os.chdir(REPOSITORY)
+    try:
+        yield context
+    finally:
+        os.chdir(directory)
+        context.close()
+
+
+def render_frames(context, instanced):
+    """
+    :return: Two frames of the default scene, before and after turning it
+    """
+    from scene import Scene
+    scene = Scene(instanced=instanced)
+    try:
+        first = context.render(scene)
+        scene.rotate(30)
+        return first, context.render(scene)
+    finally:
+        scene.close()
+
+
+def test_plain_and_instanced_frames_match(context):
+    plain = render_frames(context, False)
+    instanced = render_frames(context, True)
+
+    for plain_frame, instanced_frame in zip(plain, instanced):
+        assert plain_frame.shape == (SIZE, SIZE, 3)
+        assert plain_frame.any()
+        assert np.array_equal(plain_frame, instanced_frame)
+    assert not np.array_equal(*plain)
@@ -0,0 +1,57 @@
+"""
+test_mesh.py
+
+Tests picking index types and splitting triangle lists into sub-draws.
+"""
+
+import numpy as np
+import pytest
+from OpenGL.GL import GL_UNSIGNED_BYTE, GL_UNSIGNED_INT, GL_UNSIGNED_SHORT
+from mesh import index_type, split_elements
+
+
+@pytest.mark.parametrize('vertex_count, expected',
+                         [(1, (np.uint8, GL_UNSIGNED_BYTE)),
+                          (256, (np.uint8, GL_UNSIGNED_BYTE)),
+                          (257, (np.uint16, GL_UNSIGNED_SHORT)),
+                          (65536, (np.uint16, GL_UNSIGNED_SHORT)),
+                          (65537, (np.uint32, GL_UNSIGNED_INT)),
+                          (2 ** 32, (np.uint32, GL_UNSIGNED_INT))])
+def test_index_type(vertex_count, expected):
+    assert index_type(vertex_count) == expected
+
+
+def test_index_type_too_many_vertices():
+    with pytest.raises(ValueError):
+        index_type(2 ** 32 + 1)
+
+
+def strip(vertex_count):
+    """
+    :return: The indices of a triangle strip over a number of vertices, as a
+             triangle list
+    """
+    first = np.arange(vertex_count - 2)
+    return np.stack([first, first + 1, first + 2], axis=1).ravel()
+
+
+@pytest.mark.parametrize('max_vertices', [3, 4, 100, 256, 10000])
+def test_split_elements(max_vertices):
+    elements = strip(1000)
+    draws = split_elements(elements, max_vertices)
+
+    for indices, base_vertex in draws:
+        assert indices.min() == 0
+        assert indices.max() < max_vertices
+
+    # Rebasing the sub-draws gives back the triangles in order
+    rebuilt = np.concatenate([indices + base_vertex for indices, base_vertex in draws])
+    assert np.array_equal(rebuilt, elements)
+
+    if max_vertices >= 1000:
+        assert len(draws) == 1
+
+
+def test_split_elements_triangle_too_wide():
+    with pytest.raises(ValueError):
+        split_elements([0, 1, 300], 256)
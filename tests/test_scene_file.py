@@ -0,0 +1,86 @@
+"""
+test_scene_file.py
+
+Tests writing scene files and reading them back.
+"""
+
+import json
+import os
+import numpy as np
+import pytest
+from scene_file import OBJECT_DTYPE, SceneFile
+
+SCENE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'stonehenge.json')
+
+
+def random_scene(count):
+    """
+    :return: A SceneFile of a number of objects with random values
+    """
+    rng = np.random.default_rng(0)
+    records = np.zeros(count, dtype=OBJECT_DTYPE)
+    records['type'] = rng.integers(2, size=count)
+    records['translation'] = rng.uniform(-100.0, 100.0, (count, 3))
+    records['rotation'] = rng.normal(size=(count, 4))
+    records['scale'] = rng.uniform(0.1, 5.0, (count, 3))
+    for name in ('ambient', 'diffuse', 'specular'):
+        records[name] = rng.uniform(0.0, 1.0, (count, 3))
+    records['shininess'] = rng.uniform(1.0, 10.0, count)
+    return SceneFile(records)
+
+
+def test_round_trip(tmp_path):
+    scene = random_scene(100)
+    path = str(tmp_path / 'scene.json')
+    scene.save(path)
+
+    assert os.path.exists(str(tmp_path / 'scene.bin'))
+    loaded = SceneFile.load(path)
+    assert loaded.types == scene.types
+    assert loaded.records.tobytes() == scene.records.tobytes()
+    assert loaded.extent() == scene.extent()
+
+
+def test_round_trip_empty(tmp_path):
+    path = str(tmp_path / 'empty.json')
+    SceneFile().save(path)
+
+    loaded = SceneFile.load(path)
+    assert len(loaded) == 0
+    assert loaded.extent() == 0.0
+
+
+def test_stonehenge_round_trip(tmp_path):
+    scene = SceneFile.load(SCENE_PATH)
+    assert len(scene) > 0
+
+    path = str(tmp_path / 'stonehenge.json')
+    scene.save(path)
+    assert SceneFile.load(path).records.tobytes() == scene.records.tobytes()
+
+
+def test_load_rejects_bad_files(tmp_path):
+    path = str(tmp_path / 'scene.json')
+    random_scene(10).save(path)
+    with open(path) as manifest_file:
+        manifest = json.load(manifest_file)
+
+    def load(**changes):
+        with open(path, 'w') as manifest_file:
+            json.dump(dict(manifest, **changes), manifest_file)
+        return SceneFile.load(path)
+
+    with pytest.raises(ValueError):
+        load(version=manifest['version'] + 1)
+    with pytest.raises(ValueError):
+        load(count=manifest['count'] + 1)
+    with pytest.raises(ValueError):
+        load(types=['stone'])
+    with pytest.raises(ValueError):
+        load(columns=manifest['columns'][1:])
+
+
+def test_unknown_types():
+    with pytest.raises(ValueError):
+        SceneFile(types=['stone', 'tree'])
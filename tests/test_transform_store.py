@@ -0,0 +1,141 @@
+"""
+test_transform_store.py
+
+Tests the transform store against model matrices composed one 4x4 product
+at a time, as SceneObject did before the store.
+"""
+
+import math
+import numpy as np
+import pytest
+from transform_store import TransformStore, euler_quaternion, quaternion_matrix
+
+
+def scale_matrix(x, y, z):
+    return np.diag([x, y, z, 1.0])
+
+
+def rotation_matrix(x, y, z):
+    """
+    :return: The 4x4 rotation about the x, y and z axes, applied in the order
+             y -> z -> x
+    """
+    x, y, z = math.radians(x), math.radians(y), math.radians(z)
+    x_mat = np.array([[1.0, 0.0, 0.0, 0.0],
+                      [0.0, math.cos(x), -math.sin(x), 0.0],
+                      [0.0, math.sin(x), math.cos(x), 0.0],
+                      [0.0, 0.0, 0.0, 1.0]])
+    y_mat = np.array([[math.cos(y), 0.0, math.sin(y), 0.0],
+                      [0.0, 1.0, 0.0, 0.0],
+                      [-math.sin(y), 0.0, math.cos(y), 0.0],
+                      [0.0, 0.0, 0.0, 1.0]])
+    z_mat = np.array([[math.cos(z), -math.sin(z), 0.0, 0.0],
+                      [math.sin(z), math.cos(z), 0.0, 0.0],
+                      [0.0, 0.0, 1.0, 0.0],
+                      [0.0, 0.0, 0.0, 1.0]])
+    return x_mat @ z_mat @ y_mat
+
+
+def translation_matrix(x, y, z):
+    matrix = np.identity(4)
+    matrix[:3, 3] = [x, y, z]
+    return matrix
+
+
+OPERATIONS = [('scale', scale_matrix), ('rotate', rotation_matrix),
+              ('translate', translation_matrix)]
+
+
+def test_euler_quaternion_matches_matrices():
+    rng = np.random.default_rng(0)
+    for angles in rng.uniform(-180.0, 180.0, (20, 3)):
+        q = euler_quaternion(*angles)
+        assert np.isclose(np.linalg.norm(q), 1.0)
+        assert np.allclose(quaternion_matrix(q), rotation_matrix(*angles)[:3, :3])
+
+
+@pytest.mark.parametrize('uniform', [True, False])
+def test_random_operations(uniform):
+    rng = np.random.default_rng(1)
+    count = 40
+    store = TransformStore(4)
+    store.allocate(count)
+    reference = np.tile(np.identity(4), (count, 1, 1))
+
+    for step in range(200):
+        name, matrix = OPERATIONS[rng.integers(len(OPERATIONS))]
+        if name == 'scale':
+            values = rng.uniform(0.5, 2.0, 3)
+            if uniform:
+                values[:] = values[0]
+        elif name == 'rotate':
+            values = rng.uniform(-90.0, 90.0, 3)
+        else:
+            values = rng.uniform(-5.0, 5.0, 3)
+
+        # Single objects, arrays of indices, slices and all objects take
+        # different paths
+        choice = rng.integers(4)
+        if choice == 0:
+            indices = int(rng.integers(count))
+        elif choice == 1:
+            indices = rng.choice(count, rng.integers(1, count), replace=False)
+        elif choice == 2:
+            indices = slice(int(rng.integers(count)), None)
+        else:
+            indices = None
+
+        getattr(store, name)(indices, *values)
+        selection = slice(None) if indices is None else indices
+        reference[selection] = matrix(*values) @ reference[selection]
+
+    assert store.sheared[:count].any() != uniform
+    assert np.allclose(store.matrices(), reference, atol=1e-4)
+    assert np.allclose(store.matrices(3), reference[3], atol=1e-4)
+
+
+def test_shear_after_full_turn():
+    store = TransformStore()
+    index = int(store.allocate()[0])
+    for step in range(12):
+        store.rotate(index, 0.0, 30.0, 0.0)
+    store.scale(index, 2.0, 1.0, 1.0)
+
+    assert not store.sheared[index]
+    assert np.allclose(store.matrices(index), scale_matrix(2.0, 1.0, 1.0),
+                       atol=1e-5)
+
+
+def test_set_drops_shear():
+    store = TransformStore()
+    indices = store.allocate(2)
+    store.rotate(indices, 0.0, 45.0, 0.0)
+    store.scale(indices, 1.0, 3.0, 1.0)
+    assert store.sheared[indices].all()
+
+    store.set(indices, [[1.0, 2.0, 3.0]] * 2, [[0.0, 0.0, 0.0, 2.0]] * 2,
+              [[1.0, 2.0, 3.0]] * 2)
+    assert not store.sheared[indices].any()
+    expected = translation_matrix(1.0, 2.0, 3.0) @ scale_matrix(1.0, 2.0, 3.0)
+    assert np.allclose(store.matrices(indices), expected)
+
+
+def test_allocate_grows_and_resets():
+    store = TransformStore(2)
+    first = store.allocate(2)
+    store.scale(first, 1.0, 2.0, 3.0)
+    store.translate(first, 1.0, 1.0, 1.0)
+
+    grown = store.allocate(5)
+    assert list(grown) == [2, 3, 4, 5, 6]
+    assert len(store) == 7
+    assert np.allclose(store.matrices(grown), np.identity(4))
+    assert np.allclose(store.matrices(first),
+                       translation_matrix(1.0, 1.0, 1.0) @ scale_matrix(1.0, 2.0, 3.0))
+
+    # Cleared storage is reused with identity transforms
+    store.clear()
+    assert len(store) == 0
+    reused = store.allocate(2)
+    assert list(reused) == [0, 1]
+    assert np.allclose(store.matrices(), np.identity(4))
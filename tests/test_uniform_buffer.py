@@ -0,0 +1,51 @@
+"""
+test_uniform_buffer.py
+
+Tests packing the camera and light state into the std140 FrameUniforms
+block.
+"""
+
+import numpy as np
+import uniform_buffer
+from camera import Camera
+from light import Light
+from uniform_buffer import BLOCK_FLOATS, pack_block
+
+
+def test_std140_offsets():
+    # mat4 members take 16 floats, and each vec3 is aligned to and padded
+    # out to 4 floats
+    assert uniform_buffer.VIEW_OFFSET == 0
+    assert uniform_buffer.PROJECTION_OFFSET == 16
+    vec3_offsets = [uniform_buffer.LIGHT_POSITION_CAM_OFFSET,
+                    uniform_buffer.AMBIENT_OFFSET,
+                    uniform_buffer.DIFFUSE_OFFSET,
+                    uniform_buffer.SPECULAR_OFFSET]
+    assert vec3_offsets == [32, 36, 40, 44]
+    assert BLOCK_FLOATS == 48
+
+
+def test_pack_block():
+    camera = Camera()
+    light = Light()
+    data = pack_block(camera, light)
+
+    assert data.dtype == np.float32 and data.shape == (BLOCK_FLOATS,)
+    assert np.array_equal(data[0:16], camera.view_matrix())
+    assert np.array_equal(data[16:32], camera.projection_matrix())
+    assert np.array_equal(data[36:39], light.ambient)
+    assert np.array_equal(data[40:43], light.diffuse)
+    assert np.array_equal(data[44:47], light.specular)
+
+    # The light position is rotated, not translated, into camera space
+    view = camera.view_matrix().reshape((4, 4)).T
+    assert np.allclose(data[32:35], view[:3, :3] @ light.position)
+
+    # Padding after each vec3 is left zero
+    assert np.all(data[[35, 39, 43, 47]] == 0.0)
+
+
+def test_pack_block_into_array():
+    data = np.zeros(BLOCK_FLOATS, dtype=np.float32)
+    assert pack_block(Camera(), Light(), data) is data
+    assert data.any()
@@ -0,0 +1,210 @@
+"""
+texture_cache.py
+
+Contains the TextureCache class, which stores the complete mip chain of each
+texture in a file ready to be uploaded to the GPU, keyed by a hash of the
+source image's contents. Cache files are memory-mapped when loaded, so warm
+loads decode nothing and each level is handed to OpenGL straight from the
+mapped file.
+
+The cache is filled on first use, or ahead of time by running this module:
+
+    python texture_cache.py grass_texture.jpg stone_texture.jpg ...
+"""
+
+import hashlib
+import os
+import struct
+import numpy as np
+
+DEFAULT_DIRECTORY = "texture_cache"
+
+# File layout: a header of magic, format version, width, height and level
+# count, padded to HEADER_SIZE bytes, followed by the RGBA8 pixels of every
+# mip level in turn, each bottom row first.
+MAGIC = b'MIPC'
+VERSION = 1
+HEADER_FORMAT = '<4sIIII'
+HEADER_SIZE = 32
+
+EXTENSION = '.mip'
+
+
+def content_hash(path):
+    """
+    Returns a hash of the contents of a file.
+
+    :param path: The path of the file
+
+    :return: The hash as a hexadecimal string
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as source_file:
+        for chunk in iter(lambda: source_file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def level_sizes(width, height):
+    """
+    Returns the sizes of all levels of a full mip chain, halving each
+    dimension (rounding down) until both are 1, as OpenGL does.
+
+    :param width: The width of the base level in pixels
+    :param height: The height of the base level in pixels
+
+    :return: A list of (width, height) tuples, base level first
+    """
+    sizes = [(width, height)]
+    while width > 1 or height > 1:
+        width, height = max(1, width // 2), max(1, height // 2)
+        sizes.append((width, height))
+    return sizes
+
+
+def build_mip_chain(pixels):
+    """
+    Builds a full mip chain from an image by repeated box filtering.
+
+    :param pixels: A (height, width, 4) array of RGBA bytes
+
+    :return: A list of (height, width, 4) arrays, base level first
+    """
+    from PIL import Image
+
+    height, width = pixels.shape[:2]
+    levels = [pixels]
+    for level_width, level_height in level_sizes(width, height)[1:]:
+        image = Image.fromarray(levels[-1])
+        levels.append(np.asarray(image.resize((level_width, level_height),
+                                              Image.BOX)))
+    return levels
+
+
+class TextureCache(object):
+    """
+    A directory of mip chain files named after the content hash of their
+    source images. Changing a source image changes its hash, so stale files
+    are never used.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY):
+        """
+        Constructor.
+
+        :param directory: The directory holding the cache files. It is created
+                          when the first file is written.
+        """
+        self.directory = directory
+
+    def file_path(self, key):
+        """
+        Returns the path of the cache file for a content hash.
+
+        :param key: The content hash of the source image
+
+        :return: The path of the cache file
+        """
+        return os.path.join(self.directory, key + EXTENSION)
+
+    def read(self, key):
+        """
+        Memory-maps the mip chain stored for a content hash.
+
+        :param key: The content hash of the source image
+
+        :return: A list of (height, width, 4) arrays viewing the mapped file,
+                 base level first, or None if nothing valid is stored
+        """
+        path = self.file_path(key)
+        if not os.path.exists(path):
+            return None
+
+        with open(path, 'rb') as cache_file:
+            header = cache_file.read(struct.calcsize(HEADER_FORMAT))
+        if len(header) < struct.calcsize(HEADER_FORMAT):
+            return None
+
+        magic, version, width, height, level_count = struct.unpack(HEADER_FORMAT,
+                                                                   header)
+        sizes = level_sizes(width, height)
+        if magic != MAGIC or version != VERSION or level_count != len(sizes):
+            return None
+
+        expected = HEADER_SIZE + sum(4 * w * h for w, h in sizes)
+        if os.path.getsize(path) != expected:
+            return None
+
+        data = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE)
+        levels = []
+        offset = 0
+        for level_width, level_height in sizes:
+            size = 4 * level_width * level_height
+            levels.append(data[offset:offset + size].reshape((level_height,
+                                                              level_width, 4)))
+            offset += size
+        return levels
+
+    def write(self, key, levels):
+        """
+        Stores a mip chain for a content hash. The file is written under a
+        temporary name and then renamed, so readers never see a partial file.
+
+        :param key: The content hash of the source image
+        :param levels: A list of (height, width, 4) arrays, base level first
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.file_path(key)
+        temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+
+        height, width = levels[0].shape[:2]
+        header = struct.pack(HEADER_FORMAT, MAGIC, VERSION, width, height,
+                             len(levels))
+
+        with open(temporary_path, 'wb') as cache_file:
+            cache_file.write(header.ljust(HEADER_SIZE, b'\0'))
+            for level in levels:
+                cache_file.write(np.ascontiguousarray(level).tobytes())
+        os.replace(temporary_path, path)
+
+    def load(self, path, decode):
+        """
+        Returns the mip chain of an image, from the cache if possible, and
+        otherwise by decoding the image and building the chain, which is then
+        stored for next time.
+
+        :param path: The path of the image file
+        :param decode: A function decoding the image file into a
+                       (height, width, 4) array of RGBA bytes, bottom row first
+
+        :return: A list of (height, width, 4) arrays, base level first
+        """
+        key = content_hash(path)
+        levels = self.read(key)
+        if levels is not None:
+            return levels
+
+        levels = build_mip_chain(decode(path))
+        try:
+            self.write(key, levels)
+        except OSError as cache_ex:
+            print('Could not write texture cache file:', cache_ex)
+            return levels
+
+        # Map the file just written, so the decoded copy can be freed
+        return self.read(key)
+
+
+# The cache shared by all texture loads
+texture_cache = TextureCache()
+
+
+if __name__ == "__main__":
+    import sys
+    from texture_loader import decode_image
+
+    for source_path in sys.argv[1:]:
+        mip_levels = texture_cache.load(source_path, decode_image)
+        print('{}: {} levels -> {}'.format(
+            source_path, len(mip_levels),
+            texture_cache.file_path(content_hash(source_path))))
@@ -0,0 +1,294 @@
+"""
+texture_loader.py
+
+Contains the TextureLoader class, which decodes texture images on a pool of
+background threads and uploads them to the GPU on the OpenGL thread. The mip
+chain of each image is kept in the texture cache (see texture_cache.py), so
+an image is only decoded the first time it is loaded.
+
+Images are decoded with Pillow. If Pillow is not installed, textures are
+loaded synchronously through pysoil instead, which needs the SOIL library.
+The layers of array textures are then loaded as separate textures by pysoil
+and copied into the array texture level by level.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from OpenGL.GL import *
+from texture_cache import texture_cache, level_sizes
+from texture_manager import texture_manager, SCRATCH_UNIT
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# pysoil loads soil.dll when imported, which fails where it is not installed
+try:
+    import pysoil
+except (ImportError, OSError):
+    pysoil = None
+
+DEFAULT_WORKERS = 4
+
+
+def decode_image(path):
+    """
+    Decodes an image file into RGBA pixels. Runs on a worker thread.
+
+    :param path: The path of the image file
+
+    :return: A (height, width, 4) array of bytes, bottom row first as OpenGL
+             expects
+    """
+    with Image.open(path) as image:
+        pixels = np.asarray(image.convert('RGBA'))
+    return np.ascontiguousarray(pixels[::-1])
+
+
+class TextureLoader(object):
+    """
+    Loads textures without blocking the OpenGL thread on image decoding. A
+    texture name is returned as soon as a load is requested, and the decoded
+    image is uploaded to it later, when upload_ready or finish is called.
+    Several images are decoded in parallel. Same-sized images can be packed
+    into the layers of one array texture. Loading the same images again
+    returns the texture already created for them.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, cache=texture_cache):
+        """
+        Constructor.
+
+        :param workers: The number of threads decoding images
+        :param cache: The TextureCache holding decoded mip chains
+        """
+        self.workers = workers
+        self.cache = cache
+
+        # A TextureStreamer to upload the larger mip levels over several
+        # frames, or None to upload textures completely at once
+        self.streamer = None
+        self.executor = None
+        self.pending = {}
+        self.textures = {}
+
+    def load(self, path):
+        """
+        Requests a texture to be loaded from an image file.
+
+        :param path: The path of the image file
+
+        :return: The name of the texture. It has no contents until the decoded
+                 image is uploaded, unless pysoil was used.
+        """
+        if path in self.textures:
+            return self.textures[path]
+
+        if Image is None:
+            texture = self.load_with_soil(path)
+            self.textures[path] = texture
+            return texture
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        texture = int(glGenTextures(1))
+        texture_manager.register(texture, GL_TEXTURE_2D)
+        self.pending[texture] = [self.executor.submit(self.cache.load, path,
+                                                      decode_image)]
+        self.textures[path] = texture
+        return texture
+
+    def load_array(self, paths):
+        """
+        Requests an array texture to be loaded, with one layer per image
+        file. All images must have the same size.
+
+        :param paths: The paths of the image files, in layer order
+
+        :return: The name of the texture. It has no contents until the decoded
+                 images are uploaded.
+        """
+        key = tuple(paths)
+        if key in self.textures:
+            return self.textures[key]
+
+        if Image is None:
+            texture = self.load_array_with_soil(paths)
+            self.textures[key] = texture
+            return texture
+
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+        texture = int(glGenTextures(1))
+        texture_manager.register(texture, GL_TEXTURE_2D_ARRAY)
+        self.pending[texture] = [self.executor.submit(self.cache.load, path,
+                                                      decode_image)
+                                 for path in paths]
+        self.textures[key] = texture
+        return texture
+
+    @staticmethod
+    def load_with_soil(path):
+        """
+        Loads a texture synchronously with pysoil.
+
+        :param path: The path of the image file
+
+        :return: The name of the texture, or 0 if it could not be loaded
+        """
+        if pysoil is None:
+            raise RuntimeError('Loading textures needs either Pillow or the '
+                               'SOIL library')
+
+        # SOIL binds the texture it creates to the active unit
+        glActiveTexture(GL_TEXTURE0 + SCRATCH_UNIT)
+        return pysoil.SOIL_load_OGL_texture(
+            path,
+            pysoil.SOIL_LOAD_AUTO,
+            pysoil.SOIL_CREATE_NEW_ID,
+            pysoil.SOIL_FLAG_INVERT_Y | pysoil.SOIL_FLAG_TEXTURE_REPEATS
+            | pysoil.SOIL_FLAG_MIPMAPS
+        )
+
+    def load_array_with_soil(self, paths):
+        """
+        Loads an array texture synchronously with pysoil. Each image is
+        loaded as a texture of its own, with mipmaps, and its levels are read
+        back and uploaded as a layer of the array texture.
+
+        :param paths: The paths of the image files, in layer order
+
+        :return: The name of the array texture
+        """
+        layers = []
+        for path in paths:
+            layer_texture = self.load_with_soil(path)
+            if not layer_texture:
+                raise RuntimeError('Could not load {} with SOIL'.format(path))
+
+            glBindTexture(GL_TEXTURE_2D, layer_texture)
+            glGenerateMipmap(GL_TEXTURE_2D)
+            width = glGetTexLevelParameteriv(GL_TEXTURE_2D, 0, GL_TEXTURE_WIDTH)
+            height = glGetTexLevelParameteriv(GL_TEXTURE_2D, 0,
+                                              GL_TEXTURE_HEIGHT)
+
+            glPixelStorei(GL_PACK_ALIGNMENT, 1)
+            levels = []
+            for level_width, level_height in level_sizes(int(width),
+                                                         int(height)):
+                pixels = glGetTexImage(GL_TEXTURE_2D, len(levels), GL_RGBA,
+                                       GL_UNSIGNED_BYTE)
+                levels.append(np.frombuffer(pixels, dtype=np.uint8).reshape(
+                    (level_height, level_width, 4)))
+
+            glBindTexture(GL_TEXTURE_2D, 0)
+            glDeleteTextures([layer_texture])
+            layers.append(levels)
+
+        texture = int(glGenTextures(1))
+        texture_manager.register(texture, GL_TEXTURE_2D_ARRAY)
+        self.upload(texture, layers)
+        return texture
+
+    def upload_ready(self):
+        """
+        Uploads the textures whose images have finished decoding, without
+        waiting for the others.
+
+        :return: The number of textures still being decoded
+        """
+        for texture, futures in list(self.pending.items()):
+            if all(future.done() for future in futures):
+                del self.pending[texture]
+                self.upload(texture, [future.result() for future in futures])
+        return len(self.pending)
+
+    def finish(self):
+        """
+        Waits for every requested image to be decoded and uploads it.
+        """
+        for texture, futures in list(self.pending.items()):
+            del self.pending[texture]
+            self.upload(texture, [future.result() for future in futures])
+
+    def delete(self, texture):
+        """
+        Deletes a texture, so loading its images again creates a new one.
+
+        :param texture: The name of the texture
+        """
+        for key, loaded in list(self.textures.items()):
+            if loaded == texture:
+                del self.textures[key]
+        self.pending.pop(texture, None)
+        texture_manager.delete(texture)
+
+    def clear(self):
+        """
+        Deletes every texture created by the loader, so loading an image
+        again creates a new texture even in another OpenGL context. Images
+        still being decoded are not uploaded. Must be called while the context
+        the textures were created in is current.
+        """
+        for texture in set(self.textures.values()):
+            self.delete(texture)
+        self.pending.clear()
+
+    def upload(self, texture, layers):
+        """
+        Uploads the mip chains of a texture, with repeating wrap and
+        trilinear filtering. Levels read from the cache are passed to OpenGL
+        directly from the mapped file. The texture is bound to the scratch
+        unit, so the units of the texture manager are left as they are.
+
+        With a streamer, only the smallest levels are uploaded here and the
+        rest are handed to the streamer.
+
+        :param texture: The name of the texture
+        :param layers: A list with the mip chain of each layer, in layer
+                       order. Each chain is a list of (height, width, 4)
+                       arrays of RGBA bytes, base level first.
+        """
+        target = texture_manager.target(texture)
+        levels = layers[0]
+
+        glActiveTexture(GL_TEXTURE0 + SCRATCH_UNIT)
+        glBindTexture(target, texture)
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+
+        if target == GL_TEXTURE_2D_ARRAY and \
+                any(layer[0].shape != levels[0].shape for layer in layers):
+            raise ValueError('The layers of an array texture must all have '
+                             'the same size')
+
+        if self.streamer is not None:
+            self.streamer.add(texture, target, layers)
+        elif target == GL_TEXTURE_2D_ARRAY:
+            for level, pixels in enumerate(levels):
+                height, width = pixels.shape[:2]
+                glTexImage3D(target, level, GL_RGBA8, width, height,
+                             len(layers), 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+                for index, layer in enumerate(layers):
+                    glTexSubImage3D(target, level, 0, 0, index, width, height,
+                                    1, GL_RGBA, GL_UNSIGNED_BYTE, layer[level])
+        else:
+            for level, pixels in enumerate(levels):
+                height, width = pixels.shape[:2]
+                glTexImage2D(target, level, GL_RGBA8, width, height, 0,
+                             GL_RGBA, GL_UNSIGNED_BYTE, pixels)
+
+            glTexParameteri(target, GL_TEXTURE_BASE_LEVEL, 0)
+
+        glTexParameteri(target, GL_TEXTURE_MAX_LEVEL, len(levels) - 1)
+        glTexParameteri(target, GL_TEXTURE_WRAP_S, GL_REPEAT)
+        glTexParameteri(target, GL_TEXTURE_WRAP_T, GL_REPEAT)
+        glTexParameteri(target, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_LINEAR)
+        glTexParameteri(target, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glBindTexture(target, 0)
+
+
+# The loader shared by all scene objects
+texture_loader = TextureLoader()
@@ -0,0 +1,112 @@
+"""
+texture_manager.py
+
+Contains the TextureManager class, which assigns textures to texture units
+and keeps track of what is bound to each unit.
+"""
+
+from collections import OrderedDict
+from OpenGL.GL import *
+
+# Kept free for creating and uploading textures, so doing so never disturbs
+# the bindings the manager keeps track of
+SCRATCH_UNIT = 0
+
+
+class TextureManager(object):
+    """
+    Owns the texture units. Each texture is given a unit of its own the
+    first time it is bound, and stays bound there, so switching between
+    textures needs no rebinding until there are more textures than units.
+    Then the least recently used texture gives up its unit.
+    """
+
+    def __init__(self):
+        """
+        Constructor. The number of units is queried when first needed, since
+        there may be no OpenGL context yet.
+        """
+        self.targets = {}
+        self.units = OrderedDict()
+        self.bound = {}
+        self.free_units = None
+
+    def register(self, texture, target=GL_TEXTURE_2D):
+        """
+        Records the target of a texture, e.g. GL_TEXTURE_2D_ARRAY for an array
+        texture.
+
+        :param texture: The name of the texture
+        :param target: The target the texture is bound to
+        """
+        self.targets[texture] = target
+
+    def target(self, texture):
+        """
+        :param texture: The name of the texture
+
+        :return: The target the texture is bound to
+        """
+        return self.targets.get(texture, GL_TEXTURE_2D)
+
+    def unit(self, texture):
+        """
+        Returns the texture unit of a texture, assigning one if needed.
+
+        :param texture: The name of the texture
+
+        :return: The index of the texture unit
+        """
+        if texture in self.units:
+            self.units.move_to_end(texture)
+            return self.units[texture]
+
+        # Kept in descending order, so the lowest free unit is popped first
+        if self.free_units is None:
+            unit_count = int(glGetIntegerv(GL_MAX_COMBINED_TEXTURE_IMAGE_UNITS))
+            self.free_units = [unit for unit in range(unit_count - 1, -1, -1)
+                               if unit != SCRATCH_UNIT]
+
+        if self.free_units:
+            unit = self.free_units.pop()
+        else:
+            evicted, unit = self.units.popitem(last=False)
+
+        self.units[texture] = unit
+        return unit
+
+    def bind(self, texture):
+        """
+        Binds a texture to its texture unit, unless it is already bound there.
+
+        :param texture: The name of the texture
+
+        :return: Whether the texture had to be bound
+        """
+        unit = self.unit(texture)
+        if self.bound.get(unit) == texture:
+            return False
+
+        glActiveTexture(GL_TEXTURE0 + unit)
+        glBindTexture(self.target(texture), texture)
+        self.bound[unit] = texture
+        return True
+
+    def delete(self, texture):
+        """
+        Deletes a texture and frees its texture unit.
+
+        :param texture: The name of the texture
+        """
+        unit = self.units.pop(texture, None)
+        if unit is not None:
+            if self.bound.get(unit) == texture:
+                del self.bound[unit]
+            self.free_units.append(unit)
+            self.free_units.sort(reverse=True)
+        self.targets.pop(texture, None)
+        glDeleteTextures([texture])
+
+
+# The manager shared by all scene objects
+texture_manager = TextureManager()
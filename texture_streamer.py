@@ -0,0 +1,225 @@
+"""
+texture_streamer.py
+
+Contains the TextureStreamer class, which uploads the mip chains of textures
+progressively. The smallest levels are uploaded at once, so the texture can
+be drawn straight away, and the larger levels follow in chunks through pixel
+buffer objects over the next frames, within a fixed budget of bytes per
+frame.
+"""
+
+import ctypes
+from OpenGL.GL import *
+from texture_manager import SCRATCH_UNIT
+
+# Bytes uploaded per frame, across all textures
+DEFAULT_BUDGET = 4 << 20
+
+# Levels no larger than this in either dimension are uploaded immediately
+RESIDENT_SIZE = 64
+
+DEFAULT_RING_SIZE = 3
+
+
+class StreamingTexture(object):
+    """
+    The upload progress of one texture. Levels are uploaded from the
+    smallest to the largest, each layer by layer, in chunks of rows.
+    """
+
+    def __init__(self, texture, target, layers, level):
+        """
+        Constructor.
+
+        :param texture: The name of the texture
+        :param target: GL_TEXTURE_2D or GL_TEXTURE_2D_ARRAY
+        :param layers: The mip chain of each layer, in layer order
+        :param level: The largest level still to be uploaded
+        """
+        self.texture = texture
+        self.target = target
+        self.layers = layers
+        self.level = level
+        self.layer = 0
+        self.row = 0
+
+
+class TextureStreamer(object):
+    """
+    Streams textures to the GPU a chunk at a time. Every chunk goes through
+    the next pixel buffer object of a ring, which is orphaned before it is
+    written, so writing never waits for the GPU to finish reading the
+    previous chunk. A texture's base level is lowered each time a larger
+    level is complete, so it is drawn at the best resolution uploaded so far.
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, resident_size=RESIDENT_SIZE,
+                 ring_size=DEFAULT_RING_SIZE):
+        """
+        Constructor. Creates the ring of pixel buffer objects.
+
+        :param budget: The number of bytes to upload per frame
+        :param resident_size: Levels no larger than this in either dimension
+                              are uploaded as soon as a texture is added
+        :param ring_size: The number of pixel buffer objects in the ring
+        """
+        self.budget = budget
+        self.resident_size = resident_size
+        self.textures = []
+        self.next_buffer = 0
+
+        self.pixel_buffers = glGenBuffers(ring_size)
+        if ring_size == 1:
+            self.pixel_buffers = [self.pixel_buffers]
+
+    def __len__(self):
+        return len(self.textures)
+
+    def add(self, texture, target, layers):
+        """
+        Allocates every level of a texture, uploads the smallest levels and
+        queues the rest to be streamed. The texture must be bound to the
+        active texture unit, and is left bound.
+
+        :param texture: The name of the texture
+        :param target: GL_TEXTURE_2D or GL_TEXTURE_2D_ARRAY
+        :param layers: A list with the mip chain of each layer, in layer
+                       order. Each chain is a list of (height, width, 4)
+                       arrays of RGBA bytes, base level first.
+        """
+        levels = layers[0]
+
+        # Allocate storage for all levels, without sending any pixels
+        for level, pixels in enumerate(levels):
+            height, width = pixels.shape[:2]
+            if target == GL_TEXTURE_2D_ARRAY:
+                glTexImage3D(target, level, GL_RGBA8, width, height,
+                             len(layers), 0, GL_RGBA, GL_UNSIGNED_BYTE, None)
+            else:
+                glTexImage2D(target, level, GL_RGBA8, width, height, 0,
+                             GL_RGBA, GL_UNSIGNED_BYTE, None)
+
+        # Upload the small levels directly, largest first
+        resident = len(levels) - 1
+        while resident > 0 and max(levels[resident - 1].shape[:2]) <= self.resident_size:
+            resident -= 1
+
+        for level in range(len(levels) - 1, resident - 1, -1):
+            for index, layer in enumerate(layers):
+                self.upload_rows(target, level, index, 0, layer[level], None)
+
+        glTexParameteri(target, GL_TEXTURE_BASE_LEVEL, resident)
+        if resident > 0:
+            self.textures.append(StreamingTexture(texture, target, layers,
+                                                  resident - 1))
+
+    def update(self):
+        """
+        Uploads the next chunks of the queued textures, up to the budget.
+        Called once per frame. Nothing is bound or unbound once the queue is
+        empty.
+
+        :return: The number of bytes uploaded
+        """
+        if not self.textures:
+            return 0
+
+        # Bind on the scratch unit, to leave the units of the texture manager
+        # as they are
+        glActiveTexture(GL_TEXTURE0 + SCRATCH_UNIT)
+        uploaded = 0
+
+        while self.textures and uploaded < self.budget:
+            streaming = self.textures[0]
+            pixels = streaming.layers[streaming.layer][streaming.level]
+            height, width = pixels.shape[:2]
+
+            row_bytes = width * 4
+            rows = max(1, min(height - streaming.row,
+                              (self.budget - uploaded) // row_bytes))
+            chunk = pixels[streaming.row:streaming.row + rows]
+
+            glBindTexture(streaming.target, streaming.texture)
+            self.upload_chunk(streaming.target, streaming.level,
+                              streaming.layer, streaming.row, chunk)
+            uploaded += chunk.nbytes
+
+            streaming.row += rows
+            if streaming.row < height:
+                continue
+
+            # The layer is done, then the level once all layers are
+            streaming.row = 0
+            streaming.layer += 1
+            if streaming.layer < len(streaming.layers):
+                continue
+
+            streaming.layer = 0
+            glTexParameteri(streaming.target, GL_TEXTURE_BASE_LEVEL,
+                            streaming.level)
+            streaming.level -= 1
+            if streaming.level < 0:
+                self.textures.pop(0)
+
+        glBindTexture(GL_TEXTURE_2D, 0)
+        glBindTexture(GL_TEXTURE_2D_ARRAY, 0)
+        return uploaded
+
+    def upload_chunk(self, target, level, layer, row, chunk):
+        """
+        Copies a chunk of rows into the next pixel buffer object of the ring
+        and uploads it from there to a texture level.
+
+        :param target: GL_TEXTURE_2D or GL_TEXTURE_2D_ARRAY
+        :param level: The mip level being uploaded
+        :param layer: The layer being uploaded, for array textures
+        :param row: The first row of the chunk within the level
+        :param chunk: A (rows, width, 4) array of RGBA bytes
+        """
+        pixel_buffer = self.pixel_buffers[self.next_buffer]
+        self.next_buffer = (self.next_buffer + 1) % len(self.pixel_buffers)
+
+        # Orphan the old storage rather than wait until it has been read
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, pixel_buffer)
+        glBufferData(GL_PIXEL_UNPACK_BUFFER, chunk.nbytes, None, GL_STREAM_DRAW)
+        address = glMapBufferRange(GL_PIXEL_UNPACK_BUFFER, 0, chunk.nbytes,
+                                   GL_MAP_WRITE_BIT | GL_MAP_INVALIDATE_BUFFER_BIT)
+        ctypes.memmove(address, chunk.ctypes.data, chunk.nbytes)
+        glUnmapBuffer(GL_PIXEL_UNPACK_BUFFER)
+
+        self.upload_rows(target, level, layer, row, chunk, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_UNPACK_BUFFER, 0)
+
+    @staticmethod
+    def upload_rows(target, level, layer, row, pixels, source):
+        """
+        Uploads rows of a texture level from client memory or from the bound
+        pixel buffer object.
+
+        :param target: GL_TEXTURE_2D or GL_TEXTURE_2D_ARRAY
+        :param level: The mip level being uploaded
+        :param layer: The layer being uploaded, for array textures
+        :param row: The first row being uploaded within the level
+        :param pixels: A (rows, width, 4) array of RGBA bytes
+        :param source: An offset into the bound pixel buffer object, or None
+                       to upload the pixels from client memory
+        """
+        rows, width = pixels.shape[:2]
+        data = pixels if source is None else source
+
+        glPixelStorei(GL_UNPACK_ALIGNMENT, 1)
+        if target == GL_TEXTURE_2D_ARRAY:
+            glTexSubImage3D(target, level, 0, row, layer, width, rows, 1,
+                            GL_RGBA, GL_UNSIGNED_BYTE, data)
+        else:
+            glTexSubImage2D(target, level, 0, row, width, rows, GL_RGBA,
+                            GL_UNSIGNED_BYTE, data)
+
+    def delete(self):
+        """
+        Frees the pixel buffer objects. Textures still queued are left with
+        the levels uploaded so far.
+        """
+        glDeleteBuffers(len(self.pixel_buffers), self.pixel_buffers)
+        self.pixel_buffers = []
+        self.textures = []
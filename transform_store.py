@@ -0,0 +1,439 @@
+"""
+transform_store.py
+
+Contains the TransformStore class, which keeps the translation, rotation and
+scale of every scene object in contiguous arrays and builds their model
+matrices in one batch.
+"""
+
+import functools
+import math
+import numbers
+import numpy as np
+
+# How far the w component of a rotation may be from +-1 for the rotation to
+# count as the identity, as rotating by a full turn leaves rounding residue
+ROTATION_TOLERANCE = 1e-9
+
+# The number of distinct Euler rotations whose quaternions are kept
+EULER_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=EULER_CACHE_SIZE)
+def euler_rotation(x, y, z):
+    """
+    Returns the quaternion and rotation matrix for a rotation given as Euler
+    angles, applied in the order y -> z -> x as in SceneObject.rotate. The
+    results are cached, as the same rotation is usually applied to many
+    objects one at a time.
+
+    :param x: The rotation angle (in degrees) in the x-direction
+    :param y: The rotation angle (in degrees) in the y-direction
+    :param z: The rotation angle (in degrees) in the z-direction
+
+    :return: A tuple of the (x, y, z, w) quaternion and the rows of the 3x3
+             matrix, as tuples of floats
+    """
+    x, y, z = math.radians(x) / 2, math.radians(y) / 2, math.radians(z) / 2
+
+    q_x = (math.sin(x), 0.0, 0.0, math.cos(x))
+    q_y = (0.0, math.sin(y), 0.0, math.cos(y))
+    q_z = (0.0, 0.0, math.sin(z), math.cos(z))
+
+    q = scalar_quaternion_multiply(q_x, scalar_quaternion_multiply(q_z, q_y))
+    return q, scalar_quaternion_matrix(q)
+
+
+def euler_quaternion(x, y, z):
+    """
+    Returns the quaternion for a rotation given as Euler angles, applied in
+    the order y -> z -> x as in SceneObject.rotate.
+
+    :param x: The rotation angle (in degrees) in the x-direction
+    :param y: The rotation angle (in degrees) in the y-direction
+    :param z: The rotation angle (in degrees) in the z-direction
+
+    :return: A quaternion as an (x, y, z, w) array
+    """
+    return np.array(euler_rotation(x, y, z)[0])
+
+
+def scalar_quaternion_multiply(a, b):
+    """
+    Returns the Hamilton product of two quaternions, like
+    quaternion_multiply, without the overhead of NumPy for single values.
+
+    :param a: An (x, y, z, w) quaternion
+    :param b: An (x, y, z, w) quaternion
+
+    :return: The product as an (x, y, z, w) tuple
+    """
+    a_x, a_y, a_z, a_w = a
+    b_x, b_y, b_z, b_w = b
+
+    return (a_w * b_x + a_x * b_w + a_y * b_z - a_z * b_y,
+            a_w * b_y - a_x * b_z + a_y * b_w + a_z * b_x,
+            a_w * b_z + a_x * b_y - a_y * b_x + a_z * b_w,
+            a_w * b_w - a_x * b_x - a_y * b_y - a_z * b_z)
+
+
+def scalar_quaternion_matrix(q):
+    """
+    Returns the rotation matrix of a unit quaternion, like quaternion_matrix,
+    without the overhead of NumPy for single values.
+
+    :param q: An (x, y, z, w) quaternion
+
+    :return: The rows of the 3x3 matrix, as tuples
+    """
+    x, y, z, w = q
+
+    return ((1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)),
+            (2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)),
+            (2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)))
+
+
+def quaternion_multiply(a, b):
+    """
+    Returns the Hamilton product of two quaternions or arrays of quaternions.
+    The result represents the rotation b followed by the rotation a.
+
+    :param a: An (..., 4) array of (x, y, z, w) quaternions
+    :param b: An (..., 4) array of (x, y, z, w) quaternions
+
+    :return: An (..., 4) array of (x, y, z, w) quaternions
+    """
+    a_x, a_y, a_z, a_w = np.moveaxis(np.asarray(a), -1, 0)
+    b_x, b_y, b_z, b_w = np.moveaxis(np.asarray(b), -1, 0)
+
+    return np.stack([a_w * b_x + a_x * b_w + a_y * b_z - a_z * b_y,
+                     a_w * b_y - a_x * b_z + a_y * b_w + a_z * b_x,
+                     a_w * b_z + a_x * b_y - a_y * b_x + a_z * b_w,
+                     a_w * b_w - a_x * b_x - a_y * b_y - a_z * b_z], axis=-1)
+
+
+def quaternion_matrix(q):
+    """
+    Returns the rotation matrices of unit quaternions.
+
+    :param q: An (..., 4) array of (x, y, z, w) quaternions
+
+    :return: An (..., 3, 3) array of rotation matrices
+    """
+    x, y, z, w = np.moveaxis(np.asarray(q), -1, 0)
+
+    return np.stack([
+        np.stack([1 - 2 * (y * y + z * z), 2 * (x * y - z * w), 2 * (x * z + y * w)], axis=-1),
+        np.stack([2 * (x * y + z * w), 1 - 2 * (x * x + z * z), 2 * (y * z - x * w)], axis=-1),
+        np.stack([2 * (x * z - y * w), 2 * (y * z + x * w), 1 - 2 * (x * x + y * y)], axis=-1),
+    ], axis=-2)
+
+
+class TransformStore(object):
+    """
+    The translation, rotation (as a quaternion) and scale of a set of
+    objects, each stored in one contiguous array. Objects refer to their
+    transform by index. Model matrices are rebuilt from these values in a
+    single batched operation whenever they are read after a change, so
+    rounding errors never accumulate in the matrices themselves.
+
+    A non-uniform scale applied to a rotated object shears it, which a
+    rotation and scale cannot represent. Such objects keep a general 3x3
+    matrix in place of their rotation and scale from then on.
+    """
+
+    def __init__(self, capacity=64):
+        """
+        Constructor. Allocates storage for a number of objects.
+
+        :param capacity: The number of objects to allocate storage for. The
+                         store grows as needed.
+        """
+        self.count = 0
+        self.translation = np.zeros((capacity, 3))
+        self.rotation = np.tile([0.0, 0.0, 0.0, 1.0], (capacity, 1))
+        self.scale_factors = np.ones((capacity, 3))
+        self.linear = np.zeros((capacity, 3, 3))
+        self.sheared = np.zeros(capacity, dtype=bool)
+        self.world = np.empty((0, 4, 4), dtype=np.float32)
+        self.dirty = True
+
+    def __len__(self):
+        return self.count
+
+    def allocate(self, count=1):
+        """
+        Adds transforms for a number of objects, initialised to the identity.
+
+        :param count: The number of transforms to add
+
+        :return: An array of the indices of the new transforms
+        """
+        start = self.count
+        self.count += count
+
+        capacity = len(self.translation)
+        if self.count > capacity:
+            capacity = max(self.count, 2 * capacity)
+            self.translation = self.resize(self.translation, capacity, 0.0)
+            self.rotation = self.resize(self.rotation, capacity,
+                                        [0.0, 0.0, 0.0, 1.0])
+            self.scale_factors = self.resize(self.scale_factors, capacity, 1.0)
+            self.linear = self.resize(self.linear, capacity, 0.0)
+            self.sheared = self.resize(self.sheared, capacity, False)
+
+        # Storage may hold the values of cleared transforms
+        self.translation[start:self.count] = 0.0
+        self.rotation[start:self.count] = [0.0, 0.0, 0.0, 1.0]
+        self.scale_factors[start:self.count] = 1.0
+        self.sheared[start:self.count] = False
+
+        self.dirty = True
+        return np.arange(start, self.count)
+
+    def clear(self):
+        """
+        Removes all transforms, keeping the allocated storage. Objects holding
+        indices into the store must not be used afterwards.
+        """
+        self.count = 0
+        self.dirty = True
+
+    @staticmethod
+    def resize(array, capacity, fill):
+        """
+        Returns a copy of an array with more rows, the new rows set to a fill
+        value.
+
+        :param array: The array to be resized
+        :param capacity: The new number of rows
+        :param fill: The value of the new rows
+
+        :return: The resized array
+        """
+        resized = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+        resized[:len(array)] = array
+        resized[len(array):] = fill
+        return resized
+
+    def select(self, indices):
+        """
+        Returns an index usable on the storage arrays for a selection of
+        objects.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+
+        :return: The selection as an index, array or slice
+        """
+        return slice(0, self.count) if indices is None else indices
+
+    def rows(self, indices):
+        """
+        Returns the indices of a selection of objects as an array.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+
+        :return: A 1D array of indices
+        """
+        return np.atleast_1d(np.arange(self.count)[self.select(indices)])
+
+    def linear_matrices(self, rows):
+        """
+        Returns the 3x3 rotation and scale part of the model matrices of a
+        set of objects.
+
+        :param rows: A 1D array of indices
+
+        :return: An (N, 3, 3) array
+        """
+        linear = (quaternion_matrix(self.rotation[rows])
+                  * self.scale_factors[rows, np.newaxis, :])
+        sheared = self.sheared[rows]
+        linear[sheared] = self.linear[rows[sheared]]
+        return linear
+
+    def scale(self, indices, x, y, z):
+        """
+        Scales a selection of objects about the origin, as if the scale was
+        applied after their current transform. Rotated objects given a
+        non-uniform scale are sheared, and keep a general 3x3 matrix.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+        :param x: The scale value in the x-direction
+        :param y: The scale value in the y-direction
+        :param z: The scale value in the z-direction
+        """
+        if isinstance(indices, numbers.Integral):
+            self.scale_one(indices, x, y, z)
+            return
+
+        selection = self.select(indices)
+        factors = np.array([x, y, z], dtype=np.float64)
+
+        if not (x == y == z):
+            rows = self.rows(selection)
+
+            # A quaternion with w of +-1 is the identity rotation, however it
+            # was reached
+            rotated = 1.0 - np.abs(self.rotation[rows, 3]) > ROTATION_TOLERANCE
+            shearing = rows[rotated & ~self.sheared[rows]]
+            self.linear[shearing] = self.linear_matrices(shearing)
+            self.sheared[shearing] = True
+
+        sheared = self.rows(selection)
+        sheared = sheared[self.sheared[sheared]]
+        self.linear[sheared] *= factors[:, np.newaxis]
+
+        self.translation[selection] *= factors
+        self.scale_factors[selection] *= factors
+        self.dirty = True
+
+    def rotate(self, indices, x, y, z):
+        """
+        Rotates a selection of objects about the origin, as if the rotation
+        was applied after their current transform. The order of rotation is
+        y -> z -> x.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+        :param x: The rotation angle (in degrees) in the x-direction
+        :param y: The rotation angle (in degrees) in the y-direction
+        :param z: The rotation angle (in degrees) in the z-direction
+        """
+        if isinstance(indices, numbers.Integral):
+            self.rotate_one(indices, x, y, z)
+            return
+
+        selection = self.select(indices)
+        q = euler_quaternion(x, y, z)
+
+        rotation = quaternion_multiply(q, self.rotation[selection])
+        rotation /= np.linalg.norm(rotation, axis=-1, keepdims=True)
+
+        self.rotation[selection] = rotation
+        matrix = quaternion_matrix(q)
+        self.translation[selection] = self.translation[selection] @ matrix.T
+
+        sheared = self.rows(selection)
+        sheared = sheared[self.sheared[sheared]]
+        self.linear[sheared] = matrix @ self.linear[sheared]
+        self.dirty = True
+
+    def translate(self, indices, x, y, z):
+        """
+        Translates a selection of objects.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+        :param x: The translation value in the x-direction
+        :param y: The translation value in the y-direction
+        :param z: The translation value in the z-direction
+        """
+        if isinstance(indices, numbers.Integral):
+            t_x, t_y, t_z = self.translation[indices].tolist()
+            self.translation[indices] = (t_x + x, t_y + y, t_z + z)
+        else:
+            self.translation[self.select(indices)] += [x, y, z]
+        self.dirty = True
+
+    def scale_one(self, index, x, y, z):
+        """
+        Scales a single object like scale, reading and writing its values as
+        Python floats, which is several times faster than indexing the arrays
+        with NumPy for one object.
+
+        :param index: The index of the object
+        :param x: The scale value in the x-direction
+        :param y: The scale value in the y-direction
+        :param z: The scale value in the z-direction
+        """
+        sheared = self.sheared[index]
+        if not sheared and not (x == y == z) and \
+                1.0 - abs(self.rotation[index, 3]) > ROTATION_TOLERANCE:
+            self.linear[index] = self.linear_matrices(np.array([index]))[0]
+            self.sheared[index] = sheared = True
+
+        if sheared:
+            self.linear[index] *= ((x,), (y,), (z,))
+
+        t_x, t_y, t_z = self.translation[index].tolist()
+        s_x, s_y, s_z = self.scale_factors[index].tolist()
+        self.translation[index] = (t_x * x, t_y * y, t_z * z)
+        self.scale_factors[index] = (s_x * x, s_y * y, s_z * z)
+        self.dirty = True
+
+    def rotate_one(self, index, x, y, z):
+        """
+        Rotates a single object like rotate, with the rotation computed in
+        Python floats and cached across calls with the same angles.
+
+        :param index: The index of the object
+        :param x: The rotation angle (in degrees) in the x-direction
+        :param y: The rotation angle (in degrees) in the y-direction
+        :param z: The rotation angle (in degrees) in the z-direction
+        """
+        q, matrix = euler_rotation(x, y, z)
+
+        rotation = scalar_quaternion_multiply(q, self.rotation[index].tolist())
+        norm = math.sqrt(sum(component * component for component in rotation))
+        self.rotation[index] = [component / norm for component in rotation]
+
+        t_x, t_y, t_z = self.translation[index].tolist()
+        self.translation[index] = [row[0] * t_x + row[1] * t_y + row[2] * t_z
+                                   for row in matrix]
+
+        if self.sheared[index]:
+            self.linear[index] = np.array(matrix) @ self.linear[index]
+        self.dirty = True
+
+    def set(self, indices, translation, rotation, scale_factors):
+        """
+        Replaces the transforms of a selection of objects. Unlike scale,
+        rotate and translate, the values are not combined with the current
+        transforms, so any scale can be given with any rotation. Any shear
+        of the objects is dropped.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+        :param translation: An (N, 3) array of translations
+        :param rotation: An (N, 4) array of (x, y, z, w) quaternions
+        :param scale_factors: An (N, 3) array of scale factors
+        """
+        selection = self.select(indices)
+        rotation = np.asarray(rotation, dtype=np.float64)
+
+        self.translation[selection] = translation
+        self.rotation[selection] = rotation / np.linalg.norm(rotation, axis=-1,
+                                                             keepdims=True)
+        self.scale_factors[selection] = scale_factors
+        self.sheared[selection] = False
+        self.dirty = True
+
+    def matrices(self, indices=None):
+        """
+        Returns the model matrices of a selection of objects, rebuilding the
+        matrices of all objects first if any transform has changed.
+
+        :param indices: An index, array of indices or slice, or None for all
+                        objects
+
+        :return: An (N, 4, 4) array, or a single 4x4 matrix for one index
+        """
+        if self.dirty or len(self.world) != self.count:
+            count = self.count
+            world = np.zeros((count, 4, 4))
+            world[:, :3, :3] = self.linear_matrices(np.arange(count))
+            world[:, :3, 3] = self.translation[:count]
+            world[:, 3, 3] = 1.0
+
+            self.world = world.astype(np.float32)
+            self.dirty = False
+
+        return self.world[self.select(indices)]
+
+
+# The store shared by all scene objects
+transform_store = TransformStore()
@@ -0,0 +1,270 @@
+"""
+turntable.py
+
+Contains the Turntable class, which renders a full rotation of the scene
+offscreen as a numbered sequence of image files.
+
+Frames are read back through a ring of pixel buffer objects, so glReadPixels
+returns without waiting for the frame to finish, and are encoded on a pool of
+worker threads. Rendering, transfer and encoding of different frames overlap.
+
+    python turntable.py [--frames N] [--size WIDTHxHEIGHT] [--format png|raw]
+                        [--workers N] [--instanced] [--stream-textures]
+                        [--occlusion-culling] [--scene PATH]
+                        [--profile PATH] output_directory
+"""
+
+# Must be imported before OpenGL so the offscreen platform is selected
+from headless import HeadlessContext, parse_size, DEFAULT_WIDTH, DEFAULT_HEIGHT
+
+import argparse
+import ctypes
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from OpenGL.GL import *
+
+DEFAULT_FRAMES = 180
+DEFAULT_RING_SIZE = 3
+DEFAULT_WORKERS = 4
+
+FORMATS = ('png', 'raw')
+
+
+def encode_frame(pixels, width, height, path, image_format):
+    """
+    Flips a frame read back from OpenGL to top row first and writes it to a
+    file. Runs on a worker thread.
+
+    :param pixels: The RGB bytes of the frame, bottom row first
+    :param width: The width of the frame in pixels
+    :param height: The height of the frame in pixels
+    :param path: The path of the file to write
+    :param image_format: 'png' for a PNG image, or 'raw' for the bare RGB bytes
+    """
+    frame = np.frombuffer(pixels, dtype=np.uint8).reshape((height, width, 3))[::-1]
+
+    if image_format == 'png':
+        from PIL import Image
+        Image.fromarray(frame).save(path)
+    else:
+        with open(path, 'wb') as raw_file:
+            raw_file.write(frame.tobytes())
+
+
+class Turntable(object):
+    """
+    Renders the scene rotating about the vertical axis in equal steps. Each
+    frame is read into the next pixel buffer object of a ring, and a buffer
+    is only mapped once the frame read into it a full ring earlier has been
+    signalled complete by its fence.
+    """
+    context = None
+    scene = None
+    executor = None
+
+    def __init__(self, context, scene, ring_size=DEFAULT_RING_SIZE,
+                 workers=DEFAULT_WORKERS):
+        """
+        Constructor. Creates the ring of pixel buffer objects.
+
+        :param context: The HeadlessContext the scene is drawn in
+        :param scene: The Scene to be rendered
+        :param ring_size: The number of frames that may be in flight between
+                          rendering and readback
+        :param workers: The number of threads encoding frames
+        """
+        self.context = context
+        self.scene = scene
+        self.frame_bytes = context.width * context.height * 3
+        self.workers = workers
+
+        self.pixel_buffers = glGenBuffers(ring_size)
+        if ring_size == 1:
+            self.pixel_buffers = [self.pixel_buffers]
+        for pixel_buffer in self.pixel_buffers:
+            glBindBuffer(GL_PIXEL_PACK_BUFFER, pixel_buffer)
+            glBufferData(GL_PIXEL_PACK_BUFFER, self.frame_bytes, None,
+                         GL_STREAM_READ)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        # The fence and file path of the frame pending in each buffer
+        self.pending = [None] * ring_size
+
+    def render(self, directory, frames=DEFAULT_FRAMES, image_format='png'):
+        """
+        Renders a full rotation and writes each frame to a numbered file.
+
+        :param directory: The directory the frames are written to
+        :param frames: The number of frames in the rotation, at least one
+        :param image_format: 'png' for PNG images, or 'raw' for bare RGB bytes
+
+        :return: The paths of the written frames, in order
+        """
+        if image_format not in FORMATS:
+            raise ValueError('Unknown frame format {}'.format(image_format))
+        if frames < 1:
+            raise ValueError('A rotation needs at least one frame')
+
+        os.makedirs(directory, exist_ok=True)
+        angle = 360.0 / frames
+        paths = []
+        futures = []
+
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+        try:
+            for frame in range(frames):
+                path = os.path.join(directory, 'frame_{:04d}.{}'.format(frame, image_format))
+                paths.append(path)
+
+                slot = frame % len(self.pixel_buffers)
+                if self.pending[slot] is not None:
+                    futures.append(self.collect(slot, image_format))
+
+                profiler = self.scene.profiler
+                if profiler is not None:
+                    profiler.begin_frame()
+
+                glBindFramebuffer(GL_FRAMEBUFFER, self.context.framebuffer)
+                self.scene.display()
+
+                if profiler is not None:
+                    profiler.begin('readback')
+                self.read(slot, path)
+                if profiler is not None:
+                    profiler.end()
+                    profiler.end_frame()
+
+                self.scene.rotate(angle)
+
+            # Drain the frames still in flight, oldest first
+            for offset in range(len(self.pixel_buffers)):
+                slot = (frames + offset) % len(self.pixel_buffers)
+                if self.pending[slot] is not None:
+                    futures.append(self.collect(slot, image_format))
+
+            for future in futures:
+                future.result()
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+
+        return paths
+
+    def read(self, slot, path):
+        """
+        Starts an asynchronous read of the framebuffer into a buffer of the
+        ring and fences it.
+
+        :param slot: The index of the buffer in the ring
+        :param path: The path the frame will be written to
+        """
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pixel_buffers[slot])
+        glReadPixels(0, 0, self.context.width, self.context.height, GL_RGB,
+                     GL_UNSIGNED_BYTE, ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0)
+        self.pending[slot] = (fence, path)
+
+    def collect(self, slot, image_format):
+        """
+        Waits for the read into a buffer of the ring to complete, copies the
+        frame out of it and hands it to the encoding workers.
+
+        :param slot: The index of the buffer in the ring
+        :param image_format: 'png' for a PNG image, or 'raw' for bare RGB bytes
+
+        :return: The Future of the encoding job
+        """
+        fence, path = self.pending[slot]
+        glClientWaitSync(fence, GL_SYNC_FLUSH_COMMANDS_BIT, GL_TIMEOUT_IGNORED)
+        glDeleteSync(fence)
+        self.pending[slot] = None
+
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, self.pixel_buffers[slot])
+        address = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, self.frame_bytes,
+                                   GL_MAP_READ_BIT)
+        pixels = ctypes.string_at(address, self.frame_bytes)
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+
+        return self.executor.submit(encode_frame, pixels, self.context.width,
+                                    self.context.height, path, image_format)
+
+    def delete(self):
+        """
+        Frees the pixel buffer objects.
+        """
+        glDeleteBuffers(len(self.pixel_buffers), self.pixel_buffers)
+        self.pixel_buffers = []
+
+
+
+def parse_count(text):
+    """
+    Parses a count that must be at least one, for argparse.
+
+    :param text: The count, e.g. "36"
+
+    :return: The count as an integer
+    """
+    count = int(text)
+    if count < 1:
+        raise argparse.ArgumentTypeError('must be at least 1, not {}'.format(
+            count))
+    return count
+
+
+if __name__ == "__main__":
+    from scene import Scene, DEFAULT_SCENE_PATH
+    from profiler import Profiler
+
+    parser = argparse.ArgumentParser(description='Render a full rotation of '
+                                                 'the scene offscreen.')
+    parser.add_argument('output', help='the directory to write frames to')
+    parser.add_argument('--frames', type=parse_count, default=DEFAULT_FRAMES,
+                        help='the number of frames in the rotation')
+    parser.add_argument('--size', type=parse_size,
+                        default=(DEFAULT_WIDTH, DEFAULT_HEIGHT),
+                        help='the frame size as WIDTHxHEIGHT')
+    parser.add_argument('--format', choices=FORMATS, default='png',
+                        help='the format of the frame files')
+    parser.add_argument('--workers', type=parse_count, default=DEFAULT_WORKERS,
+                        help='the number of threads encoding frames')
+    parser.add_argument('--instanced', action='store_true',
+                        help='draw repeated meshes with instancing')
+    parser.add_argument('--stream-textures', action='store_true',
+                        help='upload large textures progressively')
+    parser.add_argument('--occlusion-culling', action='store_true',
+                        help='skip objects hidden behind the stones')
+    parser.add_argument('--scene', default=DEFAULT_SCENE_PATH, metavar='PATH',
+                        help='the scene file to render (see henge.py)')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='time every frame and write PATH.json (a Chrome '
+                             'trace) and PATH.csv')
+    args = parser.parse_args()
+
+    headless_context = HeadlessContext(*args.size)
+    scene = Scene(args.instanced, args.stream_textures, args.occlusion_culling,
+                  args.scene)
+    if args.profile:
+        scene.profiler = Profiler()
+    turntable = Turntable(headless_context, scene, workers=args.workers)
+
+    start = time.perf_counter()
+    turntable.render(args.output, args.frames, args.format)
+    elapsed = time.perf_counter() - start
+    print('{} frames in {:.2f} s ({:.1f} fps)'.format(args.frames, elapsed,
+                                                     args.frames / elapsed))
+
+    if args.profile:
+        scene.profiler.write_chrome_trace(args.profile + '.json')
+        scene.profiler.write_csv(args.profile + '.csv')
+        scene.profiler.delete()
+
+    turntable.delete()
+    scene.close()
+    headless_context.close()
@@ -0,0 +1,111 @@
+"""
+uniform_buffer.py
+
+Contains the FrameUniforms class, which keeps the camera and light state in a
+uniform buffer object shared by every shader program in the scene.
+"""
+
+import numpy as np
+from OpenGL.GL import *
+
+# Must match the FrameUniforms block declared in the shaders
+BLOCK_NAME = "FrameUniforms"
+BINDING = 0
+
+# Offsets (in floats) of the block members under the std140 layout rules.
+# Every vec3 is aligned to, and padded out to, 16 bytes.
+VIEW_OFFSET = 0
+PROJECTION_OFFSET = 16
+LIGHT_POSITION_CAM_OFFSET = 32
+AMBIENT_OFFSET = 36
+DIFFUSE_OFFSET = 40
+SPECULAR_OFFSET = 44
+BLOCK_FLOATS = 48
+
+
+def pack_block(camera, light, data=None):
+    """
+    Packs the camera and light state into the std140 layout of the
+    FrameUniforms block.
+
+    :param camera: The Camera of the scene
+    :param light: The Light of the scene
+    :param data: A float32 array of BLOCK_FLOATS values to pack into, or
+                 None for a new one
+
+    :return: The packed array
+    """
+    if data is None:
+        data = np.zeros(BLOCK_FLOATS, dtype=np.float32)
+
+    view = camera.view_matrix()
+
+    # Only the rotation of the view is applied to the light
+    light_position_cam = view.reshape((4, 4)).T[:3, :3] @ light.position
+
+    data[VIEW_OFFSET:VIEW_OFFSET + 16] = view
+    data[PROJECTION_OFFSET:PROJECTION_OFFSET + 16] = camera.projection_matrix()
+    data[LIGHT_POSITION_CAM_OFFSET:LIGHT_POSITION_CAM_OFFSET + 3] = light_position_cam
+    data[AMBIENT_OFFSET:AMBIENT_OFFSET + 3] = light.ambient
+    data[DIFFUSE_OFFSET:DIFFUSE_OFFSET + 3] = light.diffuse
+    data[SPECULAR_OFFSET:SPECULAR_OFFSET + 3] = light.specular
+    return data
+
+
+class FrameUniforms(object):
+    """
+    The view and projection matrices and the light position (in camera
+    space) and intensities, packed into a std140 uniform block. The block is
+    written once per frame and read by every program bound to it, so adding
+    programs adds no per-frame uploads.
+    """
+
+    def __init__(self):
+        """
+        Constructor. Creates the uniform buffer and attaches it to its binding
+        point.
+        """
+        self.data = np.zeros(BLOCK_FLOATS, dtype=np.float32)
+        self.uploaded = None
+
+        self.buffer = glGenBuffers(1)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferData(GL_UNIFORM_BUFFER, self.data.nbytes, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+        glBindBufferBase(GL_UNIFORM_BUFFER, BINDING, self.buffer)
+
+    def bind(self, shader_program):
+        """
+        Connects the FrameUniforms block of a shader program to the buffer.
+
+        :param shader_program: The ShaderProgram reading the block
+        """
+        shader_program.bind_uniform_block(BLOCK_NAME, BINDING)
+
+    def update(self, camera, light):
+        """
+        Packs the current camera and light state into the block and uploads
+        it, unless it is unchanged since the last upload.
+
+        :param camera: The Camera of the scene
+        :param light: The Light of the scene
+        """
+        packed = pack_block(camera, light, self.data).tobytes()
+        if packed == self.uploaded:
+            return
+
+        glBindBuffer(GL_UNIFORM_BUFFER, self.buffer)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.data.nbytes, self.data)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+        self.uploaded = packed
+
+    def delete(self):
+        """
+        Frees the uniform buffer, detaching it from its binding point first.
+        """
+        if self.buffer:
+            glBindBufferBase(GL_UNIFORM_BUFFER, BINDING, 0)
+            glDeleteBuffers(1, [self.buffer])
+            self.buffer = 0
+            self.uploaded = None
@@ -0,0 +1,213 @@
+"""
+window.py
+
+Contains the Window class, which displays the scene in an interactive GLUT
+window and handles user input.
+"""
+
+import sys
+import time
+from OpenGL.GL import *
+from OpenGL.GLUT import *
+from scene import Scene, DEFAULT_SCENE_PATH
+from profiler import Profiler
+
+WINDOW_WIDTH = 768
+WINDOW_HEIGHT = 768
+
+# Degrees per second each held key rotates the scene by, clockwise positive
+ROTATION_KEYS = {'a': 60.0, 'd': -60.0}
+
+# The simulation advances in fixed steps of this many seconds, checked by a
+# timer running every TICK_MILLISECONDS while a key is held
+SIMULATION_STEP = 1.0 / 120.0
+TICK_MILLISECONDS = 8
+
+# Limits the catch-up after a stall, e.g. while the window is being dragged
+MAX_STEPS_PER_TICK = 30
+
+class Window(object):
+    """
+    A GLUT window showing the scene. Creates the OpenGL context, builds the
+    scene in it and runs the GLUT event loop.
+
+    Held keys are tracked rather than acted on per key event, and rotate the
+    scene by the time they are held for, advanced in fixed simulation steps.
+    Redraws are requested with glutPostRedisplay, which GLUT merges into at
+    most one per pass of its loop, and the timer only runs while a key is
+    held. While textures are streamed, every frame requests the next one, so
+    the uploads keep going. Otherwise an idle window uses no CPU.
+    """
+    scene = None
+    profile_path = None
+
+    keys_down = set()
+    ticking = False
+    last_tick = 0.0
+    accumulator = 0.0
+
+    def __init__(self, instanced=False, profile_path=None,
+                 stream_textures=False, occlusion_culling=False,
+                 scene_path=DEFAULT_SCENE_PATH):
+        """
+        Constructor. Opens the window and enters the event loop.
+
+        :param instanced: Whether stones and boulders sharing a mesh are drawn
+                          with a single instanced draw call
+        :param profile_path: If given, every frame is profiled, and a Chrome
+                             trace and CSV summary are written to this path
+                             (with .json and .csv appended) on quitting
+        :param stream_textures: Whether the larger mip levels of textures are
+                                uploaded over several frames
+        :param occlusion_culling: Whether objects hidden behind the stones are
+                                  culled before drawing
+        :param scene_path: The path of the scene file holding the stones and
+                           boulders
+        """
+        self.init_glut()
+        self.scene = Scene(instanced, stream_textures, occlusion_culling,
+                           scene_path)
+        self.keys_down = set()
+
+        if profile_path is not None:
+            self.profile_path = profile_path
+            self.scene.profiler = Profiler()
+
+        glutDisplayFunc(self.display)
+        glutKeyboardFunc(self.handle_key)
+        glutKeyboardUpFunc(self.handle_key_up)
+
+        # Held keys are tracked through key up events instead of repeats
+        glutIgnoreKeyRepeat(1)
+
+        glutMainLoop()
+
+    @staticmethod
+    def init_glut():
+        """
+        Sets up the OpenGL context using GLUT.
+        """
+        glutInit()
+        glutInitDisplayMode(GLUT_RGBA | GLUT_ALPHA | GLUT_DOUBLE | GLUT_DEPTH
+                            | GLUT_3_2_CORE_PROFILE)
+        glutInitWindowSize(WINDOW_WIDTH, WINDOW_HEIGHT)
+        glutCreateWindow(b"Final Project - Stonehenge")
+
+    def display(self):
+        """
+        Draws the scene and shows it in the window, then requests another
+        frame if textures are still loading.
+        """
+        profiler = self.scene.profiler
+        if profiler is not None:
+            profiler.begin_frame()
+
+        self.scene.display()
+
+        if profiler is not None:
+            profiler.begin('swap')
+        glutSwapBuffers()
+        if profiler is not None:
+            profiler.end()
+            profiler.end_frame()
+
+        if self.scene.loading_textures():
+            glutPostRedisplay()
+
+    def handle_key(self, *args):
+        """
+        Handles user input to start rotating the scene, print the render
+        statistics of the last frame, or quit.
+
+        :param *args: User input parameters passed by GLUT
+        """
+        key = args[0].decode()
+
+        # Rotate the scene clockwise (a) or counter-clockwise (d) while held
+        if key in ROTATION_KEYS:
+            self.keys_down.add(key)
+            self.start_ticking()
+
+        # Print the culling, detail levels, state changes and draws of the
+        # last frame
+        elif key == 's':
+            print(self.scene.culler)
+            if self.scene.occlusion_culler is not None:
+                print(self.scene.occlusion_culler)
+            print(self.scene.lod_selector)
+            print(self.scene.render_queue.stats)
+
+        # Close the window
+        elif key == 'q':
+            if self.scene.profiler is not None:
+                self.scene.profiler.write_chrome_trace(self.profile_path + '.json')
+                self.scene.profiler.write_csv(self.profile_path + '.csv')
+            sys.exit(0)
+
+    def handle_key_up(self, *args):
+        """
+        Handles the release of a key, stopping any rotation it drives.
+
+        :param *args: User input parameters passed by GLUT
+        """
+        self.keys_down.discard(args[0].decode())
+
+    def start_ticking(self):
+        """
+        Starts the simulation timer, unless it is already running.
+        """
+        if self.ticking:
+            return
+
+        self.ticking = True
+        self.last_tick = time.perf_counter()
+        self.accumulator = 0.0
+        glutTimerFunc(TICK_MILLISECONDS, self.tick, 0)
+
+    def tick(self, value):
+        """
+        Advances the simulation by the time elapsed since the last tick, in
+        whole fixed steps, and requests a redraw if anything moved. The timer
+        is rescheduled only while a key is held.
+
+        :param value: The value passed to glutTimerFunc, unused
+        """
+        now = time.perf_counter()
+        self.accumulator += now - self.last_tick
+        self.last_tick = now
+
+        steps = min(int(self.accumulator / SIMULATION_STEP), MAX_STEPS_PER_TICK)
+        self.accumulator = min(self.accumulator - steps * SIMULATION_STEP,
+                               SIMULATION_STEP)
+
+        # Rotation is linear in time, so the steps of a tick are applied at
+        # once
+        speed = sum(ROTATION_KEYS[key] for key in self.keys_down)
+        if steps > 0 and speed != 0.0:
+            self.scene.rotate(speed * steps * SIMULATION_STEP)
+            glutPostRedisplay()
+
+        if self.keys_down:
+            glutTimerFunc(TICK_MILLISECONDS, self.tick, 0)
+        else:
+            self.ticking = False
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Show the scene in a window.')
+    parser.add_argument('--instanced', action='store_true',
+                        help='draw repeated meshes with instancing')
+    parser.add_argument('--profile', metavar='PATH',
+                        help='time every frame and write PATH.json (a Chrome '
+                             'trace) and PATH.csv on quitting with q')
+    parser.add_argument('--stream-textures', action='store_true',
+                        help='upload large textures progressively')
+    parser.add_argument('--occlusion-culling', action='store_true',
+                        help='skip objects hidden behind the stones')
+    parser.add_argument('--scene', default=DEFAULT_SCENE_PATH, metavar='PATH',
+                        help='the scene file to show (see henge.py)')
+    args = parser.parse_args()
+
+    Window(args.instanced, args.profile, args.stream_textures,
+           args.occlusion_culling, args.scene)